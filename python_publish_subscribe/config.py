@@ -22,6 +22,18 @@ class Config:
             'PUBLISH_TOPICS': {},
             'SUBSCRIPTION_TOPICS': {},
             'DEFAULT_TIMEOUT': 10,
+            'SHUTDOWN_TIMEOUT': 30,
+            'PUBLISH_BATCH_MAX_MESSAGES': 100,
+            'PUBLISH_BATCH_MAX_LATENCY': 0.01,
+            'STATE_STORE_PATH': '.state',
+            'STATE_CHECKPOINT_INTERVAL': 5,
+            'METRICS_PORT': None,
+            'METRICS_HOST': '0.0.0.0',
+            'PROFILE_PATH': '.profiles',
+            'LEDGER_RETENTION': 604800,
+            'LEDGER_PRUNE_INTERVAL': 3600,
+            'TOPOLOGY_CACHE_PATH': '.topology.json',
+            'TOPOLOGY_MAX_WORKERS': 10,
             'PROJECT_ID': '',
             'DATABASE_URL': '',
             'DATABASE_DIALECT': '',
@@ -30,6 +42,17 @@ class Config:
             'DATABASE_PASSWORD': '',
             'DATABASE_PORT': '',
             'DATABASE_HOST': '',
+            'DATABASE_POOL_SIZE': None,
+            'DATABASE_MAX_OVERFLOW': None,
+            'DATABASE_POOL_RECYCLE': None,
+            'DATABASE_POOL_PRE_PING': None,
+            'DATABASE_POOL_TIMEOUT': None,
+            'DATABASE_ECHO': None,
+            'DATABASE_REPLICA_URLS': [],
+            'DATABASE_REPLICA_CHECK_INTERVAL': 30,
+            'DATABASE_ENGINES': {},
+            'AUTOMAP_CACHE_PATH': '.automap',
+            'DATABASE_OFFLOAD_WORKERS': 10,
         }
 
         if default_config is None:
@@ -128,6 +151,29 @@ class Config:
         DATABASE_PASSWORD = 9
         DATABASE_HOST = 10
         DATABASE_PORT = 11
+        SHUTDOWN_TIMEOUT = 12
+        PUBLISH_BATCH_MAX_MESSAGES = 13
+        PUBLISH_BATCH_MAX_LATENCY = 14
+        STATE_STORE_PATH = 15
+        STATE_CHECKPOINT_INTERVAL = 16
+        METRICS_PORT = 17
+        METRICS_HOST = 18
+        PROFILE_PATH = 19
+        LEDGER_RETENTION = 20
+        LEDGER_PRUNE_INTERVAL = 21
+        TOPOLOGY_CACHE_PATH = 22
+        TOPOLOGY_MAX_WORKERS = 23
+        DATABASE_POOL_SIZE = 24
+        DATABASE_MAX_OVERFLOW = 25
+        DATABASE_POOL_RECYCLE = 26
+        DATABASE_POOL_PRE_PING = 27
+        DATABASE_POOL_TIMEOUT = 28
+        DATABASE_ECHO = 29
+        DATABASE_REPLICA_URLS = 30
+        DATABASE_REPLICA_CHECK_INTERVAL = 31
+        DATABASE_ENGINES = 32
+        AUTOMAP_CACHE_PATH = 33
+        DATABASE_OFFLOAD_WORKERS = 34
 
 DEFAULT_CONFIG = {
    # Config.ConfigKeys.SUBSCRIPTION_TOPICS : {}
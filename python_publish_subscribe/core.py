@@ -1,16 +1,23 @@
 import asyncio
 import json
+from datetime import datetime
 from threading import Thread
 from time import sleep
-from typing import Any, Optional
+from typing import Any, Optional, Callable, List, Type
 
 from google.api_core.exceptions import InvalidArgument
 from google.api_core.retry import Retry
 from google.pubsub_v1 import Subscription
 
 from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.Metrics import metrics, serve_metrics, monitor_loop_lag
+from python_publish_subscribe.src.Pipeline import Pipeline
 from python_publish_subscribe.src.Publisher import Publisher
+from python_publish_subscribe.src.Replay import Replay
 from python_publish_subscribe.src.Subscriber import Subscriber
+from python_publish_subscribe.src.Topology import Topology
+from python_publish_subscribe.src.Window import WindowAggregator, TumblingWindow, SlidingWindow, SessionWindow
+from python_publish_subscribe.src.db.Cache import CACHE_ATTRIBUTE, KEY_ATTRIBUTE, invalidate_from_message
 from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
 
 class PythonPublishSubscribe:
@@ -23,9 +30,16 @@ class PythonPublishSubscribe:
         self.test_func_map = {}
         self.publisher = Publisher(self.config)
         self.subscriber = Subscriber(self.config)
+        self.topology = Topology(self.publisher, self.subscriber, self.config)
+        self.replays: List[Replay] = []
+        self.subscriber.add_shutdown_callback(self.publisher.stop)
+        self.subscriber.add_shutdown_callback(DatabaseHelper.dispose)
 
         if database_connectivity:
             DatabaseHelper.get_instance(self.config)
+            if DatabaseHelper.has_replicas():
+                interval = float(self.config.get(Config.ConfigKeys.DATABASE_REPLICA_CHECK_INTERVAL.name))
+                self.subscriber.add_background_task(lambda: DatabaseHelper.monitor_replicas(interval))
 
 
     def initialise(self):
@@ -50,28 +64,303 @@ class PythonPublishSubscribe:
         """
         return self.publisher.create_topic(topic_name)
 
-    def create_subscription(self, subscription_name: str, topic: str, create_topic: bool=False) -> Optional[Subscription]:
+    def declare_topic(self, topic_name: str) -> None:
+        """
+        Declares a topic that is created when the app is run, along with any other declared topics and subscriptions.
+
+        :param topic_name: Name of the topic, can either be the complete topic as required by gcp or just the topic name.
+        """
+        self.topology.add_topic(topic_name)
+
+    def declare_subscription(self, subscription_name: str, topic: str, **options) -> None:
+        """
+        Declares a subscription that is created when the app is run, along with any other declared topics and subscriptions.
+
+        :param subscription_name: Name of the subscription
+        :param topic: Name of the topic to subscribe to
+        :param options: Options for creating the subscription, e.g. filter or dead_letter_topic,
+        see create_subscription
+        """
+        self.topology.add_subscription(subscription_name, topic, **options)
+
+    def create_subscription(
+            self,
+            subscription_name: str,
+            topic: str,
+            create_topic: bool=False,
+            dead_letter_topic: str=None,
+            max_delivery_attempts: int=None,
+            min_retry_backoff: float=None,
+            max_retry_backoff: float=None,
+            filter: str=None,
+            ack_deadline: int=None,
+            enable_message_ordering: bool=None,
+            enable_exactly_once_delivery: bool=None,
+            message_retention_duration: float=None,
+            retain_acked_messages: bool=None,
+            expiration_ttl: float=None,
+    ) -> Optional[Subscription]:
         """
         Creates a subscription on the given topic.
 
         :param topic:
         :param subscription_name:
         :param create_topic:
+        :param dead_letter_topic: Optional topic that messages which keep failing are forwarded to,
+        it is created if create_topic is set.
+        :param max_delivery_attempts: Optional number of delivery attempts before a message is dead lettered
+        :param min_retry_backoff: Optional min seconds Pub/Sub waits before redelivering a nacked message
+        :param max_retry_backoff: Optional max seconds Pub/Sub waits before redelivering a nacked message
+        :param filter: Optional filter on the messages' attributes, messages that don't match are never delivered
+        :param ack_deadline: Optional seconds Pub/Sub waits for a message to be acked before redelivering it
+        :param enable_message_ordering: If messages with the same ordering key should be delivered in order
+        :param enable_exactly_once_delivery: If Pub/Sub shouldn't redeliver messages that have been acked
+        :param message_retention_duration: Optional seconds unacked messages are kept for
+        :param retain_acked_messages: If acked messages should be kept, so they can be replayed
+        :param expiration_ttl: Optional seconds of inactivity before the subscription is deleted, 0 for never
         :return: Subscription if created or already exists.
         """
         if create_topic:
-            has_topic_been_created = self.publisher.create_topic(topic)
-            if not has_topic_been_created:
-                return None
-        return self.subscriber.create_subscription(subscription_name, topic)
+            for topic_to_create in (topic, dead_letter_topic):
+                if topic_to_create is None:
+                    continue
+                has_topic_been_created = self.publisher.create_topic(topic_to_create)
+                if not has_topic_been_created:
+                    return None
+        return self.subscriber.create_subscription(
+            subscription_name,
+            topic,
+            dead_letter_topic=dead_letter_topic,
+            max_delivery_attempts=max_delivery_attempts,
+            min_retry_backoff=min_retry_backoff,
+            max_retry_backoff=max_retry_backoff,
+            filter=filter,
+            ack_deadline=ack_deadline,
+            enable_message_ordering=enable_message_ordering,
+            enable_exactly_once_delivery=enable_exactly_once_delivery,
+            message_retention_duration=message_retention_duration,
+            retain_acked_messages=retain_acked_messages,
+            expiration_ttl=expiration_ttl,
+        )
+
+    def subscribe(
+            self,
+            subscription_name: str,
+            topic_name: str=None,
+            dead_letter_topic: str=None,
+            max_delivery_attempts: int=None,
+            filter: str=None,
+            ack_deadline: int=None,
+            enable_message_ordering: bool=None,
+            message_retention_duration: float=None,
+            retain_acked_messages: bool=None,
+            expiration_ttl: float=None,
+            **subscription_options
+    ):
+        """
+        Registers the decorated function as the handler of a subscription.
+
+        :param subscription_name: Name of the subscription
+        :param topic_name: Optional topic, if given the subscription is created on it when the app is run
+        :param dead_letter_topic: Optional dead letter topic for the subscription, only used when it's created
+        :param max_delivery_attempts: Optional number of delivery attempts before a message is dead lettered
+        :param filter: Optional filter on the messages' attributes, e.g. 'attributes.type = "order"',
+        messages that don't match are never delivered. Only used when the subscription is created.
+        :param ack_deadline: Optional ack deadline in seconds, only used when the subscription is created
+        :param enable_message_ordering: If messages should be delivered in order of their ordering key,
+        only used when the subscription is created
+        :param message_retention_duration: Optional seconds unacked messages are kept for,
+        only used when the subscription is created
+        :param retain_acked_messages: If acked messages should be kept, only used when the subscription is created
+        :param expiration_ttl: Optional seconds of inactivity before the subscription is deleted, 0 for never,
+        only used when the subscription is created
+        :param subscription_options: Options for how messages of the subscription are handled,
+        e.g. max_concurrency, min_retry_backoff or when to only handle messages with matching attributes,
+        see Subscriber.add_subscription
+        """
+        provisioning_options = {
+            key: value for key, value in (
+                ('dead_letter_topic', dead_letter_topic),
+                ('max_delivery_attempts', max_delivery_attempts),
+                ('filter', filter),
+                ('ack_deadline', ack_deadline),
+                ('enable_message_ordering', enable_message_ordering),
+                ('message_retention_duration', message_retention_duration),
+                ('retain_acked_messages', retain_acked_messages),
+                ('expiration_ttl', expiration_ttl),
+            ) if value is not None
+        }
+        if subscription_options.get('exactly_once_delivery'):
+            # Acks are only confirmed if the subscription itself has exactly-once delivery enabled
+            provisioning_options['enable_exactly_once_delivery'] = True
 
-    def subscribe(self, subscription_name: str, topic_name: str=None):
         def decorator(func):
             if topic_name is not None:
-                self.subscriber.create_subscription(subscription_name, topic_name)
-            self.subscriber.add_subscription(subscription_name, func)
+                self.topology.add_subscription(subscription_name, topic_name, **provisioning_options)
+            self.subscriber.add_subscription(subscription_name, func, **subscription_options)
+            return func
+        return decorator
+
+    def pipeline(
+            self,
+            subscription_name: str,
+            max_in_flight: int=1000,
+            forward_attributes: bool=False,
+            **subscription_options
+    ) -> Pipeline:
+        """
+        Creates a pipeline that relays the messages of a subscription to a topic through transform stages,
+        e.g. app.pipeline("orders").transform(parse).transform(enrich).to("enriched-orders")
+
+        :param subscription_name: Name of the subscription to read messages from
+        :param max_in_flight: Max number of messages being transformed or waiting to be published at once
+        :param forward_attributes: If the attributes of received messages should be added to the published messages
+        :param subscription_options: Any other options for the subscription, see Subscriber.add_subscription
+        :return: The pipeline, which starts once its output topic has been set with `to`
+        """
+        return Pipeline(
+            subscription_name,
+            self.publisher,
+            self.subscriber,
+            max_in_flight=max_in_flight,
+            forward_attributes=forward_attributes,
+            **subscription_options
+        )
+
+    def window(
+            self,
+            subscription_name: str,
+            window: TumblingWindow | SlidingWindow | SessionWindow,
+            key: Callable[[Any], str]=None,
+            value: Callable[[Any], float]=None,
+            emit_topic: str=None,
+            emit_model: Type=None,
+            max_in_flight: int=10000,
+            **subscription_options
+    ) -> WindowAggregator:
+        """
+        Aggregates the messages of a subscription over time windows,
+        emitting the count, sum, min and max of each window once it closes.
+
+        :param subscription_name: Name of the subscription to aggregate
+        :param window: TumblingWindow, SlidingWindow or SessionWindow
+        :param key: Optional function getting the key to aggregate by from the decoded message data
+        :param value: Optional function getting the value to sum from the decoded message data
+        :param emit_topic: Topic to publish the result of each window to
+        :param emit_model: SQLAlchemy model to save the result of each window as
+        :param max_in_flight: Max number of messages waiting for their windows to close
+        :param subscription_options: Any other options for the subscription, see Subscriber.add_subscription,
+        max_lease_duration defaults to the longer of an hour and the window's size or session gap
+        :return: The window aggregator
+        """
+        return WindowAggregator(
+            subscription_name,
+            window,
+            self.publisher,
+            self.subscriber,
+            key=key,
+            value=value,
+            emit_topic=emit_topic,
+            emit_model=emit_model,
+            max_in_flight=max_in_flight,
+            **subscription_options
+        )
+
+    def replay(
+            self,
+            subscription_name: str,
+            from_time: datetime=None,
+            snapshot: str=None,
+            max_in_flight: int=5000,
+            batch_size: int=500,
+            batch_latency: float=0.5,
+            **subscription_options
+    ):
+        """
+        Registers the decorated function to reprocess the history of a subscription, handling it in replay mode:
+        many more messages in flight, database writes committed in batches and progress reported against the backlog.
+        The subscription is only seeked back to the time or snapshot when the app is run with replay=True,
+        so restarting the app afterwards resumes the replay instead of starting it over.
+
+        :param subscription_name: Name of the subscription to replay
+        :param from_time: Optional time to seek the subscription back to
+        :param snapshot: Optional name or path of a snapshot to seek the subscription back to
+        :param max_in_flight: Max number of messages being handled at once
+        :param batch_size: Max number of messages written in a single commit
+        :param batch_latency: Max seconds a message waits for its batch to fill before it's written
+        :param subscription_options: Any other options for the subscription, see Subscriber.add_subscription
+        """
+        def decorator(func):
+            self.replays.append(Replay(
+                subscription_name,
+                func,
+                self.subscriber,
+                from_time=from_time,
+                snapshot=snapshot,
+                max_in_flight=max_in_flight,
+                batch_size=batch_size,
+                batch_latency=batch_latency,
+                **subscription_options
+            ))
             return func
         return decorator
 
-    def run(self):
-        self.subscriber.start_subscription_tasks()
\ No newline at end of file
+    def invalidate_caches_on(self, subscription_name: str, topic_name: str=None) -> None:
+        """
+        Invalidates the read-through caches when a message is received on the subscription,
+        the message's `cache` and `key` attributes say which cache and key, every cache/key if they're missing.
+
+        Every instance of the app needs its own subscription to the topic so each of their caches is invalidated.
+
+        :param subscription_name: Name of the subscription to receive invalidation messages on
+        :param topic_name: Optional topic, if given the subscription is created on it when the app is run
+        """
+        if topic_name is not None:
+            self.topology.add_subscription(subscription_name, topic_name)
+        self.subscriber.add_subscription(subscription_name, invalidate_from_message)
+
+    def publish_cache_invalidation(self, topic_name: str, cache: str=None, key: Any=None) -> Optional[str]:
+        """
+        Publishes a message invalidating a read-through cache of every app subscribed with invalidate_caches_on.
+
+        :param topic_name: Topic the apps' invalidation subscriptions are on
+        :param cache: Optional name of the cache, every cache is invalidated if it isn't given
+        :param key: Optional key to invalidate, the whole cache is invalidated if it isn't given
+        :return: ID of the published message
+        """
+        attributes = {}
+        if cache is not None:
+            attributes[CACHE_ATTRIBUTE] = cache
+        if key is not None:
+            attributes[KEY_ATTRIBUTE] = str(key)
+        return self.publisher.publish(topic_name, "invalidate", attributes=attributes)
+
+    def run(self, replay: bool=False):
+        """
+        Provisions the declared topics and subscriptions, then starts handling the subscriptions.
+
+        :param replay: Seek the subscriptions registered with @replay back to their time or snapshot before starting,
+        otherwise they carry on from where they are, e.g. when restarting during a replay
+        """
+        self.topology.provision()
+        if replay:
+            for registered_replay in self.replays:
+                registered_replay.seek()
+        elif self.replays:
+            print("Info: Replay subscriptions carry on from where they are, run with replay=True to seek them back")
+        metrics_port = self.config.get(Config.ConfigKeys.METRICS_PORT.name)
+        if metrics_port:
+            self.enable_metrics(int(metrics_port), self.config.get(Config.ConfigKeys.METRICS_HOST.name))
+        self.subscriber.start_subscription_tasks()
+
+    def enable_metrics(self, port: int, host: str='0.0.0.0') -> None:
+        """
+        Starts recording metrics and serves them in the Prometheus format at http://<host>:<port>/metrics
+        once the app is running. Called by run() when METRICS_PORT is set in the config.
+
+        :param port: Port to serve the metrics on
+        :param host: Host to serve the metrics on
+        """
+        metrics.enable()
+        self.subscriber.add_background_task(lambda: serve_metrics(port, host))
+        self.subscriber.add_background_task(monitor_loop_lag)
\ No newline at end of file
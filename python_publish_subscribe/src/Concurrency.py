@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from python_publish_subscribe.src.Metrics import metrics
+
+CONCURRENCY_LIMIT = metrics.gauge(
+    'pubsub_concurrency_limit', 'Current limit of handlers run at once by adaptive subscriptions', ['subscription']
+)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bounds how many handlers of a subscription run at once, adjusting the limit from their latency and errors (AIMD).
+
+    The limit grows by about one for every `limit` handlers that finish quickly while the limit is being used,
+    and is cut by `backoff` (at most once per handler latency) when a handler fails
+    or the smoothed latency rises above `tolerance` times the lowest latency seen,
+    which is a sign that whatever the handlers depend on (e.g. the database) is saturated.
+
+    Used like an asyncio.Semaphore, `async with limiter:`, from a single event loop.
+    """
+    def __init__(
+            self,
+            max_limit: int,
+            min_limit: int=1,
+            initial_limit: int=None,
+            tolerance: float=2.0,
+            backoff: float=0.9,
+            smoothing: float=0.2,
+            name: str=None,
+    ):
+        """
+        :param max_limit: Max number of handlers run at once
+        :param min_limit: Min number of handlers run at once
+        :param initial_limit: Limit to start with, defaults to 10 (or max_limit if lower)
+        :param tolerance: How many times the lowest latency the smoothed latency can reach before the limit is cut
+        :param backoff: Factor the limit is multiplied by when it's cut
+        :param smoothing: Weight of each new latency in the smoothed latency
+        :param name: Optional name of the subscription, used to label the limit metric
+        """
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError("Concurrency limits must be at least 1 and max_limit can't be less than min_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit or 10, min_limit), max_limit))
+        self._tolerance = tolerance
+        self._backoff = backoff
+        self._smoothing = smoothing
+        self._name = name
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._started: Dict[asyncio.Task, float] = {}
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def __aenter__(self) -> None:
+        if self._waiters or self._in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # A slot had already been handed to this waiter, pass it on
+                    self._in_flight -= 1
+                    self._wake()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self._in_flight += 1
+        self._started[asyncio.current_task()] = time.monotonic()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        started = self._started.pop(asyncio.current_task(), None)
+        self._in_flight -= 1
+        if started is not None:
+            self._update(time.monotonic() - started, exc_type is not None)
+        self._wake()
+
+    def _wake(self) -> None:
+        """
+        Hands free slots to waiting handlers, in the order they started waiting.
+        """
+        while self._waiters and self._in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def _update(self, latency: float, failed: bool) -> None:
+        """
+        Adjusts the limit after a handler has finished.
+
+        :param latency: Seconds the handler took
+        :param failed: If the handler raised an exception
+        """
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self._smoothing * (latency - self._latency)
+        if self._baseline is None or self._latency < self._baseline:
+            self._baseline = self._latency
+        else:
+            # Drift towards the current latency so the baseline recovers if the normal latency changes
+            self._baseline += 0.01 * (self._latency - self._baseline)
+
+        now = time.monotonic()
+        if failed or self._latency > self._baseline * self._tolerance:
+            if now - self._last_decrease >= self._latency:
+                self.limit = max(float(self.min_limit), self.limit * self._backoff)
+                self._last_decrease = now
+        elif self._in_flight + 1 >= int(self.limit):
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+        if metrics.enabled and self._name is not None:
+            CONCURRENCY_LIMIT.set(int(self.limit), self._name)
@@ -0,0 +1,242 @@
+import asyncio
+import math
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str=None) -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """
+    A value that only goes up, e.g. the number of messages received.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float=1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}' for labels, value in values]
+
+
+class Gauge:
+    """
+    A value that can go up and down, either set directly or read from a function when the metrics are collected.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]=(), function: Callable[[], float]=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self._values[label_values] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Makes the gauge read its value from a function whenever the metrics are collected.
+
+        :param function: Function returning the current value
+        """
+        self._function = function
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f'{self.name} {_format_value(self._function())}']
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}' for labels, value in list(self._values.items())]
+
+
+class Histogram:
+    """
+    Counts observed values, e.g. latencies, into buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # One count per bucket, followed by the sum and count of all values
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def count(self, *label_values: str) -> int:
+        counts = self._values.get(label_values)
+        return int(counts[-1]) if counts else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        samples = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket = _format_labels(self.labels, labels, f'le="{_format_value(bound)}"')
+                samples.append(f'{self.name}_bucket{bucket} {cumulative}')
+            samples.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(counts[-2])}')
+            samples.append(f'{self.name}_count{_format_labels(self.labels, labels)} {int(counts[-1])}')
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Collection of all the framework's metrics.
+
+    Metrics are disabled until enable() is called, and code recording metrics checks `enabled` first,
+    so they cost close to nothing when they aren't used.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._metrics: Dict[str, Counter | Gauge | Histogram] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def register(self, metric: Counter | Gauge | Histogram) -> Counter | Gauge | Histogram:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} has already been registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: Sequence[str]=()) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str]=(), function: Callable[[], float]=None) -> Gauge:
+        return self.register(Gauge(name, description, labels, function))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render(self) -> str:
+        """
+        Renders all the metrics in the Prometheus text format.
+
+        :return: The metrics
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+PUBLISH_LATENCY = metrics.histogram('pubsub_publish_latency_seconds', 'Time taken for a publish to be confirmed', ['topic'])
+PUBLISH_BATCH_SIZE = metrics.histogram(
+    'pubsub_publish_batch_size', 'Number of messages published by each publish_batch call',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+PUBLISH_ERRORS = metrics.counter('pubsub_publish_errors_total', 'Number of publishes that failed', ['topic'])
+MESSAGES_RECEIVED = metrics.counter('pubsub_messages_received_total', 'Number of messages received', ['subscription'])
+MESSAGES_ACKED = metrics.counter('pubsub_messages_acked_total', 'Number of messages acked', ['subscription'])
+MESSAGES_NACKED = metrics.counter('pubsub_messages_nacked_total', 'Number of messages nacked', ['subscription'])
+HANDLER_LATENCY = metrics.histogram('pubsub_handler_latency_seconds', 'Time taken for a handler to finish', ['subscription'])
+PUBLISH_IN_FLIGHT = metrics.gauge('pubsub_publish_in_flight', 'Number of asynchronous publishes waiting to be confirmed')
+MESSAGES_IN_FLIGHT = metrics.gauge('pubsub_messages_in_flight', 'Number of received messages being handled')
+EXECUTOR_QUEUE_DEPTH = metrics.gauge('pubsub_executor_queue_depth', 'Number of synchronous handlers waiting for a worker thread')
+DATABASE_EXECUTOR_QUEUE_DEPTH = metrics.gauge(
+    'pubsub_database_executor_queue_depth', 'Number of offloaded database calls waiting for a database thread'
+)
+LOOP_LAG = metrics.gauge('pubsub_event_loop_lag_seconds', 'How late the event loop last ran a scheduled callback')
+
+
+async def monitor_loop_lag(interval: float=1.0) -> None:
+    """
+    Measures how late the event loop is running scheduled callbacks, which shows how busy the loop is.
+
+    :param interval: Seconds between measurements
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.set(max(0.0, loop.time() - expected))
+
+
+async def serve_metrics(port: int, host: str='0.0.0.0') -> None:
+    """
+    Serves the metrics over HTTP at /metrics until cancelled.
+
+    :param port: Port to listen on
+    :param host: Host to listen on
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', metrics.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Info: Serving metrics on {host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,81 @@
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Dict, Optional, Tuple
+
+
+class OrderingKeyError(Exception):
+    """
+    Raised for a message that wasn't handled because an earlier message with the same ordering key failed.
+    """
+
+
+class OrderingKeyScheduler:
+    """
+    Runs the handlers of messages with the same ordering key one after another,
+    while messages with different keys are handled concurrently.
+
+    If a handler fails, the messages already queued behind it for the same key fail without being handled,
+    so they're nacked and redelivered after the failed message, instead of being handled (and acked) before it.
+
+    Each key only keeps a reference to its most recently scheduled message,
+    which is removed once that message has been handled, so keys that are idle use no memory.
+    """
+    def __init__(self):
+        self._tails: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tails)
+
+    def run_in_order(self, key: str, awaitable: Awaitable) -> Awaitable:
+        """
+        Schedules an awaitable to run after all previously scheduled awaitables with the same key.
+
+        The position in the key's queue is taken when this is called (not when the returned coroutine starts),
+        so it should be called in the order the messages were received.
+
+        :param key: Ordering key of the message, messages without a key aren't ordered
+        :param awaitable: Awaitable handling the message
+        :return: Coroutine that waits for its turn then awaits the awaitable
+        """
+        if not key:
+            return awaitable
+        previous, turn = self._claim(key)
+        return self._run_after(key, previous, turn, awaitable)
+
+    def _claim(self, key: str) -> Tuple[Optional[Future], Future]:
+        turn = Future()
+        with self._lock:
+            previous = self._tails.get(key)
+            self._tails[key] = turn
+        return previous, turn
+
+    def _release(self, key: str, turn: Future, error: BaseException=None) -> None:
+        with self._lock:
+            if self._tails.get(key) is turn:
+                del self._tails[key]
+        if error is None:
+            turn.set_result(None)
+        else:
+            # Fails the message waiting on this turn, which fails the one waiting on it and so on
+            turn.set_exception(error if isinstance(error, Exception) else OrderingKeyError(f"Handling of {key} was cancelled"))
+
+    async def _run_after(self, key: str, previous: Optional[Future], turn: Future, awaitable: Awaitable) -> Any:
+        try:
+            if previous is not None:
+                try:
+                    await asyncio.wrap_future(previous)
+                except Exception as error:
+                    if inspect.iscoroutine(awaitable):
+                        awaitable.close()
+                    raise OrderingKeyError(
+                        f"An earlier message with ordering key {key} failed, this one is redelivered after it"
+                    ) from error
+            result = await awaitable
+        except BaseException as error:
+            self._release(key, turn, error)
+            raise
+        self._release(key, turn)
+        return result
@@ -0,0 +1,101 @@
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, List, Optional
+
+from google.cloud.pubsub_v1.subscriber.message import Message
+
+from python_publish_subscribe.src.Publisher import Publisher, convert_bytes_to_data
+from python_publish_subscribe.src.Subscriber import Subscriber
+
+
+class Pipeline:
+    """
+    Relays the messages of a subscription to a topic, transforming them on the way.
+
+    Each message's data is decoded, passed through the transform stages in order
+    and published to the output topic. Publishes aren't waited on one by one,
+    so the publisher batches them, and a message is only acked once its publish has been confirmed.
+    As at most max_in_flight messages are handled at once,
+    a slow publisher holds back the subscription rather than letting messages pile up.
+    """
+    def __init__(
+            self,
+            subscription_name: str,
+            publisher: Publisher,
+            subscriber: Subscriber,
+            max_in_flight: int=1000,
+            forward_attributes: bool=False,
+            **subscription_options
+    ):
+        """
+        :param subscription_name: Name of the subscription to read messages from
+        :param publisher: Publisher to publish the results with
+        :param subscriber: Subscriber to add the subscription to
+        :param max_in_flight: Max number of messages being transformed or waiting to be published at once
+        :param forward_attributes: If the attributes of received messages should be added to the published messages
+        :param subscription_options: Any other options for the subscription, see Subscriber.add_subscription
+        """
+        if 'max_concurrency' in subscription_options:
+            raise ValueError("Use max_in_flight to limit how many messages are handled at once, not max_concurrency")
+        self._subscription_name = subscription_name
+        self._publisher = publisher
+        self._subscriber = subscriber
+        self._max_in_flight = max_in_flight
+        self._forward_attributes = forward_attributes
+        self._subscription_options = subscription_options
+        self._stages: List[Callable] = []
+        self._topic_name: Optional[str] = None
+        self._attributes: Dict[str, str] = {}
+
+    def transform(self, stage: Callable) -> 'Pipeline':
+        """
+        Adds a transform stage to the pipeline.
+
+        The stage is called with the output of the previous stage (or the decoded message data for the first stage)
+        and can be a coroutine function. If a stage returns None the message is acked without being published.
+
+        :param stage: Function transforming the data
+        :return: The pipeline, so stages can be chained
+        """
+        if self._topic_name is not None:
+            raise RuntimeError("Stages can't be added once the output topic has been set")
+        self._stages.append(stage)
+        return self
+
+    def to(self, topic_name: str, attributes: Optional[Dict[str, str]]=None) -> 'Pipeline':
+        """
+        Sets the output topic of the pipeline and adds its subscription to the subscriber.
+
+        :param topic_name: Topic to publish the results to, can either be the complete topic path or just the topic name
+        :param attributes: Optional attributes to add to every published message
+        :return: The pipeline
+        """
+        if self._topic_name is not None:
+            raise RuntimeError("The output topic of the pipeline has already been set")
+        self._topic_name = topic_name
+        self._attributes = attributes or {}
+        self._subscriber.add_subscription(
+            self._subscription_name,
+            self._handle,
+            max_concurrency=self._max_in_flight,
+            **self._subscription_options
+        )
+        return self
+
+    async def _transform(self, data: Any) -> Any:
+        for stage in self._stages:
+            data = stage(data)
+            if inspect.isawaitable(data):
+                data = await data
+            if data is None:
+                return None
+        return data
+
+    async def _handle(self, message: Message) -> None:
+        data = await self._transform(convert_bytes_to_data(message.data))
+        if data is None:
+            return
+
+        attributes = {**message.attributes, **self._attributes} if self._forward_attributes else self._attributes
+        future = self._publisher.publish(self._topic_name, data, attributes=attributes, asynchronous=True)
+        await asyncio.wrap_future(future)
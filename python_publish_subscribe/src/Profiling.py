@@ -0,0 +1,199 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from types import CodeType, FrameType
+from typing import Callable, Dict, List, Optional
+
+from python_publish_subscribe.src.Metrics import metrics
+
+# Phases of handling a message, in the order they happen
+PHASES = ('queue_wait', 'dispatch', 'handler', 'commit', 'ack')
+
+HANDLER_PHASE_LATENCY = metrics.histogram(
+    'pubsub_handler_phase_seconds', 'Time taken by each phase of handling a message', ['subscription', 'phase']
+)
+
+
+class PhaseTimer:
+    """
+    Times the phases of handling a single message, each phase lasts from the end of the previous one.
+
+    - queue_wait: from the message being received until its handler is started on the event loop,
+      including waiting for the concurrency limit and for earlier messages with the same ordering key
+    - dispatch: from then until the callback is called, including waiting for an executor thread
+      for synchronous callbacks and creating the database session
+    - handler: the callback itself
+    - commit: committing the database session
+    - ack: from then until the message has been acked or nacked
+    """
+    __slots__ = ('subscription_name', '_profiler', '_last')
+
+    def __init__(self, subscription_name: str, profiler: 'Profiler'):
+        self.subscription_name = subscription_name
+        self._profiler = profiler
+        self._last = time.monotonic()
+
+    def mark(self, phase: str) -> None:
+        """
+        Ends a phase and records how long it took.
+
+        :param phase: The phase that has just ended
+        """
+        now = time.monotonic()
+        self._profiler.record(self.subscription_name, phase, now - self._last)
+        self._last = now
+
+
+class Profiler:
+    """
+    Profiling of subscription handlers.
+
+    Phase timings are recorded for every message while metrics are enabled or a phase hook has been added,
+    otherwise no timers are created.
+
+    The sampling profiler periodically takes the stacks of all threads and counts the stacks that are in a handler,
+    per subscription. The counts can be dumped in the collapsed stack format used by flamegraph tools.
+    Only code running on a thread is sampled, so time an async handler spends awaiting isn't included.
+    """
+    def __init__(self):
+        self._hooks: List[Callable[[str, str, float], None]] = []
+        self._handlers: Dict[CodeType, str] = {}
+        self._samples: Dict[str, Tally] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+
+    @property
+    def timing(self) -> bool:
+        """
+        If the phases of handling messages should be timed.
+        """
+        return metrics.enabled or bool(self._hooks)
+
+    def add_phase_hook(self, hook: Callable[[str, str, float], None]) -> None:
+        """
+        Adds a function called with the subscription name, phase and seconds taken whenever a phase ends.
+        It's called on whichever thread the phase ended on, so it should be quick.
+
+        :param hook: Function to call
+        """
+        self._hooks.append(hook)
+
+    def remove_phase_hook(self, hook: Callable[[str, str, float], None]) -> None:
+        self._hooks.remove(hook)
+
+    def timer(self, subscription_name: str) -> Optional[PhaseTimer]:
+        """
+        Starts timing the phases of handling a message.
+
+        :param subscription_name: Name of the subscription the message was received on
+        :return: The timer, or None if phases aren't being timed
+        """
+        return PhaseTimer(subscription_name, self) if self.timing else None
+
+    def record(self, subscription_name: str, phase: str, seconds: float) -> None:
+        if metrics.enabled:
+            HANDLER_PHASE_LATENCY.observe(seconds, subscription_name, phase)
+        for hook in self._hooks:
+            try:
+                hook(subscription_name, phase, seconds)
+            except Exception as error:
+                print(f"Error: Profiling hook failed: {error}")
+
+    def register_handler(self, subscription_name: str, handler: Callable) -> None:
+        """
+        Registers a subscription's handler so the sampling profiler can tell which subscription a stack belongs to.
+
+        :param subscription_name: Name of the subscription
+        :param handler: Callback handling the subscription's messages
+        """
+        handler = getattr(handler, '__func__', handler)
+        code = getattr(handler, '__code__', None)
+        if code is not None:
+            self._handlers[code] = subscription_name
+
+    @property
+    def sampling(self) -> bool:
+        return self._sampler is not None
+
+    def start_sampling(self, interval: float=0.01) -> None:
+        """
+        Starts the sampling profiler, clearing any previous samples.
+
+        :param interval: Seconds between samples
+        """
+        if self._sampler is not None:
+            return
+        self._samples = {}
+        self._stop_sampling.clear()
+        self._sampler = threading.Thread(target=self._sample_periodically, args=(interval,), daemon=True)
+        self._sampler.start()
+        print("Info: Started the sampling profiler")
+
+    def stop_sampling(self) -> None:
+        """
+        Stops the sampling profiler, keeping its samples so they can be dumped.
+        """
+        if self._sampler is None:
+            return
+        self._stop_sampling.set()
+        self._sampler.join()
+        self._sampler = None
+        print("Info: Stopped the sampling profiler")
+
+    def collapsed_stacks(self) -> Dict[str, List[str]]:
+        """
+        Gets the samples taken by the sampling profiler.
+
+        :return: Lines of collapsed stacks and their counts ("outer;inner count") per subscription
+        """
+        return {
+            subscription_name: [f'{stack} {count}' for stack, count in samples.most_common()]
+            for subscription_name, samples in list(self._samples.items())
+        }
+
+    def dump(self, directory: str) -> List[str]:
+        """
+        Writes the samples of each subscription to <directory>/<subscription_name>.folded.
+
+        :param directory: Directory to write the files to, created if it doesn't exist
+        :return: Paths of the files written
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for subscription_name, lines in self.collapsed_stacks().items():
+            path = os.path.join(directory, f"{subscription_name.split('/')[-1]}.folded")
+            with open(path, 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+            paths.append(path)
+        return paths
+
+    def _sample_periodically(self, interval: float) -> None:
+        own_thread = threading.get_ident()
+        while not self._stop_sampling.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    self.sample(frame)
+
+    def sample(self, frame: FrameType) -> None:
+        """
+        Counts a thread's stack if it's in a registered handler, from the handler to the innermost frame.
+
+        :param frame: Innermost frame of the thread
+        """
+        stack = []
+        subscription_name = None
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            if code in self._handlers:
+                subscription_name = self._handlers[code]
+                # Keep going in case this is a nested call of another handler
+                collapsed = ';'.join(reversed(stack))
+            frame = frame.f_back
+        if subscription_name is not None:
+            self._samples.setdefault(subscription_name, Tally())[collapsed] += 1
+
+
+profiler = Profiler()
@@ -1,12 +1,16 @@
 import json
-from typing import Optional, Any, Dict, List, Tuple
+import time
+from concurrent import futures
+from typing import Optional, Any, Dict, List, Tuple, Set
 
 from google.api_core.retry import Retry
 from google.cloud import pubsub_v1
 from google.cloud.pubsub_v1.publisher.futures import Future
 
 from python_publish_subscribe.config import Config
-from google.api_core.exceptions import AlreadyExists, InvalidArgument, GoogleAPICallError, RetryError
+from python_publish_subscribe.src.Metrics import metrics, PUBLISH_LATENCY, PUBLISH_ERRORS, PUBLISH_BATCH_SIZE, PUBLISH_IN_FLIGHT
+from python_publish_subscribe.src.Tracing import inject, publish_span
+from google.api_core.exceptions import AlreadyExists, InvalidArgument, GoogleAPICallError, RetryError, NotFound
 import re
 
 
@@ -32,10 +36,50 @@ def convert_data_to_string(data: Any) -> str:
         return str(data)
 
 
+def convert_bytes_to_data(data: bytes) -> Any:
+    """
+    Converts the data of a received message back into data.
+
+    The inverse of convert_data_to_string, json is loaded if possible
+    otherwise the decoded string is returned.
+    :param data: Data of the message
+    :return: converted data
+    """
+    text = data.decode('utf-8')
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _observe_publish(future: Future, topic_name: str) -> None:
+    """
+    Records the latency and outcome of a publish once it has been confirmed.
+
+    :param future: Future of the publish
+    :param topic_name: Name of the topic published to
+    """
+    started = time.monotonic()
+
+    def done(future: Future) -> None:
+        PUBLISH_LATENCY.observe(time.monotonic() - started, topic_name)
+        if future.exception() is not None:
+            PUBLISH_ERRORS.inc(topic_name)
+
+    future.add_done_callback(done)
+
+
 class Publisher:
     def __init__(self, config: Config, timout: int=None):
-        self._publisher = pubsub_v1.PublisherClient()
+        self._publisher = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(
+                max_messages=int(config.get(Config.ConfigKeys.PUBLISH_BATCH_MAX_MESSAGES.name)),
+                max_latency=float(config.get(Config.ConfigKeys.PUBLISH_BATCH_MAX_LATENCY.name)),
+            )
+        )
         self._config = config
+        self._pending_futures: Set[Future] = set()
+        PUBLISH_IN_FLIGHT.set_function(lambda: len(self._pending_futures))
         if timout:
             self._timout = timout
         else:
@@ -85,6 +129,19 @@ class Publisher:
             print("Error: Something when wrong when creating topic {topic}: {error}".format(topic=topic_name, error=error))
             return False
 
+    def topic_exists(self, topic_name: str) -> bool:
+        """
+        Checks if a topic exists.
+
+        :param topic_name: Name of the topic, can either be the complete topic as required by gcp or just the topic name.
+        :return: If the topic exists.
+        """
+        try:
+            self._publisher.get_topic(topic=self.build_topic(topic_name))
+            return True
+        except NotFound:
+            return False
+
     def get_topic(self, topic_name: str):
         """
         Gets both the topic path and name from the given topic.
@@ -127,6 +184,7 @@ class Publisher:
         Currently, topic path is still the preferred way to pass the topic.
         :param asynchronous: If the function should return the future of the message publishing or
          wait till it gets a result.
+        The trace context of the current span, if there is one, is added to the attributes as `traceparent`/`tracestate`.
         :return: Result of the publishing, if successful, otherwise None.
         """
 
@@ -137,10 +195,15 @@ class Publisher:
 
         timeout = timeout or self._timout
 
-        if attributes:
-            published = self._publisher.publish(topic, data.encode('utf-8'), timeout=timeout, retry=retry, **attributes)
-        else:
-            published = self._publisher.publish(topic, data.encode('utf-8'), timeout=timeout, retry=retry)
+        with publish_span(topic_name):
+            attributes = inject(attributes)
+            if attributes:
+                published = self._publisher.publish(topic, data.encode('utf-8'), timeout=timeout, retry=retry, **attributes)
+            else:
+                published = self._publisher.publish(topic, data.encode('utf-8'), timeout=timeout, retry=retry)
+
+        if metrics.enabled:
+            _observe_publish(published, topic_name)
 
         if not asynchronous:
             try:
@@ -154,8 +217,29 @@ class Publisher:
                 print("Error: Something when wrong: {error}".format(error=error))
                 return None
         else:
+            self._pending_futures.add(published)
+            published.add_done_callback(self._pending_futures.discard)
             return published
 
+    def stop(self, timeout: float=None) -> None:
+        """
+        Publishes any outstanding batched messages, waits for the asynchronous publishes
+        to finish and stops the publisher client.
+
+        The publisher can't be used to publish once stopped.
+        :param timeout: Max seconds to wait for outstanding publishes,
+        defaults to SHUTDOWN_TIMEOUT in the config (optional)
+        """
+        if timeout is None:
+            timeout = float(self._config.get(Config.ConfigKeys.SHUTDOWN_TIMEOUT.name))
+        self._publisher.stop()
+        pending = list(self._pending_futures)
+        if pending:
+            _, not_done = futures.wait(pending, timeout=timeout)
+            if not_done:
+                print("Warning: {count} messages were not published before the publisher stopped"
+                      .format(count=len(not_done)))
+
 
     def publish_batch(
             self,
@@ -179,6 +263,8 @@ class Publisher:
         full_topic, _ = self.get_topic(topic_name)
 
         timeout = timeout or self._timout
+        if metrics.enabled:
+            PUBLISH_BATCH_SIZE.observe(len(messages))
 
         paired_futures: List[Tuple[Any, Future]] = [
             (message, self.publish(topic_name, message, attributes, timeout, retry, full_topic, True))
@@ -0,0 +1,251 @@
+import asyncio
+import inspect
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.cloud.pubsub_v1.subscriber.message import Message
+
+from python_publish_subscribe.src.Subscriber import Subscriber, _SYNC_EXECUTOR, _create_async_session, _create_session
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.OffloadedSession import OffloadedSession
+from python_publish_subscribe.src.db.Sharding import ShardRouter
+
+
+class Replay:
+    """
+    Reprocesses the history of a subscription, tuned for throughput rather than latency.
+
+    The subscription is seeked back to a time or snapshot when seek() is called, which the app does on startup
+    when run with replay=True, then handled with a much larger number of messages in flight than normal. Callbacks with a `session` parameter are run in batches sharing one session,
+    each in its own savepoint, so a batch of messages is written with a single commit,
+    and a message is only acked once its batch has been committed. A callback that fails only rolls back
+    its own message, which is nacked. With a `database` option, messages are batched per database,
+    each message going to the named database or the shard the ShardRouter picks for it. Progress is printed every progress_interval seconds,
+    based on the publish time of the handled messages compared to when the replay started.
+    """
+    def __init__(
+            self,
+            subscription_name: str,
+            callback: Callable,
+            subscriber: Subscriber,
+            from_time: datetime=None,
+            snapshot: str=None,
+            max_in_flight: int=5000,
+            batch_size: int=500,
+            batch_latency: float=0.5,
+            progress_interval: float=10.0,
+            **subscription_options
+    ):
+        """
+        :param subscription_name: Name of the subscription to replay
+        :param callback: Function called with each message, and the batch's session if it has a `session` parameter
+        :param subscriber: Subscriber to add the subscription to
+        :param from_time: Optional time to seek the subscription back to
+        :param snapshot: Optional name or path of a snapshot to seek the subscription back to
+        :param max_in_flight: Max number of messages being handled or waiting for their batch to be written at once
+        :param batch_size: Max number of messages written in a single commit
+        :param batch_latency: Max seconds a message waits for its batch to fill before it's written
+        :param progress_interval: Seconds between progress reports
+        :param subscription_options: Any other options for the subscription, see Subscriber.add_subscription
+        """
+        if 'max_concurrency' in subscription_options:
+            raise ValueError("Use max_in_flight to limit how many messages are handled at once, not max_concurrency")
+        if from_time is not None and snapshot is not None:
+            raise ValueError("Only one of from_time or snapshot can be given")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self._subscription_name = subscription_name
+        self._subscriber = subscriber
+        self._snapshot = snapshot
+        self._from_time = from_time
+        self._callback = callback
+        self._wants_session = 'session' in inspect.signature(callback).parameters
+        self._batch_size = batch_size
+        self._batch_latency = batch_latency
+        self._progress_interval = progress_interval
+        self._database: str | ShardRouter | None = subscription_options.get('database')
+        # Batches and their flush timers per database, None being the primary database
+        self._batches: Dict[Optional[str], List[Tuple[Message, asyncio.Future]]] = {}
+        self._flush_timers: Dict[Optional[str], asyncio.TimerHandle] = {}
+
+        # When the replay started, taken at the seek or else on the first message handled
+        self._started: Optional[float] = None
+        self._from = from_time.timestamp() if from_time is not None else None
+        self._latest: Optional[float] = None
+        self._handled = 0
+        self._last_report = time.monotonic()
+        self._caught_up = False
+
+        subscriber.add_subscription(
+            subscription_name,
+            self._handle,
+            max_concurrency=max_in_flight,
+            **subscription_options
+        )
+
+    def seek(self) -> None:
+        """
+        Seeks the subscription back to the replay's time or snapshot, so its history is redelivered.
+        It's a blocking admin request, made on startup once the subscription has been provisioned.
+        """
+        if self._from_time is None and self._snapshot is None:
+            return
+        self._started = time.time()
+        if not self._subscriber.seek(self._subscription_name, time=self._from_time, snapshot=self._snapshot):
+            raise RuntimeError(f"Unable to seek {self._subscription_name} for the replay")
+        print(f"Info: Seeked {self._subscription_name} back for the replay")
+
+    def progress(self) -> Dict[str, Any]:
+        """
+        Gets the progress of the replay.
+
+        :return: Number of messages handled, messages handled per second, seconds of the backlog still to replay
+        (from the latest publish time handled to when the replay started) and the percentage of the backlog replayed
+        """
+        progress = {
+            'handled': self._handled,
+            'rate': 0.0,
+            'behind_seconds': None,
+            'percent': None,
+        }
+        if self._started is None:
+            return progress
+        progress['rate'] = self._handled / max(time.time() - self._started, 1e-9)
+        if self._latest is not None:
+            progress['behind_seconds'] = max(0.0, self._started - self._latest)
+            if self._from is not None and self._started > self._from:
+                replayed = (self._latest - self._from) / (self._started - self._from)
+                progress['percent'] = round(min(100.0, max(0.0, replayed * 100)), 1)
+        return progress
+
+    async def _handle(self, message: Message) -> None:
+        if self._started is None:
+            self._started = time.time()
+        if self._wants_session and DatabaseHelper.is_setup():
+            await self._add_to_batch(message)
+        elif inspect.iscoroutinefunction(self._callback):
+            await self._callback(message)
+        else:
+            await asyncio.get_running_loop().run_in_executor(_SYNC_EXECUTOR, self._callback, message)
+        self._record_progress(message)
+
+    def _record_progress(self, message: Message) -> None:
+        self._handled += 1
+        publish_time = getattr(message, 'publish_time', None)
+        if isinstance(publish_time, datetime):
+            published = publish_time.timestamp()
+            if self._from is None:
+                # Seeked to a snapshot, so the backlog starts at the first message received
+                self._from = published
+            if self._latest is None or published > self._latest:
+                self._latest = published
+
+        if not self._caught_up and self._latest is not None and self._latest >= self._started:
+            self._caught_up = True
+            print(f"Info: Replay of {self._subscription_name} has caught up after {self._handled} messages")
+
+        now = time.monotonic()
+        if now - self._last_report >= self._progress_interval:
+            self._last_report = now
+            progress = self.progress()
+            percent = f"{progress['percent']}%, " if progress['percent'] is not None else ""
+            print(f"Info: Replay of {self._subscription_name}: {percent}{progress['handled']} messages, "
+                  f"{progress['rate']:.0f}/s")
+
+    async def _add_to_batch(self, message: Message) -> None:
+        database = self._database.route(message) if isinstance(self._database, ShardRouter) else self._database
+        loop = asyncio.get_running_loop()
+        written = loop.create_future()
+        batch = self._batches.setdefault(database, [])
+        batch.append((message, written))
+        if len(batch) >= self._batch_size:
+            self._flush(database)
+        elif database not in self._flush_timers:
+            self._flush_timers[database] = loop.call_later(self._batch_latency, self._flush, database)
+        await written
+
+    def _flush(self, database: Optional[str]=None) -> None:
+        flush_timer = self._flush_timers.pop(database, None)
+        if flush_timer is not None:
+            flush_timer.cancel()
+        batch = self._batches.pop(database, [])
+        if batch:
+            asyncio.ensure_future(self._write(batch, database))
+
+    async def _write(self, batch: List[Tuple[Message, asyncio.Future]], database: Optional[str]=None) -> None:
+        """
+        Runs the callback of each message in the batch in its own savepoint of a shared session, then commits once.
+        """
+        try:
+            if DatabaseHelper.is_async() or inspect.iscoroutinefunction(self._callback):
+                errors = await self._write_async(batch, database)
+            else:
+                errors = await asyncio.get_running_loop().run_in_executor(
+                    _SYNC_EXECUTOR, self._write_sync, batch, database
+                )
+        except Exception as error:
+            print(f"Error: Unable to write a replay batch of {len(batch)} messages: {error}")
+            errors = [error] * len(batch)
+
+        for (_, written), error in zip(batch, errors):
+            if written.done():
+                continue
+            if error is None:
+                written.set_result(None)
+            else:
+                written.set_exception(error)
+
+    async def _write_async(
+            self,
+            batch: List[Tuple[Message, asyncio.Future]],
+            database: Optional[str]=None
+    ) -> List[Optional[Exception]]:
+        errors = []
+        # Async callbacks on a sync engine have their session's calls offloaded to the database thread pool
+        session = _create_async_session(database) if DatabaseHelper.is_async() \
+            else OffloadedSession(_create_session(database))
+        async with session:
+            for message, _ in batch:
+                try:
+                    async with session.begin_nested():
+                        if inspect.iscoroutinefunction(self._callback):
+                            result = await self._callback(message, session)
+                        else:
+                            result = await session.run_sync(lambda sync_session: self._callback(message, sync_session))
+                        if result is False:
+                            raise ValueError("Callback returned False")
+                    errors.append(None)
+                except Exception as error:
+                    errors.append(error)
+            try:
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        return errors
+
+    def _write_sync(
+            self,
+            batch: List[Tuple[Message, asyncio.Future]],
+            database: Optional[str]=None
+    ) -> List[Optional[Exception]]:
+        errors = []
+        session = _create_session(database)
+        try:
+            for message, _ in batch:
+                try:
+                    with session.begin_nested():
+                        if self._callback(message, session) is False:
+                            raise ValueError("Callback returned False")
+                    errors.append(None)
+                except Exception as error:
+                    errors.append(error)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return errors
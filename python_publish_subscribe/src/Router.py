@@ -0,0 +1,68 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+from google.cloud.pubsub_v1.subscriber.message import Message
+
+
+class MessageRouter:
+    """
+    Routes the messages of a subscription to one of its handlers by the message's attributes.
+
+    Routes are indexed by the attribute keys they match on, so finding the handler of a message
+    is a dictionary lookup per distinct set of keys rather than checking every route.
+    Routes matching on more attributes are tried first, and if no route matches
+    the default route (registered without any conditions) is used.
+    """
+    def __init__(self):
+        self._indexes: List[Tuple[Tuple[str, ...], Dict[Tuple[str, ...], Callable]]] = []
+        self._default: Optional[Callable] = None
+
+    def add_route(self, callback: Callable, when: Optional[Dict[str, str]]=None) -> None:
+        """
+        Adds a route to the router.
+
+        :param callback: Handler for messages matching the route
+        :param when: Attributes and their values a message needs to have to match the route,
+        if not given the handler is the default route.
+        """
+        if not when:
+            if self._default is not None:
+                raise ValueError("A default route has already been added")
+            self._default = callback
+            return
+
+        keys = tuple(sorted(when))
+        values = tuple(str(when[key]) for key in keys)
+        for index_keys, index in self._indexes:
+            if index_keys == keys:
+                if values in index:
+                    raise ValueError(f"A route for {when} has already been added")
+                index[values] = callback
+                return
+
+        self._indexes.append((keys, {values: callback}))
+        self._indexes.sort(key=lambda keys_and_index: len(keys_and_index[0]), reverse=True)
+
+    def route(self, message: Message) -> Optional[Callable]:
+        """
+        Finds the handler for a message.
+
+        :param message: Message to route
+        :return: The handler of the first matching route, the default route or None if nothing matches
+        """
+        attributes = message.attributes
+        for keys, index in self._indexes:
+            callback = index.get(tuple(attributes.get(key) for key in keys))
+            if callback is not None:
+                return callback
+        return self._default
+
+    def callbacks(self) -> List[Callable]:
+        """
+        Gets the callbacks of all the routes.
+
+        :return: List of callbacks, including the default
+        """
+        callbacks = [callback for _, index in self._indexes for callback in index.values()]
+        if self._default is not None:
+            callbacks.append(self._default)
+        return callbacks
@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# Marks a key that has been deleted but not yet checkpointed
+_DELETED = object()
+
+
+class StateStore:
+    """
+    Key-value state for a subscription's handlers, kept in a local SQLite file.
+
+    Writes go to an in-memory cache and are only written to the file when the store is checkpointed,
+    which happens every checkpoint_interval seconds, so a key that's updated many times
+    between checkpoints is only written once. Writes since the last checkpoint are lost if the process crashes.
+
+    Values must be json serialisable, they're encoded when they're set, so later changes to a value that has been set
+    don't change the store.
+    """
+    def __init__(
+            self,
+            path: str,
+            checkpoint_interval: float=5.0,
+            on_checkpoint: Callable[[Dict[str, Any]], None]=None,
+    ):
+        """
+        :param path: Path of the SQLite file, created if it doesn't exist
+        :param checkpoint_interval: Seconds between checkpoints
+        :param on_checkpoint: Optional function called with the changes of each checkpoint (deleted keys are None),
+        e.g. to save them to a shared database.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._checkpoint_interval = checkpoint_interval
+        self._on_checkpoint = on_checkpoint
+        # Json encoded values of the keys changed since the last checkpoint
+        self._dirty: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._checkpointer: Optional[threading.Thread] = None
+
+    def get(self, key: str, default: Any=None) -> Any:
+        """
+        Gets the value of a key.
+
+        :param key: Key to get
+        :param default: Value to return if the key doesn't exist
+        :return: The value of the key
+        """
+        with self._lock:
+            if key in self._dirty:
+                value = self._dirty[key]
+                return default if value is _DELETED else json.loads(value)
+            row = self._connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Sets the value of a key.
+
+        :param key: Key to set
+        :param value: Value of the key, raises a TypeError if it isn't json serialisable
+        """
+        encoded = json.dumps(value)
+        with self._lock:
+            self._dirty[key] = encoded
+        self._start_checkpointing()
+
+    def delete(self, key: str) -> None:
+        """
+        Deletes a key, if it exists.
+
+        :param key: Key to delete
+        """
+        with self._lock:
+            self._dirty[key] = _DELETED
+        self._start_checkpointing()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _DELETED) is not _DELETED
+
+    def checkpoint(self) -> None:
+        """
+        Writes all the changes since the last checkpoint to the file.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            changes, self._dirty = self._dirty, {}
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    [(key, value) for key, value in changes.items() if value is not _DELETED]
+                )
+                self._connection.executemany(
+                    "DELETE FROM state WHERE key = ?",
+                    [(key,) for key, value in changes.items() if value is _DELETED]
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                self._dirty = {**changes, **self._dirty}
+                raise
+
+        if self._on_checkpoint is not None:
+            self._on_checkpoint({key: None if value is _DELETED else json.loads(value) for key, value in changes.items()})
+
+    def close(self) -> None:
+        """
+        Checkpoints any remaining changes and closes the file.
+        """
+        self._closed.set()
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        self.checkpoint()
+        self._connection.close()
+
+    def _start_checkpointing(self) -> None:
+        if self._checkpointer is not None:
+            return
+        with self._lock:
+            if self._checkpointer is None:
+                self._checkpointer = threading.Thread(target=self._checkpoint_periodically, daemon=True)
+                self._checkpointer.start()
+
+    def _checkpoint_periodically(self) -> None:
+        while not self._closed.wait(self._checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Exception as error:
+                print(f"Error: Unable to checkpoint state: {error}")
@@ -1,67 +1,271 @@
 import asyncio
+import contextvars
 import inspect
+import math
+import os
 import signal
+import threading
+import time
 import typing
 from asyncio import AbstractEventLoop
-from typing import Optional, Dict, Callable, Set
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Optional, Dict, Callable, Set, List, Awaitable
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from google.cloud import pubsub_v1
-from google.api_core.exceptions import AlreadyExists
+from google.api_core.exceptions import AlreadyExists, NotFound
 from google.auth.api_key import Credentials
+from google.cloud.pubsub_v1.subscriber.futures import StreamingPullFuture
 from google.cloud.pubsub_v1.subscriber.message import Message
-from google.cloud.pubsub_v1.types import message
-from google.pubsub_v1 import Subscription, SubscriberClient
+from google.cloud.pubsub_v1.types import message, FlowControl
+from google.pubsub_v1 import Subscription, SubscriberClient, DeadLetterPolicy, RetryPolicy, ExpirationPolicy, Snapshot
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
 from python_publish_subscribe.config import Config
-from python_publish_subscribe.src.helper import build_and_save_topic_string, is_subscription_subscription_path
+from python_publish_subscribe.src.Concurrency import AdaptiveConcurrencyLimiter
+from python_publish_subscribe.src.Metrics import (
+    metrics, MESSAGES_RECEIVED, MESSAGES_ACKED, MESSAGES_NACKED, HANDLER_LATENCY, MESSAGES_IN_FLIGHT, EXECUTOR_QUEUE_DEPTH,
+)
+from python_publish_subscribe.src.Ordering import OrderingKeyScheduler
+from python_publish_subscribe.src.Profiling import profiler, PhaseTimer
+from python_publish_subscribe.src.Router import MessageRouter
+from python_publish_subscribe.src.StateStore import StateStore
+from python_publish_subscribe.src.Tracing import consume_span
+from python_publish_subscribe.src.helper import build_and_save_topic_string, is_subscription_subscription_path, build_topic_string
 from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper, create_engine_from_url
+from python_publish_subscribe.src.db.Ledger import MessageLedger
+from python_publish_subscribe.src.db.OffloadedSession import OffloadedSession
+from python_publish_subscribe.src.db.Sharding import ShardRouter
 
 _SYNC_EXECUTOR = ThreadPoolExecutor()
+EXECUTOR_QUEUE_DEPTH.set_function(lambda: _SYNC_EXECUTOR._work_queue.qsize())
 
-async def _handle_message(message, callback):
-    wants_session = 'session' in inspect.signature(callback).parameters
+# Max seconds an ack deadline can be set to
+MAX_ACK_DEADLINE = 600
+# Max number of messages whose failed attempts are remembered, when Pub/Sub doesn't count them
+MAX_TRACKED_RETRIES = 10000
+# Max number of messages handled at once by adaptive subscriptions without a max_concurrency, the client's default
+DEFAULT_MAX_CONCURRENCY = 1000
+
+def _create_session(database: str=None) -> Session:
+    return DatabaseHelper.create_session(database) if database is not None else DatabaseHelper.create_session()
+
+
+def _create_async_session(database: str=None) -> AsyncSession:
+    return DatabaseHelper.create_async_session(database) if database is not None else DatabaseHelper.create_async_session()
+
+
+def _create_awaitable_session(database: str=None) -> AsyncSession | OffloadedSession:
+    """
+    Creates a session for async handlers, which runs on the database thread pool if the engine is sync.
+    """
+    if DatabaseHelper.is_async():
+        return _create_async_session(database)
+    return OffloadedSession(_create_session(database))
+
+
+def _create_awaitable_read_session(database: str=None) -> AsyncSession | OffloadedSession:
+    if DatabaseHelper.is_async():
+        return DatabaseHelper.create_async_read_session(database)
+    return OffloadedSession(
+        DatabaseHelper.create_read_session(database) if database is not None else DatabaseHelper.create_read_session()
+    )
+
+
+async def _handle_message(
+        message,
+        callback,
+        state: StateStore=None,
+        timer: PhaseTimer=None,
+        ledger: MessageLedger=None,
+        database: str | ShardRouter=None,
+):
+    if timer is not None:
+        timer.mark('queue_wait')
+    if isinstance(database, ShardRouter):
+        database = database.route(message)
+    parameters = inspect.signature(callback).parameters
+    wants_session = 'session' in parameters
+    # Messages recorded in a ledger always need a session, so the ledger entry is committed with the handler's writes
+    uses_session = wants_session or ledger is not None
+    injected = {}
+    if 'state' in parameters:
+        injected['state'] = state
+    # Read sessions go to the read replicas, they're never committed
+    wants_read_session = 'read_session' in parameters
 
     if inspect.iscoroutinefunction(callback):
-        if wants_session and DatabaseHelper.is_setup():
-            if DatabaseHelper.is_async():
-                async with DatabaseHelper.create_async_session() as session:
+        read_session = None
+        if wants_read_session and DatabaseHelper.is_setup():
+            read_session = _create_awaitable_read_session(database)
+        if wants_read_session:
+            injected['read_session'] = read_session
+        try:
+            if uses_session and DatabaseHelper.is_setup():
+                # Sessions of sync engines are offloaded to the database thread pool, so they don't block the event loop
+                async with _create_awaitable_session(database) as session:
                     try:
-                        result = await callback(message, session)
+                        if ledger is not None and await ledger.is_processed_async(session, message.message_id):
+                            print(f"Info: Skipping message {message.message_id}, it has already been processed")
+                            return
+                        if timer is not None:
+                            timer.mark('dispatch')
+                        if wants_session:
+                            result = await callback(message, session, **injected)
+                        else:
+                            result = await callback(message, **injected)
+                        if timer is not None:
+                            timer.mark('handler')
                         if result is False:
                             raise ValueError("Callback returned False")
+                        if ledger is not None:
+                            await ledger.record_async(session, message.message_id)
                         await session.commit()
+                        if timer is not None:
+                            timer.mark('commit')
+                    except IntegrityError:
+                        await session.rollback()
+                        if ledger is None or not await ledger.is_processed_async(session, message.message_id):
+                            raise
+                        print(f"Info: Message {message.message_id} was processed by another delivery at the same time")
                     except Exception:
                         await session.rollback()
                         raise
             else:
-                print("Error: Async callback provided but using a synchronous database engine.")
-                raise RuntimeError(
-                    "Async callback provided but using a synchronous database engine "
-                    "Either make the callback synchronous or configure an async database engine."
-                )
-        else:
-            await callback(message)
+                if timer is not None:
+                    timer.mark('dispatch')
+                await callback(message, **injected)
+                if timer is not None:
+                    timer.mark('handler')
+        finally:
+            if read_session is not None:
+                await read_session.close()
 
     else:
         def sync_work():
             local_session = None
-            if wants_session:
-                local_session = DatabaseHelper.create_session()
+            if uses_session:
+                local_session = _create_session(database)
+            read_session = None
+            if wants_read_session and DatabaseHelper.is_setup():
+                read_session = DatabaseHelper.create_read_session(database)
             try:
-                callback(message, local_session) if wants_session else callback(message)
-                if wants_session:
+                if ledger is not None and ledger.is_processed(local_session, message.message_id):
+                    print(f"Info: Skipping message {message.message_id}, it has already been processed")
+                    return
+                if timer is not None:
+                    timer.mark('dispatch')
+                if wants_read_session:
+                    injected['read_session'] = read_session
+                callback(message, local_session, **injected) if wants_session else callback(message, **injected)
+                if timer is not None:
+                    timer.mark('handler')
+                if uses_session:
+                    if ledger is not None:
+                        ledger.record(local_session, message.message_id)
                     local_session.commit()
+                    if timer is not None:
+                        timer.mark('commit')
+            except IntegrityError:
+                if uses_session:
+                    local_session.rollback()
+                # Only a ledger's entry can show the message was processed by another delivery
+                if ledger is None or not ledger.is_processed(local_session, message.message_id):
+                    raise
+                print(f"Info: Message {message.message_id} was processed by another delivery at the same time")
             except Exception:
-                if wants_session:
+                if uses_session:
                     local_session.rollback()
                 raise
             finally:
-                if wants_session:
+                if uses_session:
                     local_session.close()
+                if read_session is not None:
+                    read_session.close()
 
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(_SYNC_EXECUTOR, sync_work)
+        # Run in a copy of the current context so the handler's trace context is kept in the executor thread
+        await loop.run_in_executor(_SYNC_EXECUTOR, contextvars.copy_context().run, sync_work)
+
+
+async def _handle_message_limited(
+        message,
+        callback,
+        limiter: Optional[asyncio.Semaphore | AdaptiveConcurrencyLimiter]=None,
+        state: StateStore=None,
+        subscription_name: str=None,
+        timer: PhaseTimer=None,
+        ledger: MessageLedger=None,
+        database: str | ShardRouter=None,
+):
+    """
+    Handles a message once the subscription's concurrency limiter allows it.
+
+    :param message: Message received
+    :param callback: Callback function for the subscription
+    :param limiter: Optional semaphore or adaptive limiter bounding how many handlers of the subscription run at once
+    :param state: Optional state store of the subscription, passed to callbacks with a `state` parameter
+    :param subscription_name: Optional name of the subscription, used to label the handler's metrics
+    :param timer: Optional timer of the phases of handling the message
+    :param ledger: Optional ledger of the subscription's processed messages, duplicates of which are skipped
+    :param database: Optional name of the database, or shard router, sessions are created on
+    """
+    if limiter is None:
+        return await _handle_message_observed(message, callback, state, subscription_name, timer, ledger, database)
+    async with limiter:
+        return await _handle_message_observed(message, callback, state, subscription_name, timer, ledger, database)
+
+
+async def _handle_message_observed(
+        message,
+        callback,
+        state: StateStore=None,
+        subscription_name: str=None,
+        timer: PhaseTimer=None,
+        ledger: MessageLedger=None,
+        database: str | ShardRouter=None,
+):
+    """
+    Handles a message within a span continuing the trace it was published in, recording the handler's latency.
+    """
+    with consume_span(message, subscription_name):
+        if not metrics.enabled:
+            return await _handle_message(message, callback, state, timer, ledger, database)
+        started = time.monotonic()
+        try:
+            return await _handle_message(message, callback, state, timer, ledger, database)
+        finally:
+            HANDLER_LATENCY.observe(time.monotonic() - started, subscription_name)
+
+
+def _build_flow_control(subscription_config: Dict) -> FlowControl:
+    """
+    Builds the streaming pull flow control settings of a subscription.
+
+    When a max concurrency is set, the client holds back any messages over the limit
+    instead of handing them to the callback, so they are never scheduled on the loop.
+
+    Leases of messages that are still being handled are extended by the client, each extension
+    is sized from the 99th percentile of the observed ack latency, which is the handler latency
+    since messages are only acked once their handler has finished.
+    The lease settings bound those extensions.
+
+    :param subscription_config: Configuration of the subscription
+    :return: Flow control settings
+    """
+    settings = {}
+    if subscription_config.get('max_concurrency'):
+        settings['max_messages'] = subscription_config['max_concurrency']
+    if subscription_config.get('max_lease_duration'):
+        settings['max_lease_duration'] = subscription_config['max_lease_duration']
+    if subscription_config.get('min_lease_extension'):
+        settings['min_duration_per_lease_extension'] = subscription_config['min_lease_extension']
+    if subscription_config.get('max_lease_extension'):
+        settings['max_duration_per_lease_extension'] = subscription_config['max_lease_extension']
+    return FlowControl(**settings)
 
 
 class Subscriber:
@@ -70,6 +274,19 @@ class Subscriber:
         self._config: Config = config
         self._subscriptions: Dict[str, Dict[str, Callable] | Dict[str, bool]] = {}
         self._loop = asyncio.get_event_loop()
+        self._streaming_pull_futures: Dict[str, StreamingPullFuture] = {}
+        self._in_flight: Set[Future] = set()
+        self._subscription_in_flight: Dict[str, Set[Future]] = {}
+        self._subscription_tasks: Dict[str, asyncio.Task] = {}
+        self._stopping: Set[str] = set()
+        self._resumed: Dict[str, threading.Event] = {}
+        self._shutdown_callbacks: List[Callable] = []
+        self._shutting_down: bool = False
+        self._retry_attempts: OrderedDict[str, int] = OrderedDict()
+        self._state_stores: Dict[str, StateStore] = {}
+        self._background_tasks: List[Callable[[], Awaitable]] = []
+        self._running_background_tasks: List[asyncio.Task] = []
+        MESSAGES_IN_FLIGHT.set_function(lambda: len(self._in_flight))
 
     def get_subscription_path(self, subscription_name: str) -> str:
         """
@@ -85,56 +302,636 @@ class Subscriber:
             return subscription_paths.get(subscription_name)
         return self._subscriber.subscription_path(self._config.get('PROJECT_ID'), subscription_name)
 
-    def add_subscription(self, subscription_name: str, callback: typing.Callable, exactly_once_delivery: bool=False) -> None:
+    def add_subscription(
+            self,
+            subscription_name: str,
+            callback: typing.Callable,
+            exactly_once_delivery: bool=False,
+            max_concurrency: int=None,
+            adaptive_concurrency: bool=False,
+            max_lease_duration: float=None,
+            min_lease_extension: float=None,
+            max_lease_extension: float=None,
+            min_retry_backoff: float=None,
+            max_retry_backoff: float=None,
+            when: Dict[str, str]=None,
+            ordered: bool=False,
+            ordering_attribute: str=None,
+            state: bool=False,
+            ledger: bool=False,
+            database: str | ShardRouter=None,
+    ) -> None:
         """
         Adds a preconfigured subscription, and it's callback function to the configuration, such that
         when app.run() is called it can be subscribed too correctly.
 
+        A subscription can have multiple callbacks by adding it again with different `when` conditions,
+        each message is then handled by the callback whose conditions match its attributes.
+        Options given when adding another callback update the subscription's options.
+
         :param subscription_name: name of the subscription
         :param callback: callback function for the subscription when a message is received
         :param exactly_once_delivery: if the subscription should use exactly once delivery
+        :param max_concurrency: Optional max number of messages handled at once for the subscription,
+        excess messages are held back by the client until a handler finishes.
+        :param adaptive_concurrency: If the number of messages handled at once should be adjusted
+        from the handlers' latency and errors, up to max_concurrency.
+        :param max_lease_duration: Optional max seconds a message's lease is extended for while it's handled,
+        after which it can be redelivered. Defaults to 1 hour.
+        :param min_lease_extension: Optional min seconds of each lease extension, between 10 and 600.
+        :param max_lease_extension: Optional max seconds of each lease extension, between 10 and 600.
+        :param min_retry_backoff: Optional seconds to wait before a message whose handler failed is redelivered,
+        doubled on each failed attempt. If not set failed messages are nacked and redelivered straight away.
+        :param max_retry_backoff: Optional max seconds to wait before a failed message is redelivered, at most 600.
+        :param when: Optional attributes and values, e.g. {"type": "order"}, a message needs to have to be handled
+        by the callback. A callback without conditions is the default for messages no other callback matches,
+        messages matching no callback at all are acked and dropped.
+        :param ordered: If messages with the same ordering key should be handled one at a time in the order
+        they were received, messages with different keys are still handled concurrently.
+        :param ordering_attribute: Optional attribute to use as the ordering key instead of the message's ordering key,
+        only used if ordered is set. Messages are then ordered by when the client's callback threads receive them,
+        which isn't guaranteed to be the order they were published in, unlike ordering keys.
+        :param state: If the subscription should have a local key-value state store,
+        which is passed to callbacks that have a `state` parameter.
+        :param ledger: If the IDs of processed messages should be recorded in a ledger table in the same transaction
+        as the callback's writes, so messages that are delivered again are skipped. Requires database connectivity.
+        Messages are then acked without waiting for a response, even if exactly_once_delivery is set.
+        :param database: Optional name of a database added with DatabaseHelper.add_engine, that the sessions
+        passed to callbacks are created on, or a ShardRouter picking the database from each message's key.
+        Defaults to the primary database.
         """
-        self._subscriptions[subscription_name] = {
-            'callback': callback,
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        for name, extension in (('min_lease_extension', min_lease_extension), ('max_lease_extension', max_lease_extension)):
+            if extension is not None and not 10 <= extension <= 600:
+                raise ValueError(f"{name} must be between 10 and 600 seconds")
+        if min_lease_extension and max_lease_extension and min_lease_extension > max_lease_extension:
+            raise ValueError("min_lease_extension can't be greater than max_lease_extension")
+        if max_retry_backoff is not None and max_retry_backoff > MAX_ACK_DEADLINE:
+            raise ValueError(f"max_retry_backoff can't be greater than {MAX_ACK_DEADLINE} seconds")
+        settings = {
             'exactly_once_delivery': exactly_once_delivery,
+            'max_concurrency': max_concurrency,
+            'adaptive_concurrency': adaptive_concurrency,
+            'max_lease_duration': max_lease_duration,
+            'min_lease_extension': min_lease_extension,
+            'max_lease_extension': max_lease_extension,
+            'min_retry_backoff': min_retry_backoff,
+            'max_retry_backoff': max_retry_backoff,
+            'ordered': ordered,
+            'ordering_attribute': ordering_attribute,
+            'state': state,
+            'ledger': ledger,
+            'database': database,
         }
 
+        subscription_config = self._subscriptions.get(subscription_name)
+        if subscription_config is None or (when is None and subscription_config.get('router') is None):
+            self._subscriptions[subscription_name] = {
+                'callback': callback if when is None else None,
+                **settings,
+                'router': None,
+            }
+            if when is not None:
+                router = MessageRouter()
+                router.add_route(callback, when)
+                self._subscriptions[subscription_name]['router'] = router
+            return
+
+        router = subscription_config.get('router')
+        if router is None:
+            router = MessageRouter()
+            router.add_route(subscription_config['callback'])
+            subscription_config['router'] = router
+        router.add_route(callback, when)
+        if when is None:
+            subscription_config['callback'] = callback
+        subscription_config.update({key: value for key, value in settings.items() if value})
+
         # self._subscriptions[subscription_name]["CALLBACK"] = callback
         # self._subscriptions[subscription_name]["EXACTLY_ONCE"] = exactly_once_delivery
 
-    def create_subscription(self, subscription_name, topic) -> Optional[Subscription]:
+    def get_state_store(self, subscription_name: str, on_checkpoint: Callable[[Dict[str, Any]], None]=None) -> StateStore:
+        """
+        Gets the state store of a subscription, creating it if it hasn't been opened yet.
+
+        The store is saved to STATE_STORE_PATH/<subscription_name>.sqlite and checkpointed
+        every STATE_CHECKPOINT_INTERVAL seconds.
+
+        :param subscription_name: Name of the subscription
+        :param on_checkpoint: Optional function called with the changes of each checkpoint (deleted keys are None),
+        e.g. to save them to a shared database, only used when the store is created
+        :return: The subscription's state store
+        """
+        if subscription_name not in self._state_stores:
+            path = os.path.join(
+                self._config.get(Config.ConfigKeys.STATE_STORE_PATH.name),
+                f"{subscription_name.split('/')[-1]}.sqlite",
+            )
+            self._state_stores[subscription_name] = StateStore(
+                path,
+                checkpoint_interval=float(self._config.get(Config.ConfigKeys.STATE_CHECKPOINT_INTERVAL.name)),
+                on_checkpoint=on_checkpoint,
+            )
+        return self._state_stores[subscription_name]
+
+    def create_subscription(
+            self,
+            subscription_name,
+            topic,
+            dead_letter_topic: str=None,
+            max_delivery_attempts: int=None,
+            min_retry_backoff: float=None,
+            max_retry_backoff: float=None,
+            filter: str=None,
+            ack_deadline: int=None,
+            enable_message_ordering: bool=None,
+            enable_exactly_once_delivery: bool=None,
+            message_retention_duration: float=None,
+            retain_acked_messages: bool=None,
+            expiration_ttl: float=None,
+    ) -> Optional[Subscription]:
         """
         Creates a new subscription in GCP Pub/Sub and returns it.
 
+        Options that aren't given are left to Pub/Sub's defaults. The options of a subscription that already exists
+        aren't changed, and its filter can't be changed at all, so a warning is printed if it doesn't match.
+
         :param topic: Name of the topic to subscribe to
         :param subscription_name: Subscription name
+        :param dead_letter_topic: Optional topic that messages are forwarded to once they have failed
+        max_delivery_attempts times, can either be the topic name or the complete topic path.
+        :param max_delivery_attempts: Optional number of delivery attempts before a message is dead lettered,
+        between 5 and 100, defaults to 5.
+        :param min_retry_backoff: Optional min seconds Pub/Sub waits before redelivering a nacked message.
+        :param max_retry_backoff: Optional max seconds Pub/Sub waits before redelivering a nacked message.
+        :param filter: Optional filter on the messages' attributes, e.g. 'attributes.type = "order"',
+        messages that don't match are acked by Pub/Sub without being delivered.
+        :param ack_deadline: Optional seconds (10-600) Pub/Sub waits for a message to be acked before redelivering it.
+        :param enable_message_ordering: If messages with the same ordering key should be delivered in the order they were published.
+        :param enable_exactly_once_delivery: If Pub/Sub shouldn't redeliver a message once it has been acked successfully.
+        :param message_retention_duration: Optional seconds (600-604800) unacked messages are kept for.
+        :param retain_acked_messages: If acked messages should also be kept, so the subscription can be seeked back to them.
+        :param expiration_ttl: Optional seconds of inactivity before the subscription is deleted, 0 means it never expires.
         :return: The subscription or None if there was an error correcting it.
         """
         path = self._subscriber.subscription_path(self._config.get('PROJECT_ID'), subscription_name)
         topic, topic_name = build_and_save_topic_string(topic, self._config.get(Config.ConfigKeys.PROJECT_ID.name), self._config)
         self._config.add_value_to_key(Config.ConfigKeys.SUBSCRIPTION_TOPICS.name, {subscription_name: path})
+
+        request = {'name': path, 'topic': topic}
+        if dead_letter_topic:
+            dead_letter_topic, _ = build_topic_string(dead_letter_topic, self._config.get(Config.ConfigKeys.PROJECT_ID.name))
+            request['dead_letter_policy'] = DeadLetterPolicy(
+                dead_letter_topic=dead_letter_topic,
+                max_delivery_attempts=max_delivery_attempts or 5,
+            )
+        if min_retry_backoff or max_retry_backoff:
+            retry_policy = {}
+            if min_retry_backoff:
+                retry_policy['minimum_backoff'] = timedelta(seconds=min_retry_backoff)
+            if max_retry_backoff:
+                retry_policy['maximum_backoff'] = timedelta(seconds=max_retry_backoff)
+            request['retry_policy'] = RetryPolicy(**retry_policy)
+        if filter:
+            request['filter'] = filter
+        if ack_deadline is not None:
+            request['ack_deadline_seconds'] = ack_deadline
+        if enable_message_ordering is not None:
+            request['enable_message_ordering'] = enable_message_ordering
+        if enable_exactly_once_delivery is not None:
+            request['enable_exactly_once_delivery'] = enable_exactly_once_delivery
+        if message_retention_duration is not None:
+            request['message_retention_duration'] = timedelta(seconds=message_retention_duration)
+        if retain_acked_messages is not None:
+            request['retain_acked_messages'] = retain_acked_messages
+        if expiration_ttl is not None:
+            # A policy without a ttl means the subscription never expires
+            request['expiration_policy'] = ExpirationPolicy(ttl=timedelta(seconds=expiration_ttl)) \
+                if expiration_ttl else ExpirationPolicy()
+
         try:
-            subscription = self._subscriber.create_subscription(name=path, topic=topic)
+            subscription = self._subscriber.create_subscription(**request)
             return subscription
         except AlreadyExists:
             print("Warning: Subscription {subscription} already exists".format(subscription=subscription_name))
-            return self._subscriber.get_subscription({"subscription": path})
+            subscription = self._subscriber.get_subscription({"subscription": path})
+            if filter and getattr(subscription, 'filter', filter) != filter:
+                print("Warning: Subscription {subscription} has the filter '{existing}' instead of '{filter}', "
+                      "the filter of an existing subscription can't be changed"
+                      .format(subscription=subscription_name, existing=subscription.filter, filter=filter))
+            return subscription
         except Exception as error:
             print("Error: Something went wrong when creating subscription {subscription}: {error}"
                   .format(subscription=path, error=error))
             return None
 
+    def subscription_exists(self, subscription_name: str) -> bool:
+        """
+        Checks if a subscription exists.
+
+        :param subscription_name: Subscription name
+        :return: If the subscription exists.
+        """
+        try:
+            self._subscriber.get_subscription({"subscription": self.get_subscription_path(subscription_name)})
+            return True
+        except NotFound:
+            return False
+
+    def get_snapshot_path(self, snapshot_name: str) -> str:
+        """
+        Gets the path of a snapshot.
+
+        :param snapshot_name: Name of the snapshot or its complete path
+        :return: snapshot path
+        """
+        if snapshot_name.startswith('projects/'):
+            return snapshot_name
+        return self._subscriber.snapshot_path(self._config.get(Config.ConfigKeys.PROJECT_ID.name), snapshot_name)
+
+    def create_snapshot(self, snapshot_name: str, subscription_name: str) -> Optional[Snapshot]:
+        """
+        Creates a snapshot of a subscription's acknowledgement state in GCP Pub/Sub,
+        which the subscription (or another subscription of the same topic) can later be seeked back to.
+
+        :param snapshot_name: Name of the snapshot
+        :param subscription_name: Name of the subscription to snapshot
+        :return: The snapshot or None if there was an error creating it.
+        """
+        path = self.get_snapshot_path(snapshot_name)
+        try:
+            return self._subscriber.create_snapshot(name=path, subscription=self.get_subscription_path(subscription_name))
+        except AlreadyExists:
+            print("Warning: Snapshot {snapshot} already exists".format(snapshot=snapshot_name))
+            return self._subscriber.get_snapshot({"snapshot": path})
+        except Exception as error:
+            print("Error: Something went wrong when creating snapshot {snapshot}: {error}"
+                  .format(snapshot=path, error=error))
+            return None
+
+    def seek(self, subscription_name: str, time: datetime=None, snapshot: str=None) -> bool:
+        """
+        Seeks a subscription to a point in time or to a snapshot.
+
+        Seeking to a time marks every message published after it as unacknowledged, so they are delivered again,
+        as long as they are still retained (see the subscription's retain_acked_messages and retention duration).
+        Seeking to a snapshot restores the acknowledgement state the subscription had when the snapshot was created.
+
+        :param subscription_name: Name of the subscription
+        :param time: Time to seek to
+        :param snapshot: Name or path of the snapshot to seek to
+        :return: If the seek succeeded
+        """
+        if (time is None) == (snapshot is None):
+            raise ValueError("Either time or snapshot must be given")
+        request = {'subscription': self.get_subscription_path(subscription_name)}
+        if time is not None:
+            request['time'] = time
+        else:
+            request['snapshot'] = self.get_snapshot_path(snapshot)
+
+        try:
+            self._subscriber.seek(request=request)
+            return True
+        except Exception as error:
+            print("Error: Something went wrong when seeking {subscription}: {error}"
+                  .format(subscription=subscription_name, error=error))
+            return False
+
     def start_subscription_tasks(self) -> None:
         """
         Starts listening and handling subscriptions asynchronously.
         """
         try:
             if not self._loop.is_running():
+                self._add_signal_handlers()
+                self._add_profiling_signal_handler()
+                for background_task in self._background_tasks:
+                    self._running_background_tasks.append(self._loop.create_task(background_task()))
                 self._loop.create_task(self._subscribe_to_subscriptions())
                 self._loop.run_forever()
         except KeyboardInterrupt:
             print("Info: Interrupted, stopping listening to subscriptions")
 
+    def _add_signal_handlers(self) -> None:
+        """
+        Makes SIGTERM and SIGINT trigger a graceful shutdown instead of killing the process
+        with messages still being handled.
+        """
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(signal_number, self._on_shutdown_signal, signal_number)
+            except (NotImplementedError, RuntimeError):
+                # Signal handlers can only be added from the main thread on unix event loops
+                pass
+
+    def _add_profiling_signal_handler(self) -> None:
+        """
+        Makes SIGUSR1 toggle the sampling profiler, when it's stopped the collapsed stacks of each subscription
+        are written to PROFILE_PATH.
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        try:
+            self._loop.add_signal_handler(signal.SIGUSR1, self.toggle_profiling)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    def toggle_profiling(self) -> None:
+        """
+        Starts the sampling profiler, or stops it and writes the samples of each subscription to PROFILE_PATH.
+        """
+        if not profiler.sampling:
+            profiler.start_sampling()
+            return
+        profiler.stop_sampling()
+        for path in profiler.dump(self._config.get(Config.ConfigKeys.PROFILE_PATH.name)):
+            print(f"Info: Wrote profile {path}")
+
+    def _on_shutdown_signal(self, signal_number: int) -> None:
+        print(f"Info: Received {signal.Signals(signal_number).name}, shutting down")
+        self._loop.create_task(self.shutdown())
+
+    def add_background_task(self, task: Callable[[], Awaitable]) -> None:
+        """
+        Adds a coroutine function to run on the event loop alongside the subscriptions, e.g. a metrics server.
+        It's started when the subscriptions are started and cancelled during a shutdown.
+
+        :param task: Coroutine function to run
+        """
+        self._background_tasks.append(task)
+
+    def add_shutdown_callback(self, callback: Callable) -> None:
+        """
+        Adds a function to call once all subscriptions have been stopped during a shutdown.
+        Coroutine functions are awaited, normal functions are run in an executor.
+        A function with a `timeout` parameter is given the seconds left before the shutdown timeout.
+
+        :param callback: Function to call on shutdown
+        """
+        self._shutdown_callbacks.append(callback)
+
+    async def shutdown(self, timeout: float=None) -> None:
+        """
+        Gracefully stops listening to all subscriptions.
+
+        New messages are nacked straight away, messages that are already being handled are given
+        until the timeout to finish and be acked, then the streaming pulls are closed
+        (which sends any pending acks) and the shutdown callbacks are called before the loop is stopped.
+        The timeout is a deadline for the whole shutdown, each step only waits for the time that's left of it,
+        which is passed to shutdown callbacks that have a `timeout` parameter.
+
+        :param timeout: Seconds the shutdown can take, defaults to SHUTDOWN_TIMEOUT in the config
+        """
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        if timeout is None:
+            timeout = float(self._config.get(Config.ConfigKeys.SHUTDOWN_TIMEOUT.name))
+        deadline = time.monotonic() + timeout
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        # Let callbacks held by paused subscriptions through, so they nack their messages
+        for resumed in self._resumed.values():
+            resumed.set()
+
+        loop = asyncio.get_running_loop()
+        in_flight = [asyncio.wrap_future(future) for future in list(self._in_flight)]
+        if in_flight:
+            print(f"Info: Waiting for {len(in_flight)} in-flight messages to finish")
+            _, pending = await asyncio.wait(in_flight, timeout=remaining())
+            if pending:
+                print(f"Warning: {len(pending)} messages were still being handled when the shutdown timeout was reached")
+
+        for streaming_pull_future in self._streaming_pull_futures.values():
+            streaming_pull_future.cancel()
+        for subscription_name, streaming_pull_future in list(self._streaming_pull_futures.items()):
+            try:
+                await loop.run_in_executor(None, streaming_pull_future.result, remaining())
+            except Exception as error:
+                print(f"Warning: Subscription {subscription_name} did not close cleanly: {error}")
+
+        # The tasks would otherwise still be pending when the loop is stopped
+        current = asyncio.current_task()
+        tasks = [task for task in [*self._subscription_tasks.values(), *self._running_background_tasks] if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for subscription_name, state_store in self._state_stores.items():
+            try:
+                await loop.run_in_executor(None, state_store.close)
+            except Exception as error:
+                print(f"Error: Unable to close the state store of {subscription_name}: {error}")
+
+        for callback in self._shutdown_callbacks:
+            try:
+                kwargs = {'timeout': remaining()} if 'timeout' in inspect.signature(callback).parameters else {}
+                if inspect.iscoroutinefunction(callback):
+                    await callback(**kwargs)
+                else:
+                    await loop.run_in_executor(None, lambda: callback(**kwargs))
+            except Exception as error:
+                print(f"Error: Something went wrong during shutdown: {error}")
+
+        print("Info: Shutdown complete")
+        self._loop.stop()
+
+    def _nack(self, message: Message, subscription_config: Dict) -> None:
+        """
+        Nacks a message whose handler failed.
+
+        If the subscription has a retry backoff, the message's ack deadline is set to the backoff instead,
+        doubling with each failed attempt, and it's released from lease management so that
+        it is only redelivered once the backoff has passed rather than straight away.
+
+        :param message: Message to nack
+        :param subscription_config: Configuration of the subscription the message was received on
+        """
+        min_retry_backoff = subscription_config.get('min_retry_backoff')
+        if not min_retry_backoff:
+            message.nack()
+            return
+
+        attempt = message.delivery_attempt or self._count_failed_attempt(message.message_id)
+        max_retry_backoff = subscription_config.get('max_retry_backoff') or MAX_ACK_DEADLINE
+        backoff = min(max_retry_backoff, min_retry_backoff * 2 ** (attempt - 1))
+        # Ack deadlines are whole seconds, and a deadline of 0 would redeliver the message straight away
+        message.modify_ack_deadline(max(1, math.ceil(backoff)))
+        message.drop()
+
+    def _count_failed_attempt(self, message_id: str) -> int:
+        """
+        Counts the failed attempts of a message, for subscriptions without a dead letter policy
+        where Pub/Sub doesn't count delivery attempts.
+        Only the most recent messages are remembered.
+
+        :param message_id: ID of the message that failed
+        :return: Number of failed attempts, including this one
+        """
+        attempt = self._retry_attempts.pop(message_id, 0) + 1
+        self._retry_attempts[message_id] = attempt
+        if len(self._retry_attempts) > MAX_TRACKED_RETRIES:
+            self._retry_attempts.popitem(last=False)
+        return attempt
+
+    def _ack(self, message: Message, confirm: bool=False) -> None:
+        """
+        Acks a message whose handler succeeded.
+
+        :param message: Message to ack
+        :param confirm: If the ack should be confirmed, for exactly-once delivery,
+        a failed ack is logged as the message will be redelivered
+        """
+        if self._retry_attempts:
+            self._retry_attempts.pop(message.message_id, None)
+        if not confirm:
+            message.ack()
+            return
+
+        def log_failed_ack(ack_future):
+            error = ack_future.exception()
+            if error is not None:
+                print(f"Warning: Ack of message {message.message_id} failed, it will be redelivered: {error}")
+        message.ack_with_response().add_done_callback(log_failed_ack)
+
+    def _track_in_flight(self, future: Future, subscription_name: str=None) -> None:
+        """
+        Keeps track of a message that is being handled until it has finished.
+
+        :param future: Future of the message's handler
+        :param subscription_name: Optional name of the subscription the message was received on
+        """
+        self._in_flight.add(future)
+        future.add_done_callback(self._in_flight.discard)
+        if subscription_name is not None:
+            subscription_in_flight = self._subscription_in_flight.setdefault(subscription_name, set())
+            subscription_in_flight.add(future)
+            future.add_done_callback(subscription_in_flight.discard)
+
+    def start_subscription(self, subscription_name: str, callback: typing.Callable=None, **subscription_options) -> None:
+        """
+        Starts listening to a subscription while the app is running, without affecting other subscriptions.
+        If the app isn't running yet, the subscription is started along with the others by app.run().
+        Can be called from any thread.
+
+        :param subscription_name: Name of the subscription
+        :param callback: Optional callback to add to the subscription, not needed if it has already been added
+        :param subscription_options: Options of the subscription if a callback is given, see add_subscription
+        """
+        if callback is not None:
+            self.add_subscription(subscription_name, callback, **subscription_options)
+        if subscription_name not in self._subscriptions:
+            raise ValueError(f"Subscription {subscription_name} hasn't been added")
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._start_subscription_task, subscription_name)
+
+    def _start_subscription_task(self, subscription_name: str) -> asyncio.Task:
+        """
+        Starts the task listening to a subscription, unless it's already running.
+
+        :param subscription_name: Name of the subscription
+        :return: The subscription's task
+        """
+        task = self._subscription_tasks.get(subscription_name)
+        if task is not None and not task.done():
+            print(f"Warning: Subscription {subscription_name} is already running")
+            return task
+
+        task = asyncio.get_running_loop().create_task(
+            self._subscribe_to_subscription(subscription_name, self._subscriptions[subscription_name])
+        )
+        self._subscription_tasks[subscription_name] = task
+
+        def remove(finished: asyncio.Task) -> None:
+            if self._subscription_tasks.get(subscription_name) is finished:
+                del self._subscription_tasks[subscription_name]
+
+        task.add_done_callback(remove)
+        return task
+
+    async def stop_subscription(self, subscription_name: str, timeout: float=None) -> bool:
+        """
+        Stops listening to a subscription while the app is running, without affecting other subscriptions.
+
+        New messages are nacked, messages that are already being handled are given until the timeout to finish,
+        then the streaming pull is closed and the subscription's state store is closed.
+        The subscription keeps its callbacks and options, so it can be started again with start_subscription.
+        Must be awaited on the app's event loop, from other threads use asyncio.run_coroutine_threadsafe.
+
+        :param subscription_name: Name of the subscription
+        :param timeout: Seconds to wait for in-flight messages, defaults to SHUTDOWN_TIMEOUT in the config
+        :return: If the subscription was running
+        """
+        streaming_pull_future = self._streaming_pull_futures.get(subscription_name)
+        if streaming_pull_future is None or subscription_name in self._stopping:
+            print(f"Warning: Subscription {subscription_name} isn't running")
+            return False
+        if timeout is None:
+            timeout = float(self._config.get(Config.ConfigKeys.SHUTDOWN_TIMEOUT.name))
+
+        self._stopping.add(subscription_name)
+        try:
+            self._resumed[subscription_name].set()
+            in_flight = [asyncio.wrap_future(future) for future in list(self._subscription_in_flight.get(subscription_name, ()))]
+            if in_flight:
+                _, pending = await asyncio.wait(in_flight, timeout=timeout)
+                if pending:
+                    print(f"Warning: {len(pending)} messages of {subscription_name} were still being handled when it was stopped")
+
+            streaming_pull_future.cancel()
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, streaming_pull_future.result, timeout)
+            except Exception as error:
+                print(f"Warning: Subscription {subscription_name} did not close cleanly: {error}")
+            self._streaming_pull_futures.pop(subscription_name, None)
+
+            task = self._subscription_tasks.get(subscription_name)
+            if task is not None:
+                await asyncio.wait([task], timeout=timeout)
+
+            state_store = self._state_stores.pop(subscription_name, None)
+            if state_store is not None:
+                await loop.run_in_executor(None, state_store.close)
+        finally:
+            self._stopping.discard(subscription_name)
+        return True
+
+    def pause(self, subscription_name: str) -> bool:
+        """
+        Pauses handling the messages of a running subscription, its connection stays open.
+
+        Messages received while paused are held (and their leases extended) until the subscription is resumed,
+        once max_concurrency messages are held no more are pulled.
+        Can be called from any thread.
+
+        :param subscription_name: Name of the subscription
+        :return: If the subscription is running
+        """
+        if subscription_name not in self._streaming_pull_futures:
+            print(f"Warning: Subscription {subscription_name} isn't running")
+            return False
+        self._resumed[subscription_name].clear()
+        return True
+
+    def resume(self, subscription_name: str) -> bool:
+        """
+        Resumes handling the messages of a paused subscription.
+        Can be called from any thread.
+
+        :param subscription_name: Name of the subscription
+        :return: If the subscription is running
+        """
+        if subscription_name not in self._streaming_pull_futures:
+            print(f"Warning: Subscription {subscription_name} isn't running")
+            return False
+        self._resumed[subscription_name].set()
+        return True
+
 
     async def _subscribe_to_subscription(self, subscription_name: str, subscription_config: Dict[str, Callable] | Dict[str, bool]) -> None:
         """
@@ -146,40 +943,95 @@ class Subscriber:
         """
         subscription_path = self.get_subscription_path(subscription_name)
 
+        max_concurrency = subscription_config.get('max_concurrency')
+        if subscription_config.get('adaptive_concurrency'):
+            limiter = AdaptiveConcurrencyLimiter(max_concurrency or DEFAULT_MAX_CONCURRENCY, name=subscription_name)
+        else:
+            limiter = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+        router = subscription_config.get('router')
+        scheduler = OrderingKeyScheduler() if subscription_config.get('ordered') else None
+        ordering_attribute = subscription_config.get('ordering_attribute')
+        database = subscription_config.get('database')
+        # Names of the databases the subscription's sessions are created on, None being the primary database
+        databases = database.databases if isinstance(database, ShardRouter) else [database]
+        try:
+            state = self.get_state_store(subscription_name) if subscription_config.get('state') else None
+            for name in databases:
+                if name is not None and not DatabaseHelper.has_engine(name):
+                    raise RuntimeError(f"Subscription {subscription_name} uses the database {name}, which hasn't been added")
+            ledger = None
+            if subscription_config.get('ledger'):
+                if not DatabaseHelper.is_setup():
+                    raise RuntimeError(f"Subscription {subscription_name} uses a ledger, which requires database connectivity")
+                ledger = MessageLedger(subscription_name)
+                for name in databases:
+                    await ledger.create_table(name)
+        except Exception as error:
+            # Nothing awaits this task, so the error would otherwise go unnoticed while the subscription never starts
+            print(f"Error: Unable to start subscription {subscription_name}, stopping the subscriber: {error}")
+            asyncio.ensure_future(self.shutdown())
+            return
+
+        for handler in router.callbacks() if router is not None else [subscription_config['callback']]:
+            profiler.register_handler(subscription_name, handler)
+
+        resumed = self._resumed.setdefault(subscription_name, threading.Event())
+        resumed.set()
+
+        def schedule(message: Message, handler: Callable, timer: Optional[PhaseTimer]) -> Future:
+            awaitable = _handle_message_limited(message, handler, limiter, state, subscription_name, timer, ledger, database)
+            if scheduler is not None:
+                key = message.attributes.get(ordering_attribute) if ordering_attribute else message.ordering_key
+                awaitable = scheduler.run_in_order(key, awaitable)
+            return asyncio.run_coroutine_threadsafe(awaitable, self._loop)
+
         def callback(message: Message):
+            if not resumed.is_set():
+                # Hold the message while the subscription is paused
+                resumed.wait()
+            if self._shutting_down or subscription_name in self._stopping:
+                message.nack()
+                return
+            if metrics.enabled:
+                MESSAGES_RECEIVED.inc(subscription_name)
+            timer = profiler.timer(subscription_name)
 
-            if subscription_config['exactly_once_delivery']:
-                ack_future = message.ack_with_response()
-
-                def done_callback(future):
-                    exception = future.exception()
-                    if exception:
-                        print("Error in handler:", exception)
-                        ack_future.nack()
-                    else:
-                        ack_future.ack()
-                future = asyncio.run_coroutine_threadsafe(
-                    _handle_message(message, subscription_config['callback']),
-                    self._loop
-                )
-                future.add_done_callback(done_callback)
-            else:
-                def done_callback(future):
-                    exception = future.exception()
-                    if exception:
-                        print("Error in handler:", exception)
-                        message.nack()
-                    else:
-                        message.ack()
-                future = asyncio.run_coroutine_threadsafe(
-                    _handle_message(message, subscription_config['callback']),
-                    self._loop
-                )
-                future.add_done_callback(done_callback)
-
-
-        streaming_pull_future = self._subscriber.subscribe(subscription_path, callback=callback)
+            handler = router.route(message) if router is not None else subscription_config['callback']
+            if handler is None:
+                print(f"Warning: No handler matches message {message.message_id} on {subscription_name}, dropping it")
+                message.ack()
+                return
+
+            # Acks are confirmed with exactly-once delivery, unless the ledger already makes the handling idempotent
+            confirm_ack = subscription_config['exactly_once_delivery'] and ledger is None
+
+            def done_callback(future):
+                exception = future.exception()
+                if exception:
+                    print("Error in handler:", exception)
+                    self._nack(message, subscription_config)
+                    if metrics.enabled:
+                        MESSAGES_NACKED.inc(subscription_name)
+                else:
+                    self._ack(message, confirm=confirm_ack)
+                    if metrics.enabled:
+                        MESSAGES_ACKED.inc(subscription_name)
+                    if timer is not None:
+                        timer.mark('ack')
+            future = schedule(message, handler, timer)
+            self._track_in_flight(future, subscription_name)
+            future.add_done_callback(done_callback)
+
+
+        streaming_pull_future = self._subscriber.subscribe(
+            subscription_path,
+            callback=callback,
+            flow_control=_build_flow_control(subscription_config),
+        )
+        self._streaming_pull_futures[subscription_name] = streaming_pull_future
         print(f"Info: Listening for messages on {subscription_name}")
+        pruning = asyncio.ensure_future(self._prune_ledger_periodically(ledger, databases)) if ledger is not None else None
 
         try:
             await asyncio.wrap_future(streaming_pull_future)
@@ -190,11 +1042,33 @@ class Subscriber:
             print(f"Error: Something went wrong when listening to {subscription_name}: {error}")
         finally:
             streaming_pull_future.cancel()
+            if pruning is not None:
+                pruning.cancel()
+            if self._streaming_pull_futures.get(subscription_name) is streaming_pull_future:
+                del self._streaming_pull_futures[subscription_name]
+
+    async def _prune_ledger_periodically(self, ledger: MessageLedger, databases: List[Optional[str]]=None) -> None:
+        """
+        Removes old entries from a subscription's ledger every LEDGER_PRUNE_INTERVAL seconds,
+        keeping those processed in the last LEDGER_RETENTION seconds.
+
+        :param ledger: Ledger of the subscription
+        :param databases: Names of the databases the ledger is in, None being the primary database
+        """
+        interval = float(self._config.get(Config.ConfigKeys.LEDGER_PRUNE_INTERVAL.name))
+        retention = timedelta(seconds=float(self._config.get(Config.ConfigKeys.LEDGER_RETENTION.name)))
+        while True:
+            await asyncio.sleep(interval)
+            for database in databases or [None]:
+                try:
+                    await ledger.prune(retention, database)
+                except Exception as error:
+                    print(f"Error: Unable to prune the ledger of {ledger.subscription_name}: {error}")
 
     async def _subscribe_to_subscriptions(self) -> None:
         """
         Listens to all subscriptions that the subscriber currently has configured.
-        Each subscription will be listened to in a new asyncio task.
+        Each subscription will be listened to in a new asyncio task, which can be stopped with stop_subscription.
         """
-        tasks = [self._subscribe_to_subscription(subscription, subscription_config) for subscription, subscription_config in self._subscriptions.items()]
+        tasks = [self._start_subscription_task(subscription) for subscription in list(self._subscriptions)]
         await asyncio.gather(*tasks)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.Publisher import Publisher
+from python_publish_subscribe.src.Subscriber import Subscriber
+
+
+def _fingerprint(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Topology:
+    """
+    The topics and subscriptions an app needs, declared up front and provisioned together when the app starts.
+
+    Resources are created concurrently, topics before the subscriptions on them, with at most
+    TOPOLOGY_MAX_WORKERS admin requests at once. Resources that have been created or found to exist are saved
+    to a local cache at TOPOLOGY_CACHE_PATH, keyed by project, along with a fingerprint of their options,
+    so restarts only check that a resource whose declaration hasn't changed still exists, instead of creating it.
+    Cached resources that were deleted, e.g. subscriptions that expired, are created again.
+    """
+    def __init__(self, publisher: Publisher, subscriber: Subscriber, config: Config):
+        """
+        :param publisher: Publisher used to create topics
+        :param subscriber: Subscriber used to create subscriptions
+        :param config: App config
+        """
+        self._publisher = publisher
+        self._subscriber = subscriber
+        self._config = config
+        self._topics: Dict[str, None] = {}
+        self._subscriptions: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+    def add_topic(self, topic_name: str) -> None:
+        """
+        Declares a topic to be created when the app starts.
+
+        :param topic_name: Name of the topic, can either be the complete topic path or just the topic name
+        """
+        self._topics[topic_name] = None
+
+    def add_subscription(self, subscription_name: str, topic_name: str, **options) -> None:
+        """
+        Declares a subscription to be created when the app starts.
+
+        :param subscription_name: Name of the subscription
+        :param topic_name: Topic to subscribe to
+        :param options: Options for creating the subscription, see Subscriber.create_subscription
+        """
+        self._subscriptions[subscription_name] = (topic_name, options)
+
+    def provision(self) -> bool:
+        """
+        Creates the declared topics and subscriptions that aren't in the cache, or were deleted since they were cached.
+
+        :return: If all the declared resources were created or already exist
+        """
+        if not self._topics and not self._subscriptions:
+            return True
+
+        cache = self._load_cache()
+        project_id = str(self._config.get(Config.ConfigKeys.PROJECT_ID.name))
+        project = cache.setdefault(project_id, {'topics': {}, 'subscriptions': {}})
+
+        provisioned = True
+        with ThreadPoolExecutor(
+                max_workers=int(self._config.get(Config.ConfigKeys.TOPOLOGY_MAX_WORKERS.name) or 1),
+                thread_name_prefix='topology',
+        ) as executor:
+            # Cached resources could have been deleted since, e.g. a subscription that expired, so check they still exist
+            cached_topics = [
+                topic_name for topic_name in self._topics
+                if project['topics'].get(topic_name) == _fingerprint(topic_name)
+            ]
+            cached_subscriptions = [
+                subscription_name for subscription_name, (topic_name, options) in self._subscriptions.items()
+                if project['subscriptions'].get(subscription_name) == _fingerprint([topic_name, options])
+            ]
+            deleted_topics = self._deleted(executor, self._publisher.topic_exists, cached_topics)
+            deleted_subscriptions = self._deleted(executor, self._subscriber.subscription_exists, cached_subscriptions)
+
+            topics = {
+                topic_name: _fingerprint(topic_name) for topic_name in self._topics
+                if topic_name not in cached_topics or topic_name in deleted_topics
+            }
+            subscriptions = {
+                subscription_name: _fingerprint([topic_name, options])
+                for subscription_name, (topic_name, options) in self._subscriptions.items()
+                if subscription_name not in cached_subscriptions or subscription_name in deleted_subscriptions
+            }
+            for topic_name in deleted_topics:
+                print(f"Warning: Topic {topic_name} was deleted, it will be created again")
+                del project['topics'][topic_name]
+            for subscription_name in deleted_subscriptions:
+                print(f"Warning: Subscription {subscription_name} was deleted, it will be created again")
+                del project['subscriptions'][subscription_name]
+            if not topics and not subscriptions:
+                return True
+
+            # Topics go first, as a subscription can't be created before its topic
+            created = dict(zip(topics, executor.map(self._publisher.create_topic, topics)))
+            for topic_name, was_created in created.items():
+                if was_created:
+                    project['topics'][topic_name] = topics[topic_name]
+                else:
+                    provisioned = False
+
+            results = executor.map(
+                lambda subscription_name: self._create_subscription(subscription_name, *self._subscriptions[subscription_name]),
+                subscriptions,
+            )
+            for subscription_name, was_created in zip(subscriptions, results):
+                if was_created:
+                    project['subscriptions'][subscription_name] = subscriptions[subscription_name]
+                else:
+                    provisioned = False
+
+        self._save_cache(cache)
+        return provisioned
+
+    @staticmethod
+    def _deleted(executor: ThreadPoolExecutor, exists: Callable[[str], bool], names: List[str]) -> Set[str]:
+        """
+        Checks which of the given resources no longer exist, an error checking a resource is printed and it's assumed to exist.
+
+        :param executor: Executor the checks are made on
+        :param exists: Function checking if a resource exists
+        :param names: Names of the resources
+        :return: Names of the resources that don't exist
+        """
+        def check(name: str) -> bool:
+            try:
+                return exists(name)
+            except Exception as error:
+                print(f"Warning: Unable to check if {name} exists, assuming it does: {error}")
+                return True
+        return {name for name, found in zip(names, executor.map(check, names)) if not found}
+
+    def _create_subscription(self, subscription_name: str, topic_name: str, options: Dict[str, Any]) -> bool:
+        return self._subscriber.create_subscription(subscription_name, topic_name, **options) is not None
+
+    def _load_cache(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        path = self._config.get(Config.ConfigKeys.TOPOLOGY_CACHE_PATH.name)
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as file:
+                cache = json.load(file)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError) as error:
+            print(f"Warning: Unable to read the topology cache {path}, it will be rebuilt: {error}")
+            return {}
+
+    def _save_cache(self, cache: Dict[str, Dict[str, Dict[str, str]]]) -> None:
+        path = self._config.get(Config.ConfigKeys.TOPOLOGY_CACHE_PATH.name)
+        if not path:
+            return
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary_path = f'{path}.tmp'
+            with open(temporary_path, 'w') as file:
+                json.dump(cache, file, indent=2, sort_keys=True)
+            os.replace(temporary_path, path)
+        except OSError as error:
+            print(f"Warning: Unable to save the topology cache {path}: {error}")
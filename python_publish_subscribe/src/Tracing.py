@@ -0,0 +1,121 @@
+import contextlib
+import re
+import secrets
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind
+except ImportError:
+    propagate = trace = SpanKind = None
+
+TRACEPARENT = 'traceparent'
+TRACESTATE = 'tracestate'
+
+_TRACEPARENT_FORMAT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# Trace context of the message being handled when OpenTelemetry isn't installed: trace id, span id, flags, tracestate
+_current_context: ContextVar[Optional[Tuple[str, str, str, Optional[str]]]] = ContextVar('trace_context', default=None)
+
+_tracer = trace.get_tracer('python_publish_subscribe') if trace is not None else None
+
+
+def get_trace_context() -> Dict[str, str]:
+    """
+    Gets the W3C trace context (traceparent and tracestate) of the current span.
+
+    :return: The trace context, or an empty dict if there's no current trace
+    """
+    carrier = {}
+    if propagate is not None:
+        propagate.inject(carrier)
+        return carrier
+
+    current = _current_context.get()
+    if current is not None:
+        trace_id, span_id, flags, tracestate = current
+        carrier[TRACEPARENT] = f'00-{trace_id}-{span_id}-{flags}'
+        if tracestate:
+            carrier[TRACESTATE] = tracestate
+    return carrier
+
+
+def inject(attributes: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+    """
+    Adds the current trace context to the attributes of a message being published.
+
+    :param attributes: Attributes of the message, the given attributes take precedence over the trace context
+    :return: The attributes including the trace context, or the given attributes if there's no current trace
+    """
+    carrier = get_trace_context()
+    if not carrier:
+        return attributes
+    return {**carrier, **(attributes or {})}
+
+
+@contextlib.contextmanager
+def publish_span(topic_name: str) -> Iterator[None]:
+    """
+    Wraps publishing a message in a producer span, when OpenTelemetry is installed.
+
+    :param topic_name: Name of the topic being published to
+    """
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(
+            f'{topic_name} publish',
+            kind=SpanKind.PRODUCER,
+            attributes={'messaging.system': 'gcp_pubsub', 'messaging.destination.name': str(topic_name)},
+    ):
+        yield
+
+
+@contextlib.contextmanager
+def consume_span(message, subscription_name: Optional[str]) -> Iterator[None]:
+    """
+    Makes the trace context in a received message's attributes the current context while it's handled.
+
+    With OpenTelemetry a consumer span, whose parent is the span that published the message, is started,
+    so any spans started by the handler (e.g. database queries or publishes) are part of the same trace.
+    Without it, a new span id is generated so the trace context is still propagated to any messages published.
+
+    :param message: Message being handled
+    :param subscription_name: Name of the subscription the message was received on
+    """
+    attributes = message.attributes
+    traceparent = attributes.get(TRACEPARENT) if attributes else None
+
+    if _tracer is not None:
+        carrier = {TRACEPARENT: traceparent} if traceparent else {}
+        if carrier and attributes.get(TRACESTATE):
+            carrier[TRACESTATE] = attributes[TRACESTATE]
+        span_attributes = {
+            'messaging.system': 'gcp_pubsub',
+            'messaging.destination.subscription.name': str(subscription_name),
+            'messaging.message.id': message.message_id,
+        }
+        with _tracer.start_as_current_span(
+                f'{subscription_name} process',
+                context=propagate.extract(carrier),
+                kind=SpanKind.CONSUMER,
+                attributes=span_attributes,
+        ):
+            yield
+        return
+
+    match = _TRACEPARENT_FORMAT.match(traceparent) if traceparent else None
+    if match is None:
+        yield
+        return
+    token = _current_context.set((
+        match.group(1),
+        secrets.token_hex(8),
+        match.group(3),
+        attributes.get(TRACESTATE),
+    ))
+    try:
+        yield
+    finally:
+        _current_context.reset(token)
@@ -0,0 +1,314 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from google.cloud.pubsub_v1.subscriber.message import Message
+from google.cloud.pubsub_v1.types import FlowControl
+
+from python_publish_subscribe.src.Publisher import Publisher, convert_bytes_to_data
+from python_publish_subscribe.src.Subscriber import Subscriber, _SYNC_EXECUTOR, _create_async_session, _create_session
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.Sharding import ShardRouter
+
+# Seconds a window's messages can be held for after the window ends, while its result is emitted
+_EMIT_MARGIN = 60
+
+
+class TumblingWindow:
+    """
+    Fixed size windows that don't overlap, e.g. per-minute counts.
+    """
+    def __init__(self, size: float):
+        """
+        :param size: Length of each window in seconds
+        """
+        if size <= 0:
+            raise ValueError("Window size must be greater than 0")
+        self.size = size
+
+    def assign(self, timestamp: float) -> List[Tuple[float, float]]:
+        """
+        Gets the windows a message received at the timestamp belongs to.
+
+        :param timestamp: Time the message was received
+        :return: List of the start and end of each window
+        """
+        start = timestamp - timestamp % self.size
+        return [(start, start + self.size)]
+
+
+class SlidingWindow:
+    """
+    Fixed size windows that start every `slide` seconds, so a message can belong to more than one window,
+    e.g. the count over the last 5 minutes every minute.
+    """
+    def __init__(self, size: float, slide: float):
+        """
+        :param size: Length of each window in seconds
+        :param slide: Seconds between the start of each window
+        """
+        if size <= 0 or slide <= 0:
+            raise ValueError("Window size and slide must be greater than 0")
+        if slide > size:
+            raise ValueError("Window slide can't be greater than the window size")
+        self.size = size
+        self.slide = slide
+
+    def assign(self, timestamp: float) -> List[Tuple[float, float]]:
+        """
+        Gets the windows a message received at the timestamp belongs to.
+
+        :param timestamp: Time the message was received
+        :return: List of the start and end of each window
+        """
+        windows = []
+        start = timestamp - timestamp % self.slide
+        while start > timestamp - self.size:
+            windows.append((start, start + self.size))
+            start -= self.slide
+        return windows
+
+
+class SessionWindow:
+    """
+    Windows per key that stay open while messages keep arriving and close after `gap` seconds without any.
+    """
+    def __init__(self, gap: float):
+        """
+        :param gap: Seconds of inactivity after which a key's window closes
+        """
+        if gap <= 0:
+            raise ValueError("Session gap must be greater than 0")
+        self.gap = gap
+
+
+class _WindowState:
+    """
+    Running aggregate of a single window, along with the future the window's messages wait on.
+    """
+    __slots__ = ('key', 'start', 'end', 'count', 'total', 'minimum', 'maximum', 'emitted')
+
+    def __init__(self, key: Optional[str], start: float, end: float):
+        self.key = key
+        self.start = start
+        self.end = end
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.emitted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def add(self, value: Optional[float]) -> None:
+        self.count += 1
+        if value is None:
+            return
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            'key': self.key,
+            'window_start': datetime.fromtimestamp(self.start, tz=timezone.utc),
+            'window_end': datetime.fromtimestamp(self.end, tz=timezone.utc),
+            'count': self.count,
+            'sum': self.total,
+            'min': self.minimum,
+            'max': self.maximum,
+        }
+
+
+class WindowAggregator:
+    """
+    Aggregates the messages of a subscription over time windows.
+
+    Only the count, sum, min and max of each open window are kept in memory.
+    When a window closes its result is published to a topic and/or saved to a table,
+    and only then are the messages that contributed to it acked,
+    so if the process stops before then they are redelivered rather than lost.
+
+    Windows are based on when messages are received.
+    As messages are held until their windows close, max_in_flight has to be large enough
+    to hold all the messages received during a window, and their leases are extended until then.
+    The subscription's max_lease_duration is raised to cover the window's size (or a session's gap),
+    a session that stays active for longer than it has its messages redelivered and counted again.
+    """
+    def __init__(
+            self,
+            subscription_name: str,
+            window: TumblingWindow | SlidingWindow | SessionWindow,
+            publisher: Publisher,
+            subscriber: Subscriber,
+            key: Callable[[Any], str]=None,
+            value: Callable[[Any], float]=None,
+            emit_topic: str=None,
+            emit_model: Type=None,
+            max_in_flight: int=10000,
+            **subscription_options
+    ):
+        """
+        :param subscription_name: Name of the subscription to aggregate
+        :param window: The type of window to use
+        :param publisher: Publisher to emit results to a topic with
+        :param subscriber: Subscriber to add the subscription to
+        :param key: Optional function getting the key to aggregate by from the decoded message data,
+        if not given all messages are aggregated together.
+        :param value: Optional function getting the value to sum from the decoded message data,
+        if not given only messages are counted.
+        :param emit_topic: Topic to publish the result of each window to
+        :param emit_model: SQLAlchemy model to save the result of each window as, it's created with the result's keys:
+        key, window_start, window_end, count, sum, min and max.
+        :param max_in_flight: Max number of messages waiting for their windows to close
+        :param subscription_options: Any other options for the subscription, see Subscriber.add_subscription,
+        a `database` option is the named database emit_model is saved to. A `max_lease_duration` option has to be
+        longer than the window's size or session gap, it defaults to the longer of an hour and the window
+        """
+        if 'max_concurrency' in subscription_options:
+            raise ValueError("Use max_in_flight to limit how many messages are handled at once, not max_concurrency")
+        if emit_topic is None and emit_model is None:
+            raise ValueError("Either emit_topic or emit_model must be given")
+        database = subscription_options.get('database')
+        if isinstance(database, ShardRouter):
+            # A window's result aggregates many messages, which the router could assign to different shards
+            raise ValueError("Window results can't be sharded by message, give the name of a database instead")
+        self._database: Optional[str] = database
+        # Messages are held unacked until their window closes, if their leases expire before then
+        # they're redelivered and counted again
+        held_for = (window.gap if isinstance(window, SessionWindow) else window.size) + _EMIT_MARGIN
+        max_lease_duration = subscription_options.get('max_lease_duration')
+        if max_lease_duration is None:
+            subscription_options['max_lease_duration'] = max(FlowControl().max_lease_duration, held_for)
+        elif max_lease_duration < held_for:
+            raise ValueError(f"max_lease_duration must be at least {held_for} seconds, "
+                             f"so messages aren't redelivered before their window closes")
+        self._window = window
+        self._publisher = publisher
+        self._key = key
+        self._value = value
+        self._emit_topic = emit_topic
+        self._emit_model = emit_model
+        self._windows: Dict[Tuple[Optional[str], float], _WindowState] = {}
+        self._sessions: Dict[Optional[str], _WindowState] = {}
+        self._timer: Optional[asyncio.Task] = None
+
+        subscriber.add_subscription(
+            subscription_name,
+            self._handle,
+            max_concurrency=max_in_flight,
+            **subscription_options
+        )
+        subscriber.add_shutdown_callback(self.stop)
+
+    @property
+    def _tick(self) -> float:
+        """
+        How often to check for windows that have closed.
+        """
+        if isinstance(self._window, SessionWindow):
+            interval = self._window.gap
+        elif isinstance(self._window, SlidingWindow):
+            interval = self._window.slide
+        else:
+            interval = self._window.size
+        return min(1.0, interval / 4)
+
+    def _add(self, key: Optional[str], value: Optional[float], timestamp: float) -> List[asyncio.Future]:
+        """
+        Adds a message to the windows it belongs to.
+
+        :return: Futures that resolve once each of those windows has been emitted
+        """
+        if isinstance(self._window, SessionWindow):
+            state = self._sessions.get(key)
+            if state is None:
+                state = _WindowState(key, timestamp, timestamp + self._window.gap)
+                self._sessions[key] = state
+            state.end = timestamp + self._window.gap
+            state.add(value)
+            return [state.emitted]
+
+        emitted = []
+        for start, end in self._window.assign(timestamp):
+            state = self._windows.get((key, start))
+            if state is None:
+                state = _WindowState(key, start, end)
+                self._windows[(key, start)] = state
+            state.add(value)
+            emitted.append(state.emitted)
+        return emitted
+
+    async def _handle(self, message: Message) -> None:
+        if self._timer is None:
+            self._timer = asyncio.ensure_future(self._close_windows())
+
+        data = convert_bytes_to_data(message.data)
+        key = self._key(data) if self._key else None
+        value = self._value(data) if self._value else None
+        await asyncio.gather(*self._add(key, value, time.time()))
+
+    async def _close_windows(self) -> None:
+        while True:
+            await asyncio.sleep(self._tick)
+            await self.close_windows(time.time())
+
+    async def stop(self) -> None:
+        """
+        Stops checking for windows that have closed, called when the subscriber shuts down.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+
+    async def close_windows(self, now: float) -> None:
+        """
+        Emits all the windows that have ended by the given time.
+
+        :param now: Current time
+        """
+        closed = [window_key for window_key, state in self._windows.items() if state.end <= now]
+        states = [self._windows.pop(window_key) for window_key in closed]
+        closed = [key for key, state in self._sessions.items() if state.end <= now]
+        states += [self._sessions.pop(key) for key in closed]
+        await asyncio.gather(*[self._emit(state) for state in states])
+
+    async def _emit(self, state: _WindowState) -> None:
+        try:
+            result = state.result()
+            if self._emit_topic is not None:
+                message = {
+                    **result,
+                    'window_start': result['window_start'].isoformat(),
+                    'window_end': result['window_end'].isoformat(),
+                }
+                await asyncio.wrap_future(self._publisher.publish(self._emit_topic, message, asynchronous=True))
+            if self._emit_model is not None:
+                await self._save(result)
+            state.emitted.set_result(None)
+        except Exception as error:
+            print(f"Error: Unable to emit window {state.key} {state.start}-{state.end}: {error}")
+            state.emitted.set_exception(error)
+            # The window's messages may no longer be waiting on it, e.g. after a shutdown,
+            # retrieving the error stops it being logged as never retrieved
+            state.emitted.exception()
+
+    async def _save(self, result: Dict[str, Any]) -> None:
+        if DatabaseHelper.is_async():
+            async with _create_async_session(self._database) as session:
+                session.add(self._emit_model(**result))
+                await session.commit()
+            return
+
+        def save():
+            session = _create_session(self._database)
+            try:
+                session.add(self._emit_model(**result))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        await asyncio.get_running_loop().run_in_executor(_SYNC_EXECUTOR, save)
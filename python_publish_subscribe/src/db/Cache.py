@@ -0,0 +1,269 @@
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence, Set
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import inspect as inspect_orm
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstanceState, Session
+
+from python_publish_subscribe.src.Metrics import metrics
+
+CACHE_HITS = metrics.counter('pubsub_cache_hits_total', 'Number of lookups served from a cache', ['cache'])
+CACHE_MISSES = metrics.counter('pubsub_cache_misses_total', 'Number of lookups loaded because they weren\'t cached', ['cache'])
+
+# Attributes of invalidation messages: the cache to invalidate and the key, all caches/keys if they're missing
+CACHE_ATTRIBUTE = 'cache'
+KEY_ATTRIBUTE = 'key'
+
+
+class ReadThroughCache:
+    """
+    Keeps the results of lookups (e.g. reference data loaded from the database) in memory,
+    so handlers don't make a database round trip for every message.
+
+    Values expire `ttl` seconds after they were loaded and the least recently used values are evicted
+    once there are more than `max_size`. Concurrent lookups of the same missing key share a single load,
+    from handlers running on the event loop and in worker threads alike, so an expired key doesn't cause a stampede.
+
+    Values must be plain values (e.g. a column, a tuple or a dict), not ORM instances: an instance belongs to the session
+    that loaded it and is expired when that session commits, so later messages couldn't read it.
+    """
+    def __init__(self, name: str, ttl: float=300.0, max_size: int=1024):
+        """
+        :param name: Name of the cache, used to invalidate it and label its metrics
+        :param ttl: Seconds values are kept for after they're loaded
+        :param max_size: Max number of values kept
+        """
+        if ttl <= 0 or max_size < 1:
+            raise ValueError("A cache's ttl must be greater than 0 and its max_size at least 1")
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._values: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._loading: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so loads started before it don't store what could be a stale value
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any, Optional[Future], bool, int]:
+        """
+        Gets a cached value, or the load of the key to wait for, or claims the load of the key.
+
+        :return: If the value was cached, the value, the load future and if this caller has to load it
+        and the generation the load started in
+        """
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is not None:
+                expires, value = cached
+                if expires > time.monotonic():
+                    self._values.move_to_end(key)
+                    return True, value, None, False, self._generation
+                del self._values[key]
+            loading = self._loading.get(key)
+            if loading is not None:
+                return False, None, loading, False, self._generation
+            loading = Future()
+            self._loading[key] = loading
+            return False, None, loading, True, self._generation
+
+    def _finish(self, key: Hashable, loading: Future, generation: int, value: Any=None, error: BaseException=None) -> None:
+        with self._lock:
+            if self._loading.get(key) is loading:
+                del self._loading[key]
+            if error is None and generation == self._generation:
+                self._values[key] = (time.monotonic() + self.ttl, value)
+                self._values.move_to_end(key)
+                while len(self._values) > self.max_size:
+                    self._values.popitem(last=False)
+        if error is None:
+            loading.set_result(value)
+        else:
+            loading.set_exception(error)
+
+    def _record(self, hit: bool) -> None:
+        if metrics.enabled:
+            (CACHE_HITS if hit else CACHE_MISSES).inc(self.name)
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Gets a value, loading it if it isn't cached or has expired.
+
+        :param key: Key of the value
+        :param loader: Function loading the value, only called by one caller at a time for the same key
+        :return: The value
+        """
+        hit, value, loading, owner, generation = self._lookup(key)
+        self._record(hit)
+        if hit:
+            return value
+        if not owner:
+            return loading.result()
+        try:
+            value = loader()
+            _check_cacheable(self.name, value)
+        except BaseException as error:
+            self._finish(key, loading, generation, error=error)
+            raise
+        self._finish(key, loading, generation, value)
+        return value
+
+    async def get_async(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Gets a value, loading it if it isn't cached or has expired, without blocking the event loop.
+
+        :param key: Key of the value
+        :param loader: Function or coroutine function loading the value,
+        only called by one caller at a time for the same key
+        :return: The value
+        """
+        hit, value, loading, owner, generation = self._lookup(key)
+        self._record(hit)
+        if hit:
+            return value
+        if not owner:
+            return await asyncio.wrap_future(loading)
+        try:
+            value = loader()
+            if inspect.isawaitable(value):
+                value = await value
+            _check_cacheable(self.name, value)
+        except BaseException as error:
+            self._finish(key, loading, generation, error=error)
+            raise
+        self._finish(key, loading, generation, value)
+        return value
+
+    def invalidate(self, key: Hashable=None) -> None:
+        """
+        Removes a value, or all values, so they're loaded again the next time they're used.
+
+        :param key: Optional key of the value, all values are removed if it isn't given
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+                # Keys received in messages are strings, so also match keys that are e.g. integer IDs
+                for cached_key in [cached_key for cached_key in self._values if str(cached_key) == str(key)]:
+                    del self._values[cached_key]
+
+
+def _is_orm_instance(value: Any) -> bool:
+    return isinstance(inspect_orm(value, raiseerr=False), InstanceState)
+
+
+def _check_cacheable(name: str, value: Any) -> None:
+    """
+    Raises a TypeError if a value is, or directly holds, an ORM instance.
+
+    :param name: Name of the cache the value is loaded into
+    :param value: Value being loaded
+    """
+    if isinstance(value, Mapping):
+        items = list(value.values())
+    elif isinstance(value, (Sequence, Set)) and not isinstance(value, (str, bytes)):
+        items = list(value)
+    else:
+        items = []
+    if _is_orm_instance(value) or any(_is_orm_instance(item) for item in items):
+        raise TypeError(
+            f"Cache {name} can't keep ORM instances, as they're expired when the session that loaded them commits, "
+            f"cache plain values instead, e.g. a column, a tuple or a dict"
+        )
+
+
+_caches: Dict[str, ReadThroughCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, ttl: float=300.0, max_size: int=1024) -> ReadThroughCache:
+    """
+    Gets a cache by name, creating it if it doesn't exist.
+
+    :param name: Name of the cache
+    :param ttl: Seconds values are kept for, only used when the cache is created
+    :param max_size: Max number of values kept, only used when the cache is created
+    :return: The cache
+    """
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = ReadThroughCache(name, ttl=ttl, max_size=max_size)
+        return _caches[name]
+
+
+def invalidate(name: str=None, key: Hashable=None) -> None:
+    """
+    Invalidates a key or all of a cache, or every cache.
+
+    :param name: Optional name of the cache, every cache is invalidated if it isn't given
+    :param key: Optional key to invalidate, the whole cache is invalidated if it isn't given
+    """
+    with _caches_lock:
+        caches = list(_caches.values()) if name is None else [_caches[name]] if name in _caches else []
+    for cache in caches:
+        cache.invalidate(key)
+
+
+def invalidate_from_message(message) -> None:
+    """
+    Invalidates the cache and key given in a message's `cache` and `key` attributes,
+    every cache is invalidated if there's no `cache` attribute and the whole cache if there's no `key` attribute.
+
+    :param message: Invalidation message
+    """
+    attributes = message.attributes or {}
+    invalidate(attributes.get(CACHE_ATTRIBUTE) or None, attributes.get(KEY_ATTRIBUTE) or None)
+
+
+def _is_session(value: Any) -> bool:
+    # Offloaded sessions (given to async handlers on sync engines) wrap a sync session like AsyncSession does
+    return isinstance(value, (Session, AsyncSession)) or isinstance(getattr(value, 'sync_session', None), Session)
+
+
+def _cache_key(args: tuple, kwargs: dict) -> Hashable:
+    # Sessions aren't part of what's being looked up
+    args = tuple(arg for arg in args if not _is_session(arg))
+    kwargs = {name: value for name, value in kwargs.items() if not _is_session(value)}
+    if len(args) == 1 and not kwargs:
+        return args[0]
+    return args + tuple(sorted(kwargs.items()))
+
+
+def cached(name: str=None, ttl: float=300.0, max_size: int=1024) -> Callable:
+    """
+    Caches the results of a lookup function, keyed by its arguments other than any session,
+    e.g. `@cached(ttl=60) def get_country_name(session, code): return session.get(Country, code).name`.
+    The results must be plain values, returning an ORM instance raises a TypeError.
+
+    :param name: Optional name of the cache, defaults to the function's name
+    :param ttl: Seconds results are kept for
+    :param max_size: Max number of results kept
+    """
+    def decorator(func):
+        cache = get_cache(name or func.__qualname__, ttl=ttl, max_size=max_size)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await cache.get_async(_cache_key(args, kwargs), lambda: func(*args, **kwargs))
+            async_wrapper.cache = cache
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return cache.get(_cache_key(args, kwargs), lambda: func(*args, **kwargs))
+        wrapper.cache = cache
+        return wrapper
+    return decorator
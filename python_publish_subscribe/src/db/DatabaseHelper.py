@@ -1,11 +1,16 @@
+import asyncio
+import itertools
+from typing import Callable, Dict, List
+
 import sqlalchemy
 
 from python_publish_subscribe.config import Config
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import engine, create_engine, Connection
-from sqlalchemy import URL
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncConnection
+from sqlalchemy import engine, create_engine, text
+from sqlalchemy import URL, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
+from python_publish_subscribe.src.db.Cache import ReadThroughCache, cached, get_cache, invalidate
 from python_publish_subscribe.src.db.ORMUtility import get_base
 
 # Map of all the dialect names to respective start of url for sqlalchemy
@@ -13,9 +18,15 @@ DATABASE_DIALECTS = {
     'postgresql': 'postgresql',
     'psycopg2': 'postgresql+psycopg2',
     'asyncpg': 'postgresql+asyncpg',
+    'psycopg': 'postgresql+psycopg',
+    'psycopg_async': 'postgresql+psycopg_async',
     'pg8000': 'postgresql+pg8000',
     'mysql': 'mysql',
     'pymysql': 'mysql+pymysql',
+    'aiomysql': 'mysql+aiomysql',
+    'asyncmy': 'mysql+asyncmy',
+    'sqlite': 'sqlite',
+    'aiosqlite': 'sqlite+aiosqlite',
 }
 
 
@@ -35,6 +46,12 @@ def generate_database_url(dialect: str, username: str, password: str, port: str
     if dialect.lower() in DATABASE_DIALECTS:
         dialect = DATABASE_DIALECTS[dialect] or dialect
 
+    # SQLite only needs the path of the database file
+    if dialect.split('+')[0] == 'sqlite':
+        if not name or name.strip() == '':
+            print("Info: Using an in memory SQLite database since a database name was not provided in the configuration.")
+        return URL.create(dialect, database=name or None)
+
     database_name = name
     if not name or name.strip() == '':
         print("Warning: Database name is set to default_schema since one was not provided in the configuration.")
@@ -54,27 +71,111 @@ def generate_database_url(dialect: str, username: str, password: str, port: str
     )
 
 
-def create_engine_from_url(url: URL):
+def _to_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+# Config keys of the engine's pool settings, the function converting their values and the create_engine argument
+ENGINE_OPTIONS = (
+    (Config.ConfigKeys.DATABASE_POOL_SIZE, int, 'pool_size'),
+    (Config.ConfigKeys.DATABASE_MAX_OVERFLOW, int, 'max_overflow'),
+    (Config.ConfigKeys.DATABASE_POOL_RECYCLE, int, 'pool_recycle'),
+    (Config.ConfigKeys.DATABASE_POOL_PRE_PING, _to_bool, 'pool_pre_ping'),
+    (Config.ConfigKeys.DATABASE_POOL_TIMEOUT, float, 'pool_timeout'),
+    (Config.ConfigKeys.DATABASE_ECHO, _to_bool, 'echo'),
+)
+
+
+def get_engine_options(config: Config) -> dict:
+    """
+    Gets the engine's pool settings from the config, only the settings that have been set are included
+    so anything else is left to SQLAlchemy's defaults.
+
+    :param config: Config to get the settings from, values can be strings e.g. when loaded from a .env file.
+    :return: Keyword arguments for create_engine/create_async_engine.
+    """
+    options = {}
+    for key, convert, argument in ENGINE_OPTIONS:
+        value = config.get(key.name)
+        if value is None or value == '':
+            continue
+        try:
+            options[argument] = convert(value)
+        except (TypeError, ValueError):
+            print(f"Warning: Ignoring {key.name} since {value!r} isn't a valid value")
+    return options
+
+
+def is_async_url(url: str | URL) -> bool:
+    """
+    Checks if a database url uses an async driver, e.g. asyncpg, psycopg_async, aiomysql, asyncmy or aiosqlite.
+    It's what SQLAlchemy's dialect for the driver declares, so the driver itself doesn't need to be installed.
+
+    :param url: URL of the database.
+    :return: If the driver is async.
+    """
+    return bool(make_url(url).get_dialect().is_async)
+
+
+def create_engine_from_url(url: URL, **engine_options):
     """
     Creates an engine from a database url.
 
     If the driver is an async driver it creates an async engine.
     :param url: URL of the database.
+    :param engine_options: Optional pool settings passed to the engine, e.g. pool_size or pool_pre_ping.
     :return: sync/async engine and if it's async.
     """
-    if "asyncpg" in url.drivername or "aiomysql" in url.drivername:
-        return create_async_engine(url), True
+    if is_async_url(url):
+        return create_async_engine(url, **engine_options), True
     else:
-        return create_engine(url), False
+        return create_engine(url, **engine_options), False
+
+
+def get_replica_urls(config: Config) -> List[str | URL]:
+    """
+    Gets the urls of the read replicas from the config.
+
+    :param config: Config with DATABASE_REPLICA_URLS as a list or a comma separated string.
+    :return: The replica urls.
+    """
+    replica_urls = config.get(Config.ConfigKeys.DATABASE_REPLICA_URLS.name) or []
+    if isinstance(replica_urls, str):
+        replica_urls = replica_urls.split(',')
+    return [url.strip() if isinstance(url, str) else url for url in replica_urls if url and str(url).strip()]
+
+
+def get_named_database_urls(config: Config) -> Dict[str, str | URL]:
+    """
+    Gets the urls of the named databases from the config.
+
+    :param config: Config with DATABASE_ENGINES as a dict of names to urls, or a comma separated string of name=url.
+    :return: The urls by name.
+    """
+    databases = config.get(Config.ConfigKeys.DATABASE_ENGINES.name) or {}
+    if isinstance(databases, str):
+        databases = dict(
+            database.split('=', 1) for database in databases.split(',') if '=' in database
+        )
+    return {name.strip(): url.strip() if isinstance(url, str) else url for name, url in databases.items()}
+
 
 class DatabaseHelper:
     _instance = None
     _ENGINE: engine
-    _CONN: AsyncConnection | Connection
     _session_maker: sessionmaker
     _async_session_maker: sessionmaker
     _setup: bool = False
     _async: bool = False
+    _replica_engines: tuple = ()
+    _replica_session_makers: tuple = ()
+    _healthy_replicas: tuple = ()
+    _config: Config = None
+    _engine_options: dict = {}
+    _named_engines: dict = {}
+    _named_session_makers: dict = {}
 
 
     def __new__(cls, *args, **kwargs):
@@ -86,7 +187,7 @@ class DatabaseHelper:
     def __init__(self, config: Config):
         if hasattr(self, "_setup") and self._setup:
             return
-        database_url = config.get(Config.ConfigKeys.DATABASE_URL)
+        database_url = config.get(Config.ConfigKeys.DATABASE_URL.name)
         if database_url is None or database_url == "":
             database_url = generate_database_url(
                 dialect=config.get(Config.ConfigKeys.DATABASE_DIALECT.name),
@@ -97,7 +198,13 @@ class DatabaseHelper:
                 host=config.get(Config.ConfigKeys.DATABASE_HOST.name),
             )
 
-        self._ENGINE, self._async = create_engine_from_url(database_url)
+        if isinstance(database_url, str):
+            database_url = make_url(database_url)
+        self._config = config
+        self._engine_options = get_engine_options(config)
+        self._named_engines = {}
+        self._named_session_makers = {}
+        self._ENGINE, self._async = create_engine_from_url(database_url, **self._engine_options)
         if self._ENGINE is not None:
             if self._async:
                 self._async_session_maker = sessionmaker(
@@ -105,10 +212,36 @@ class DatabaseHelper:
                     class_=AsyncSession,
                     expire_on_commit=False
                 )
-            else:
-                self._CONN = self._ENGINE.connect()
             self._session_maker = sessionmaker(bind=self._ENGINE)
             self._setup = True
+            self._create_replicas(config)
+            for name, url in get_named_database_urls(config).items():
+                self.add_engine(name, url)
+
+    def _create_replicas(self, config: Config) -> None:
+        """
+        Creates an engine and session maker for each read replica, with the same pool settings as the primary.
+        """
+        engines = []
+        for replica_url in get_replica_urls(config):
+            if isinstance(replica_url, str):
+                replica_url = make_url(replica_url)
+            replica_engine, replica_async = create_engine_from_url(replica_url, **self._engine_options)
+            if replica_async != self._async:
+                print(f"Error: Ignoring the replica {replica_url.render_as_string(hide_password=True)}, "
+                      f"its driver must be {'async' if self._async else 'sync'} like the primary's")
+                continue
+            engines.append(replica_engine)
+
+        self._replica_engines = tuple(engines)
+        self._replica_session_makers = tuple(
+            sessionmaker(bind=replica_engine, class_=AsyncSession, expire_on_commit=False) if self._async
+            else sessionmaker(bind=replica_engine)
+            for replica_engine in engines
+        )
+        # Replicas are assumed healthy until a health check fails
+        self._healthy_replicas = tuple(range(len(engines)))
+        self._replica_counter = itertools.count()
 
 
     @classmethod
@@ -129,12 +262,54 @@ class DatabaseHelper:
 
 
     @classmethod
-    def create_session(cls) -> Session | None:
+    def add_engine(cls, name: str, url: str | URL, **engine_options) -> None:
+        """
+        Adds another database, whose sessions are created by passing its name,
+        e.g. to write to a second database or one of several shards.
+
+        :param name: Name of the database
+        :param url: URL of the database, its driver must be sync or async like the primary database's
+        :param engine_options: Optional pool settings, defaults to the primary's
+        """
+        instance = cls.get_instance()
+        if isinstance(url, str):
+            url = make_url(url)
+        named_engine, named_async = create_engine_from_url(url, **{**instance._engine_options, **engine_options})
+        if named_async != instance._async:
+            raise ValueError(f"The driver of database {name} must be {'async' if instance._async else 'sync'} "
+                             f"like the primary database's")
+        instance._named_engines[name] = named_engine
+        instance._named_session_makers[name] = \
+            sessionmaker(bind=named_engine, class_=AsyncSession, expire_on_commit=False) if instance._async \
+            else sessionmaker(bind=named_engine)
+
+    @classmethod
+    def has_engine(cls, name: str) -> bool:
+        """
+        Checks if a database has been added with the name.
+
+        :param name: Name of the database
+        :return: If the database exists
+        """
+        return cls._instance is not None and name in cls._instance._named_engines
+
+    @classmethod
+    def _get_named_session_maker(cls, name: str) -> sessionmaker:
+        instance = cls.get_instance()
+        if name not in instance._named_session_makers:
+            raise ValueError(f"No database named {name} has been added")
+        return instance._named_session_makers[name]
+
+    @classmethod
+    def create_session(cls, name: str=None) -> Session | None:
         """
         Creates a sqlalchemy session
 
+        :param name: Optional name of the database, defaults to the primary database
         :return: The created session
         """
+        if name is not None:
+            return cls._get_named_session_maker(name)()
         instance = cls.get_instance()
         if instance._session_maker is None:
             print("Warning: Database engine has not been configured")
@@ -142,12 +317,15 @@ class DatabaseHelper:
         return instance._session_maker()
 
     @classmethod
-    def create_async_session(cls) -> AsyncSession | None:
+    def create_async_session(cls, name: str=None) -> AsyncSession | None:
         """
         Creates an async sqlalchemy session
 
+        :param name: Optional name of the database, defaults to the primary database
         :return: The created session
         """
+        if name is not None:
+            return cls._get_named_session_maker(name)()
         instance = cls.get_instance()
         if instance._async_session_maker is None:
             print("Warning: Database engine has not been configured for async")
@@ -155,6 +333,117 @@ class DatabaseHelper:
         return instance._async_session_maker()
 
 
+    @classmethod
+    def _next_replica_session_maker(cls) -> sessionmaker | None:
+        """
+        Gets the session maker of the next healthy replica, in turn, or None if there are no healthy replicas.
+        """
+        instance = cls.get_instance()
+        healthy = instance._healthy_replicas
+        if not healthy:
+            return None
+        return instance._replica_session_makers[healthy[next(instance._replica_counter) % len(healthy)]]
+
+    @classmethod
+    def create_read_session(cls, name: str=None) -> Session | None:
+        """
+        Creates a sqlalchemy session for reads, on the healthy read replicas in turn.
+        Falls back to the primary if there are no replicas or none of them are healthy.
+
+        :param name: Optional name of a database to read from instead, which doesn't have replicas
+        :return: The created session
+        """
+        if name is not None:
+            return cls.create_session(name)
+        session_maker = cls._next_replica_session_maker()
+        if session_maker is None:
+            return cls.create_session()
+        return session_maker()
+
+    @classmethod
+    def create_async_read_session(cls, name: str=None) -> AsyncSession | None:
+        """
+        Creates an async sqlalchemy session for reads, on the healthy read replicas in turn.
+        Falls back to the primary if there are no replicas or none of them are healthy.
+
+        :param name: Optional name of a database to read from instead, which doesn't have replicas
+        :return: The created session
+        """
+        if name is not None:
+            return cls.create_async_session(name)
+        session_maker = cls._next_replica_session_maker()
+        if session_maker is None:
+            return cls.create_async_session()
+        return session_maker()
+
+    @classmethod
+    def has_replicas(cls) -> bool:
+        """
+        Checks if any read replicas have been configured.
+
+        :return: If there are read replicas
+        """
+        return cls._instance is not None and len(cls._instance._replica_engines) > 0
+
+    @classmethod
+    async def check_replicas(cls, timeout: float=5.0) -> int:
+        """
+        Checks the connection to each read replica, replicas that fail are skipped by read sessions until they pass again.
+
+        :param timeout: Max seconds to wait for each replica to respond
+        :return: Number of healthy replicas
+        """
+        instance = cls.get_instance()
+        was_healthy = set(instance._healthy_replicas)
+
+        async def check(index: int, replica_engine) -> bool:
+            replica_url = replica_engine.url.render_as_string(hide_password=True)
+            try:
+                if instance._async:
+                    async def ping():
+                        async with replica_engine.connect() as connection:
+                            await connection.execute(text("SELECT 1"))
+                    await asyncio.wait_for(ping(), timeout)
+                else:
+                    def ping():
+                        with replica_engine.connect() as connection:
+                            connection.execute(text("SELECT 1"))
+                    await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, ping), timeout)
+            except Exception as error:
+                if index in was_healthy:
+                    print(f"Warning: Database replica {replica_url} failed its health check "
+                          f"and won't be used for reads: {error!r}")
+                return False
+            if index not in was_healthy:
+                print(f"Info: Database replica {replica_url} is healthy again")
+            return True
+
+        results = await asyncio.gather(*(
+            check(index, replica_engine) for index, replica_engine in enumerate(instance._replica_engines)
+        ))
+        instance._healthy_replicas = tuple(index for index, healthy in enumerate(results) if healthy)
+        return len(instance._healthy_replicas)
+
+    @classmethod
+    async def monitor_replicas(cls, interval: float=30.0) -> None:
+        """
+        Checks the health of the read replicas every interval seconds, until cancelled.
+
+        :param interval: Seconds between health checks
+        """
+        while True:
+            await cls.check_replicas()
+            await asyncio.sleep(interval)
+
+    @classmethod
+    def get_config(cls) -> Config | None:
+        """
+        Gets the config the database helper was set up with.
+
+        :return: The config, or None if a database helper hasn't been set up
+        """
+        return cls._instance._config if cls._instance is not None else None
+
     @classmethod
     def is_setup(cls) -> bool:
         """
@@ -167,13 +456,18 @@ class DatabaseHelper:
 
 
     @classmethod
-    def get_engine(cls) -> sqlalchemy.engine.Engine:
+    def get_engine(cls, name: str=None) -> sqlalchemy.engine.Engine:
         """
         Gets the sqlalchemy engine instance.
 
+        :param name: Optional name of the database, defaults to the primary database
         :return: The sqlalchemy engine instance
         """
         instance = cls.get_instance()
+        if name is not None:
+            if name not in instance._named_engines:
+                raise ValueError(f"No database named {name} has been added")
+            return instance._named_engines[name]
         return instance._ENGINE
 
 
@@ -209,6 +503,56 @@ class DatabaseHelper:
                 await conn.run_sync(get_base().metadata.create_all)
 
 
+    @classmethod
+    async def dispose(cls) -> None:
+        """
+        Closes all connections of the pools of the engine, its replicas and any named databases, if a database has been setup.
+        """
+        instance = cls._instance
+        if instance is None or not instance._setup:
+            return
+        for database_engine in (instance._ENGINE, *instance._replica_engines, *instance._named_engines.values()):
+            if instance._async:
+                await database_engine.dispose()
+            else:
+                database_engine.dispose()
+
+
+    @staticmethod
+    def cached(name: str=None, ttl: float=300.0, max_size: int=1024) -> Callable:
+        """
+        Caches the results of a lookup function in memory, keyed by its arguments other than any session,
+        e.g. `@DatabaseHelper.cached(ttl=60) def get_country_name(session, code): ...`.
+        The results must be plain values rather than ORM instances, which are expired when their session commits.
+
+        :param name: Optional name of the cache, defaults to the function's name
+        :param ttl: Seconds results are kept for
+        :param max_size: Max number of results kept, the least recently used are evicted first
+        """
+        return cached(name, ttl=ttl, max_size=max_size)
+
+    @staticmethod
+    def get_cache(name: str, ttl: float=300.0, max_size: int=1024) -> ReadThroughCache:
+        """
+        Gets a read-through cache by name, creating it if it doesn't exist.
+
+        :param name: Name of the cache
+        :param ttl: Seconds values are kept for, only used when the cache is created
+        :param max_size: Max number of values kept, only used when the cache is created
+        :return: The cache
+        """
+        return get_cache(name, ttl=ttl, max_size=max_size)
+
+    @staticmethod
+    def invalidate_cache(name: str=None, key=None) -> None:
+        """
+        Invalidates a key or all of a cache, or every cache if no name is given.
+
+        :param name: Optional name of the cache
+        :param key: Optional key to invalidate
+        """
+        invalidate(name, key)
+
     @classmethod
     def is_async(cls) -> bool:
         instance = cls.get_instance()
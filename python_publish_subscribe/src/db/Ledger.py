@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+
+# Kept out of the models' metadata, so create_all/drop_all of the app's models don't touch it
+_LEDGER_METADATA = MetaData()
+
+LEDGER_TABLE = Table(
+    'pubsub_processed_messages',
+    _LEDGER_METADATA,
+    Column('subscription', String(255), primary_key=True),
+    Column('message_id', String(255), primary_key=True),
+    Column('processed_at', DateTime(timezone=True), nullable=False, index=True),
+)
+
+
+class MessageLedger:
+    """
+    Records the IDs of the messages a subscription has processed in the database,
+    in the same transaction as the handler's writes, so a redelivered message can be recognised and skipped.
+
+    Either the handler's writes and the message's ledger entry are both committed or neither is,
+    which gives exactly-once effects even though Pub/Sub can deliver a message more than once.
+    """
+    def __init__(self, subscription_name: str):
+        """
+        :param subscription_name: Name of the subscription whose messages are recorded
+        """
+        self.subscription_name = subscription_name
+
+    @staticmethod
+    async def create_table(database: str=None) -> None:
+        """
+        Creates the ledger table if it doesn't exist.
+
+        :param database: Optional name of the database to create it in, defaults to the primary database
+        """
+        engine = DatabaseHelper.get_engine(database) if database is not None else DatabaseHelper.get_engine()
+        if DatabaseHelper.is_async():
+            async with engine.begin() as connection:
+                await connection.run_sync(_LEDGER_METADATA.create_all)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, _LEDGER_METADATA.create_all, engine)
+
+    def _processed_statement(self, message_id: str):
+        return select(LEDGER_TABLE.c.message_id).where(
+            LEDGER_TABLE.c.subscription == self.subscription_name,
+            LEDGER_TABLE.c.message_id == message_id,
+        )
+
+    def _record_statement(self, message_id: str):
+        return insert(LEDGER_TABLE).values(
+            subscription=self.subscription_name,
+            message_id=message_id,
+            processed_at=datetime.now(timezone.utc),
+        )
+
+    def _prune_statement(self, retention: timedelta):
+        return delete(LEDGER_TABLE).where(
+            LEDGER_TABLE.c.subscription == self.subscription_name,
+            LEDGER_TABLE.c.processed_at < datetime.now(timezone.utc) - retention,
+        )
+
+    def is_processed(self, session: Session, message_id: str) -> bool:
+        return session.execute(self._processed_statement(message_id)).first() is not None
+
+    async def is_processed_async(self, session: AsyncSession, message_id: str) -> bool:
+        return (await session.execute(self._processed_statement(message_id))).first() is not None
+
+    def record(self, session: Session, message_id: str) -> None:
+        """
+        Adds a message to the ledger, as part of the session's transaction.
+        """
+        session.execute(self._record_statement(message_id))
+
+    async def record_async(self, session: AsyncSession, message_id: str) -> None:
+        await session.execute(self._record_statement(message_id))
+
+    async def prune(self, retention: timedelta, database: str=None) -> None:
+        """
+        Removes the entries of messages processed more than `retention` ago,
+        they can't be redelivered once they are older than the subscription's message retention.
+
+        :param retention: How long entries are kept for
+        :param database: Optional name of the database the ledger is in, defaults to the primary database
+        """
+        if DatabaseHelper.is_async():
+            session = DatabaseHelper.create_async_session(database) if database is not None \
+                else DatabaseHelper.create_async_session()
+            async with session:
+                await session.execute(self._prune_statement(retention))
+                await session.commit()
+            return
+
+        def prune():
+            session = DatabaseHelper.create_session(database) if database is not None else DatabaseHelper.create_session()
+            try:
+                session.execute(self._prune_statement(retention))
+                session.commit()
+            finally:
+                session.close()
+
+        await asyncio.get_running_loop().run_in_executor(None, prune)
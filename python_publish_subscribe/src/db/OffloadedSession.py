@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.Metrics import DATABASE_EXECUTOR_QUEUE_DEPTH
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+
+# Number of database threads used if DATABASE_OFFLOAD_WORKERS isn't set
+DEFAULT_OFFLOAD_WORKERS = 10
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_offload_executor() -> ThreadPoolExecutor:
+    """
+    Gets the thread pool that offloaded sessions run on, creating it the first time it's used.
+    It's kept apart from the pool sync handlers run on, so database work from async handlers can't be starved by them,
+    and is bounded by DATABASE_OFFLOAD_WORKERS so it doesn't open more connections than the engine's pool allows.
+
+    :return: The database thread pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            config = DatabaseHelper.get_config()
+            workers = config.get(Config.ConfigKeys.DATABASE_OFFLOAD_WORKERS.name) if config is not None else None
+            _executor = ThreadPoolExecutor(
+                max_workers=int(workers) if workers else DEFAULT_OFFLOAD_WORKERS,
+                thread_name_prefix='database',
+            )
+            DATABASE_EXECUTOR_QUEUE_DEPTH.set_function(lambda: _executor._work_queue.qsize())
+        return _executor
+
+
+class OffloadedSession:
+    """
+    Awaitable facade over a sync session, given to async handlers when the database engine is sync.
+
+    Every call that can reach the database runs on the database thread pool, so the handler doesn't block the
+    event loop, and calls are made one at a time, as a session mustn't be used by two threads at once.
+    The methods mirror AsyncSession's, e.g. `await session.execute(...)`, so a handler works with either engine.
+    Like with an AsyncSession, lazy loaded attributes must be loaded in the query or through run_sync.
+    """
+    def __init__(self, session: Session, executor: ThreadPoolExecutor=None):
+        """
+        :param session: Sync session the calls are made on
+        :param executor: Optional thread pool to run the calls on, defaults to the database thread pool
+        """
+        self.sync_session = session
+        self._executor = executor
+        self._lock = asyncio.Lock()
+
+    async def run_sync(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Calls a function with the sync session on the database thread pool, e.g. for code written for a Session.
+
+        :param fn: Function called with the session, followed by the args and kwargs
+        :return: What the function returns
+        """
+        executor = self._executor or get_offload_executor()
+        async with self._lock:
+            # Run in a copy of the current context so the handler's trace context is kept in the database thread
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, functools.partial(contextvars.copy_context().run, fn, self.sync_session, *args, **kwargs)
+            )
+
+    async def _call(self, method: str, *args, **kwargs) -> Any:
+        return await self.run_sync(lambda session: getattr(session, method)(*args, **kwargs))
+
+    async def execute(self, *args, **kwargs):
+        return await self._call('execute', *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await self._call('scalar', *args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return await self._call('scalars', *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._call('get', *args, **kwargs)
+
+    async def merge(self, *args, **kwargs):
+        return await self._call('merge', *args, **kwargs)
+
+    async def refresh(self, *args, **kwargs) -> None:
+        await self._call('refresh', *args, **kwargs)
+
+    async def delete(self, instance) -> None:
+        await self._call('delete', instance)
+
+    async def flush(self, *args, **kwargs) -> None:
+        await self._call('flush', *args, **kwargs)
+
+    async def commit(self) -> None:
+        await self._call('commit')
+
+    async def rollback(self) -> None:
+        await self._call('rollback')
+
+    async def close(self) -> None:
+        await self._call('close')
+
+    def begin_nested(self) -> '_OffloadedSavepoint':
+        """
+        Starts a savepoint, used as `async with session.begin_nested():` like AsyncSession's.
+        It's released if the block succeeds and rolled back if it raises.
+        """
+        return _OffloadedSavepoint(self)
+
+    def add(self, instance) -> None:
+        # Adding doesn't reach the database until the session is flushed
+        self.sync_session.add(instance)
+
+    def add_all(self, instances) -> None:
+        self.sync_session.add_all(instances)
+
+    def expunge(self, instance) -> None:
+        self.sync_session.expunge(instance)
+
+    async def __aenter__(self) -> 'OffloadedSession':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+
+class _OffloadedSavepoint:
+    def __init__(self, session: OffloadedSession):
+        self._session = session
+        self._transaction = None
+
+    async def __aenter__(self) -> '_OffloadedSavepoint':
+        self._transaction = await self._session.run_sync(lambda session: session.begin_nested())
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is None:
+            await self._session.run_sync(lambda _: self._transaction.commit())
+        else:
+            await self._session.run_sync(lambda _: self._transaction.rollback())
+        return False
@@ -0,0 +1,63 @@
+import hashlib
+from typing import Callable, List, Optional
+
+from google.cloud.pubsub_v1.subscriber.message import Message
+
+
+class ShardRouter:
+    """
+    Picks the database a message is written to from a key of the message, so the writes of a subscription
+    are spread over several databases (shards) registered with DatabaseHelper.add_engine.
+
+    Keys are assigned with rendezvous hashing, the same key always goes to the same shard (across processes too),
+    and adding a shard only moves the keys that are assigned to the new shard.
+    """
+    def __init__(self, databases: List[str], key: Callable[[Message], Optional[str]]=None, attribute: str=None):
+        """
+        :param databases: Names of the databases of the shards
+        :param key: Optional function getting the shard key from a message
+        :param attribute: Optional attribute to use as the shard key, used if key isn't given.
+        If neither are given the message's ordering key is used.
+        """
+        if not databases:
+            raise ValueError("A shard router needs at least one database")
+        self.databases = list(databases)
+        self._key = key
+        self._attribute = attribute
+
+    def get_key(self, message: Message) -> Optional[str]:
+        """
+        Gets the shard key of a message.
+
+        :param message: Message received
+        :return: The shard key, or None if the message doesn't have one
+        """
+        if self._key is not None:
+            return self._key(message)
+        if self._attribute is not None:
+            return message.attributes.get(self._attribute) if message.attributes else None
+        return message.ordering_key or None
+
+    def shard_for(self, key: str) -> str:
+        """
+        Gets the database a key is assigned to.
+
+        :param key: Shard key
+        :return: Name of the database
+        """
+        return max(
+            self.databases,
+            key=lambda database: hashlib.blake2b(f'{database}:{key}'.encode(), digest_size=8).digest(),
+        )
+
+    def route(self, message: Message) -> str:
+        """
+        Gets the database a message should be written to.
+
+        :param message: Message received
+        :return: Name of the database
+        """
+        key = self.get_key(message)
+        if key is None or key == '':
+            raise ValueError(f"Message {message.message_id} has no shard key")
+        return self.shard_for(str(key))
@@ -1,22 +1,202 @@
+import glob
+import hashlib
+import os
+import pickle
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import sqlalchemy
+from sqlalchemy import Connection, MetaData, text
 from sqlalchemy.ext.automap import automap_base
 
+from python_publish_subscribe.config import Config
 from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
 
+
+def get_schema_fingerprint(connection: Connection, schema: str=None) -> str:
+    """
+    Gets a fingerprint of the tables, columns and keys of a schema, which changes whenever the schema does.
+    It's a couple of queries of the database's catalog, much quicker than reflecting every table.
+
+    :param connection: Connection to the database
+    :param schema: Optional schema, defaults to the connection's default schema
+    :return: The fingerprint
+    """
+    digest = hashlib.sha256()
+    if connection.dialect.name == 'sqlite':
+        queries = [("SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name", {})]
+    else:
+        schema = schema or connection.dialect.default_schema_name
+        queries = [
+            ("SELECT table_name, column_name, data_type, is_nullable, column_default, ordinal_position "
+             "FROM information_schema.columns WHERE table_schema = :schema "
+             "ORDER BY table_name, ordinal_position", {'schema': schema}),
+            ("SELECT constraint_name, table_name, column_name, ordinal_position "
+             "FROM information_schema.key_column_usage WHERE table_schema = :schema "
+             "ORDER BY table_name, constraint_name, ordinal_position", {'schema': schema}),
+        ]
+    for query, parameters in queries:
+        for row in connection.execute(text(query), parameters):
+            digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()[:32]
+
+
 class AutomapManager:
+    """
+    Generates model classes from an existing database schema with SQLAlchemy's automap.
+
+    Only the tables that are asked for are reflected, e.g. get_class('user') reflects the user table
+    (and any tables it references) the first time it's used. The reflected MetaData is saved to AUTOMAP_CACHE_PATH,
+    keyed by a fingerprint of the schema, so later processes load it instead of reflecting the database again
+    until the schema changes. The cache is a pickle, so the directory must only be writable by the app.
+    """
     _automap_classes = None
+    _base = None
+    _metadata: Optional[MetaData] = None
+    # Schemas that have been reflected completely, None being the default schema
+    _complete_schemas: Set[Optional[str]] = set()
+    _fingerprints: Dict[Optional[str], str] = {}
+    _lock = threading.RLock()
 
     @classmethod
-    def get_automap_classes(cls) -> list:
+    def get_automap_classes(cls, tables: List[str]=None, schema: str=None) -> Any:
         """
         Automaps a database model and returns a list of automap classes.
+
+        :param tables: Optional names of the tables to reflect, every table in the schema is reflected if not given
+        :param schema: Optional schema of the tables, defaults to the database's default schema
         :return: list of automap classes
         """
-        if cls._automap_classes is None:
-            engine = DatabaseHelper.get_engine()
+        with cls._lock:
+            cls._reflect(tables, schema)
+            return cls._automap_classes
+
+    @classmethod
+    def get_class(cls, table_name: str, schema: str=None) -> Any:
+        """
+        Gets the automap class of a table, reflecting only that table the first time it's used.
+
+        :param table_name: Name of the table
+        :param schema: Optional schema of the table, defaults to the database's default schema
+        :return: The automap class
+        """
+        classes = cls.get_automap_classes([table_name], schema)
+        if table_name not in classes:
+            raise LookupError(f"Unable to automap {table_name}, it doesn't exist or doesn't have a primary key")
+        return classes[table_name]
+
+    @classmethod
+    def reset(cls) -> None:
+        """
+        Forgets the reflected tables, so they're loaded again e.g. after the schema has been migrated.
+        """
+        with cls._lock:
+            cls._automap_classes = None
+            cls._base = None
+            cls._metadata = None
+            cls._complete_schemas = set()
+            cls._fingerprints = {}
+
+    @classmethod
+    def _reflect(cls, tables: Optional[List[str]], schema: Optional[str]) -> None:
+        engine = DatabaseHelper.get_engine()
+        if cls._metadata is None:
+            cls._metadata = MetaData()
+            cls._complete_schemas = set()
+        if schema in cls._complete_schemas or (tables is not None and all(
+                (table if schema is None else f'{schema}.{table}') in cls._metadata.tables for table in tables)):
+            if cls._base is None:
+                cls._prepare()
+            return
+
+        with engine.connect() as connection:
+            fingerprint = cls._get_fingerprint(connection, schema)
+            if fingerprint is not None and schema not in cls._fingerprints:
+                cls._fingerprints[schema] = fingerprint
+                cls._load_cache(engine, schema, fingerprint)
 
-            automap_base_instance = automap_base()
-            automap_base_instance.prepare(engine, reflect=True)
+            missing = None if tables is None else [
+                table for table in tables if (table if schema is None else f'{schema}.{table}') not in cls._metadata.tables
+            ]
+            if schema not in cls._complete_schemas and (missing is None or missing):
+                # Tables that don't exist are skipped, get_class raises a LookupError for them
+                cls._metadata.reflect(
+                    connection, schema=schema,
+                    only=None if missing is None else lambda table_name, _: table_name in missing,
+                )
+                if missing is None:
+                    cls._complete_schemas.add(schema)
+                if fingerprint is not None:
+                    cls._save_cache(engine, schema, fingerprint)
+        cls._prepare()
+
+    @classmethod
+    def _prepare(cls) -> None:
+        # Prepare can be called again on the same base to map tables reflected since
+        if cls._base is None:
+            cls._base = automap_base(metadata=cls._metadata)
+        cls._base.prepare()
+        cls._automap_classes = cls._base.classes
+
+    @classmethod
+    def _get_fingerprint(cls, connection: Connection, schema: Optional[str]) -> Optional[str]:
+        if cls._get_cache_path() is None:
+            return None
+        try:
+            return get_schema_fingerprint(connection, schema)
+        except Exception as error:
+            print(f"Warning: Unable to fingerprint the database schema, the automap cache won't be used: {error}")
+            connection.rollback()
+            return None
 
-            cls._automap_classes = automap_base_instance.classes
+    @staticmethod
+    def _get_cache_path() -> Optional[str]:
+        config = DatabaseHelper.get_config()
+        return config.get(Config.ConfigKeys.AUTOMAP_CACHE_PATH.name) if config is not None else None
 
-        return cls._automap_classes
\ No newline at end of file
+    @classmethod
+    def _get_cache_file(cls, engine, schema: Optional[str], fingerprint: str=None) -> str:
+        database = hashlib.sha256(
+            f'{engine.url.render_as_string(hide_password=True)}|{schema}|{sqlalchemy.__version__}'.encode()
+        ).hexdigest()[:16]
+        return os.path.join(cls._get_cache_path(), f'{database}-{fingerprint or "*"}.pickle')
+
+    @classmethod
+    def _load_cache(cls, engine, schema: Optional[str], fingerprint: str) -> None:
+        """
+        Adds the tables in the cache of the schema to the MetaData, if the cache is of the schema's current fingerprint.
+        """
+        path = cls._get_cache_file(engine, schema, fingerprint)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'rb') as file:
+                cached = pickle.load(file)
+        except Exception as error:
+            print(f"Warning: Unable to read the automap cache {path}, the schema will be reflected: {error}")
+            return
+        for table in cached['metadata'].tables.values():
+            if table.key not in cls._metadata.tables:
+                table.to_metadata(cls._metadata)
+        if cached['complete']:
+            cls._complete_schemas.add(schema)
+
+    @classmethod
+    def _save_cache(cls, engine, schema: Optional[str], fingerprint: str) -> None:
+        path = cls._get_cache_file(engine, schema, fingerprint)
+        metadata = MetaData()
+        for table in cls._metadata.tables.values():
+            if table.schema == schema:
+                table.to_metadata(metadata)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with open(temporary_path, 'wb') as file:
+                pickle.dump({'metadata': metadata, 'complete': schema in cls._complete_schemas}, file)
+            os.replace(temporary_path, path)
+            # Caches of previous versions of the schema won't be used again
+            for outdated in glob.glob(cls._get_cache_file(engine, schema)):
+                if outdated != path:
+                    os.remove(outdated)
+        except OSError as error:
+            print(f"Warning: Unable to save the automap cache {path}: {error}")
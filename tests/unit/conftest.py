@@ -1,7 +1,47 @@
 import pytest
 import os
+from unittest.mock import MagicMock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
 from python_publish_subscribe import PythonPublishSubscribe
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
 
 @pytest.fixture
 def app():
-    yield PythonPublishSubscribe({'PROJECT_ID': 'test-project'}, database_connectivity=False)
\ No newline at end of file
+    yield PythonPublishSubscribe({'PROJECT_ID': 'test-project'}, database_connectivity=False)
+
+@pytest.fixture
+def sync_database(tmp_path, monkeypatch):
+    # A sqlite database with orders and events tables, that the DatabaseHelper's sessions are created on
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE orders (id TEXT)"))
+        connection.execute(text("CREATE TABLE events (value INTEGER)"))
+    monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: True)
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    monkeypatch.setattr(DatabaseHelper, "get_engine", lambda: engine)
+    monkeypatch.setattr(DatabaseHelper, "create_session", sessionmaker(bind=engine))
+    monkeypatch.setattr(DatabaseHelper, "create_read_session", sessionmaker(bind=engine))
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def count():
+    def count_rows(engine, table):
+        with engine.connect() as connection:
+            return connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+    return count_rows
+
+@pytest.fixture
+def make_message():
+    def make(message_id="1", data=b"", attributes=None, ordering_key="", publish_time=None):
+        message = MagicMock()
+        message.message_id = message_id
+        message.data = data
+        message.attributes = attributes if attributes is not None else {}
+        message.ordering_key = ordering_key
+        message.publish_time = publish_time
+        return message
+    return make
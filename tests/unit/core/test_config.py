@@ -16,6 +16,18 @@ def test_config_init():
             'PUBLISH_TOPICS': {},
             'SUBSCRIPTION_TOPICS': {},
             'DEFAULT_TIMEOUT': 10,
+            'SHUTDOWN_TIMEOUT': 30,
+            'PUBLISH_BATCH_MAX_MESSAGES': 100,
+            'PUBLISH_BATCH_MAX_LATENCY': 0.01,
+            'STATE_STORE_PATH': '.state',
+            'STATE_CHECKPOINT_INTERVAL': 5,
+            'METRICS_PORT': None,
+            'METRICS_HOST': '0.0.0.0',
+            'PROFILE_PATH': '.profiles',
+            'LEDGER_RETENTION': 604800,
+            'LEDGER_PRUNE_INTERVAL': 3600,
+            'TOPOLOGY_CACHE_PATH': '.topology.json',
+            'TOPOLOGY_MAX_WORKERS': 10,
             'PROJECT_ID': '',
             'DATABASE_URL': '',
             'DATABASE_DIALECT': '',
@@ -24,6 +36,17 @@ def test_config_init():
             'DATABASE_PASSWORD': '',
             'DATABASE_PORT': '',
             'DATABASE_HOST': '',
+            'DATABASE_POOL_SIZE': None,
+            'DATABASE_MAX_OVERFLOW': None,
+            'DATABASE_POOL_RECYCLE': None,
+            'DATABASE_POOL_PRE_PING': None,
+            'DATABASE_POOL_TIMEOUT': None,
+            'DATABASE_ECHO': None,
+            'DATABASE_REPLICA_URLS': [],
+            'DATABASE_REPLICA_CHECK_INTERVAL': 30,
+            'DATABASE_ENGINES': {},
+            'AUTOMAP_CACHE_PATH': '.automap',
+            'DATABASE_OFFLOAD_WORKERS': 10,
         }
 
 def test_update_config(config):
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+from sqlalchemy import MetaData, create_engine, text
+
+from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.automap import AutomapManager
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'automap.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE country (code TEXT PRIMARY KEY, name TEXT)"))
+        connection.execute(text(
+            "CREATE TABLE user (id INTEGER PRIMARY KEY, country_code TEXT REFERENCES country (code))"
+        ))
+        connection.execute(text("CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT)"))
+    config = {Config.ConfigKeys.AUTOMAP_CACHE_PATH.name: str(tmp_path / 'automap')}
+    monkeypatch.setattr(DatabaseHelper, "get_engine", lambda: engine)
+    monkeypatch.setattr(DatabaseHelper, "get_config", lambda: config)
+    AutomapManager.reset()
+    yield engine
+    AutomapManager.reset()
+    engine.dispose()
+
+
+def cache_files(tmp_path):
+    return sorted(os.listdir(tmp_path / 'automap'))
+
+
+def test_only_requested_tables_are_reflected(database):
+    # When
+    User = AutomapManager.get_class('user')
+
+    # Then the table it references is reflected too, but not the others
+    assert User.__table__.name == 'user'
+    assert set(AutomapManager._metadata.tables) == {'user', 'country'}
+    assert 'product' not in AutomapManager.get_automap_classes(['user'])
+
+
+def test_tables_are_added_lazily(database):
+    # Given
+    AutomapManager.get_class('user')
+
+    # When
+    Product = AutomapManager.get_class('product')
+
+    # Then
+    assert Product.__table__.name == 'product'
+    assert AutomapManager.get_class('user').__table__.name == 'user'
+
+
+def test_all_tables_are_reflected_without_table_names(database):
+    # When
+    classes = AutomapManager().get_automap_classes()
+
+    # Then
+    assert {'user', 'country', 'product'} <= set(classes.keys())
+
+
+def test_missing_table_raises_lookup_error(database):
+    with pytest.raises(LookupError):
+        AutomapManager.get_class('missing')
+
+
+def test_cache_is_used_after_restart(database, tmp_path, monkeypatch):
+    # Given
+    AutomapManager.get_class('user')
+    assert len(cache_files(tmp_path)) == 1
+    AutomapManager.reset()
+
+    def reflect(*args, **kwargs):
+        raise AssertionError("The schema shouldn't be reflected")
+    monkeypatch.setattr(MetaData, "reflect", reflect)
+
+    # When
+    User = AutomapManager.get_class('user')
+
+    # Then
+    assert User.__table__.name == 'user'
+
+
+def test_schema_change_invalidates_cache(database, tmp_path):
+    # Given
+    AutomapManager.get_class('product')
+    [old_cache] = cache_files(tmp_path)
+    with database.begin() as connection:
+        connection.execute(text("ALTER TABLE product ADD COLUMN price INTEGER"))
+    AutomapManager.reset()
+
+    # When
+    Product = AutomapManager.get_class('product')
+
+    # Then the new column is reflected and the outdated cache is removed
+    assert 'price' in Product.__table__.columns
+    [new_cache] = cache_files(tmp_path)
+    assert new_cache != old_cache
+
+
+def test_cache_is_disabled_without_a_path(database, tmp_path, monkeypatch):
+    # Given
+    monkeypatch.setattr(DatabaseHelper, "get_config", lambda: {Config.ConfigKeys.AUTOMAP_CACHE_PATH.name: None})
+
+    # When
+    User = AutomapManager.get_class('user')
+
+    # Then
+    assert User.__table__.name == 'user'
+    assert not os.path.exists(tmp_path / 'automap')
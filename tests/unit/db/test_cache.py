@@ -0,0 +1,249 @@
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import Column, String, text
+from sqlalchemy.orm import Session, declarative_base
+
+import python_publish_subscribe.src.db.Cache as Cache
+from python_publish_subscribe.src.Subscriber import _handle_message
+from python_publish_subscribe.src.db.Cache import ReadThroughCache, cached, get_cache, invalidate_from_message
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.OffloadedSession import OffloadedSession
+
+pytest_plugins = ("pytest_asyncio",)
+
+Base = declarative_base()
+
+
+class Order(Base):
+    __tablename__ = "orders"
+    id = Column(String, primary_key=True)
+
+
+def test_values_expire_after_the_ttl(monkeypatch):
+    # Given
+    now = [100.0]
+    monkeypatch.setattr(Cache.time, "monotonic", lambda: now[0])
+    cache = ReadThroughCache("ttl", ttl=10)
+    loads = []
+
+    def load():
+        loads.append(now[0])
+        return len(loads)
+
+    # When
+    first = cache.get("key", load)
+    now[0] += 5
+    second = cache.get("key", load)
+    now[0] += 6
+    third = cache.get("key", load)
+
+    # Then
+    assert (first, second, third) == (1, 1, 2)
+
+
+def test_least_recently_used_values_are_evicted():
+    cache = ReadThroughCache("lru", max_size=2)
+    cache.get("a", lambda: "a")
+    cache.get("b", lambda: "b")
+    cache.get("a", lambda: "reloaded")
+    cache.get("c", lambda: "c")
+
+    assert len(cache) == 2
+    assert cache.get("a", lambda: "reloaded") == "a"
+    assert cache.get("b", lambda: "reloaded") == "reloaded"
+
+
+def test_concurrent_lookups_share_one_load():
+    # Given
+    cache = ReadThroughCache("single-flight")
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("key", load))) for _ in range(10)]
+
+    # When
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Then
+    assert len(calls) == 1
+    assert results == ["value"] * 10
+
+
+@pytest.mark.asyncio
+async def test_concurrent_async_lookups_share_one_load():
+    cache = ReadThroughCache("single-flight-async")
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    results = await asyncio.gather(*(cache.get_async("key", load) for _ in range(10)))
+
+    assert len(calls) == 1
+    assert results == ["value"] * 10
+
+
+@pytest.mark.asyncio
+async def test_failed_loads_are_shared_but_not_cached():
+    cache = ReadThroughCache("errors")
+
+    async def load():
+        await asyncio.sleep(0.01)
+        raise LookupError("missing")
+
+    results = await asyncio.gather(*(cache.get_async("key", load) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, LookupError) for result in results)
+    assert await cache.get_async("key", lambda: "found") == "found"
+
+
+def test_invalidation_during_a_load_isnt_overwritten_by_the_stale_value():
+    cache = ReadThroughCache("invalidation")
+
+    def load():
+        cache.invalidate("key")
+        return "stale"
+
+    assert cache.get("key", load) == "stale"
+    assert cache.get("key", lambda: "fresh") == "fresh"
+
+
+def test_cached_decorator_ignores_sessions():
+    # Given
+    calls = []
+
+    @cached(name="countries", ttl=60)
+    def get_country(session, code):
+        calls.append(code)
+        return code.upper()
+
+    # When
+    results = [get_country(MagicMock(spec=Session), "gb") for _ in range(3)] + [get_country(MagicMock(spec=Session), "fr")]
+
+    # Then
+    assert results == ["GB", "GB", "GB", "FR"]
+    assert calls == ["gb", "fr"]
+    assert get_country.cache is get_cache("countries")
+
+
+@pytest.mark.asyncio
+async def test_cached_decorator_on_coroutines():
+    calls = []
+
+    @DatabaseHelper.cached(ttl=60)
+    async def get_customer(session, customer_id):
+        calls.append(customer_id)
+        return {"id": customer_id}
+
+    assert await get_customer(None, 1) == await get_customer(None, 1) == {"id": 1}
+    assert calls == [1]
+
+
+@pytest.mark.asyncio
+async def test_cached_decorator_ignores_offloaded_sessions():
+    # Given
+    calls = []
+
+    @cached(name="offloaded_customers", ttl=60)
+    async def get_customer(session, customer_id):
+        calls.append(customer_id)
+        return {"id": customer_id}
+
+    # When
+    results = [await get_customer(OffloadedSession(MagicMock(spec=Session)), 1) for _ in range(3)]
+
+    # Then
+    assert results == [{"id": 1}] * 3
+    assert calls == [1]
+    assert len(get_customer.cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_values_outlive_the_handler_session(sync_database, make_message):
+    # Given
+    with sync_database.begin() as connection:
+        connection.execute(text("INSERT INTO orders (id) VALUES ('existing')"))
+    calls = []
+
+    @cached(name="order-ids", ttl=60)
+    def get_order_id(session, order_id):
+        calls.append(order_id)
+        return session.get(Order, order_id).id
+
+    seen = []
+
+    def handler(message, session):
+        seen.append(get_order_id(session, "existing"))
+        session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+
+    # When each message's session commits before the next is handled
+    await _handle_message(make_message("1"), handler)
+    await _handle_message(make_message("2"), handler)
+
+    # Then
+    assert seen == ["existing", "existing"]
+    assert calls == ["existing"]
+
+
+@pytest.mark.asyncio
+async def test_caching_orm_instances_is_refused(sync_database, make_message):
+    # Given
+    with sync_database.begin() as connection:
+        connection.execute(text("INSERT INTO orders (id) VALUES ('existing')"))
+
+    @cached(name="orders", ttl=60)
+    def get_order(session, order_id):
+        return session.get(Order, order_id)
+
+    @cached(name="order-lists", ttl=60)
+    def get_orders(session):
+        return session.query(Order).all()
+
+    def handler(message, session):
+        get_order(session, "existing")
+
+    # When
+    with pytest.raises(TypeError, match="ORM instances"):
+        await _handle_message(make_message("1"), handler)
+    with pytest.raises(TypeError):
+        get_orders(DatabaseHelper.create_session())
+
+    # Then
+    assert len(get_order.cache) == len(get_orders.cache) == 0
+
+
+def test_invalidation_messages():
+    # Given
+    customers = get_cache("message-customers")
+    countries = get_cache("message-countries")
+    customers.get(1, lambda: "customer 1")
+    customers.get(2, lambda: "customer 2")
+    countries.get("gb", lambda: "GB")
+
+    # When a key is invalidated, given as a string
+    invalidate_from_message(MagicMock(attributes={"cache": "message-customers", "key": "1"}))
+
+    # Then
+    assert customers.get(1, lambda: "reloaded") == "reloaded"
+    assert customers.get(2, lambda: "reloaded") == "customer 2"
+
+    # When every cache is invalidated
+    invalidate_from_message(MagicMock(attributes={}))
+
+    # Then
+    assert countries.get("gb", lambda: "reloaded") == "reloaded"
+
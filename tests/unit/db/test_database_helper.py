@@ -13,6 +13,7 @@ from python_publish_subscribe import PythonPublishSubscribe
 from python_publish_subscribe.src.db.DatabaseHelper import (
     generate_database_url,
     create_engine_from_url,
+    is_async_url,
     DatabaseHelper,
 )
 from python_publish_subscribe.src.db.DatabaseHelper import create_engine_from_url as _orig_create_engine
@@ -112,6 +113,49 @@ def test_create_engine_from_url_async(monkeypatch):
     assert is_async is True
 
 
+@pytest.mark.parametrize("dialect,expected", [
+    ("asyncpg", True),
+    ("psycopg_async", True),
+    ("aiomysql", True),
+    ("asyncmy", True),
+    ("aiosqlite", True),
+    ("psycopg2", False),
+    ("psycopg", False),
+    ("pymysql", False),
+    ("sqlite", False),
+])
+def test_async_drivers_are_detected_from_the_dialect(dialect, expected):
+    url = generate_database_url(dialect=dialect, username="user", password="pwd", name="db", host="h")
+    assert is_async_url(url) is expected
+    assert is_async_url(url.render_as_string(hide_password=False)) is expected
+
+
+def test_generate_database_url_sqlite_only_uses_the_name(tmp_path):
+    url = generate_database_url(dialect="aiosqlite", username="", password="", name=str(tmp_path / "app.db"), host="")
+    assert url.drivername == "sqlite+aiosqlite"
+    assert url.database == str(tmp_path / "app.db")
+    assert url.username is None and url.host is None
+
+
+@pytest.mark.asyncio
+async def test_aiosqlite_database_gives_async_sessions(tmp_path):
+    # Given
+    cfg = Config({
+        "DATABASE_DIALECT": "aiosqlite",
+        "DATABASE_NAME": str(tmp_path / "app.db"),
+    })
+
+    # When
+    helper = DatabaseHelper(cfg)
+
+    # Then
+    assert helper._async is True
+    assert isinstance(helper.get_engine(), AsyncEngine)
+    async with helper.create_async_session() as session:
+        assert (await session.execute(sqlalchemy.text("SELECT 1"))).scalar() == 1
+    await helper.get_engine().dispose()
+
+
 def test_get_instance_without_config_raises():
     with pytest.raises(ValueError):
         DatabaseHelper.get_instance(config=None)
@@ -249,3 +293,161 @@ def test_enabling_db_connectivty_setup(monkeypatch):
 
     # Then
     assert FakeDB, "Expected the Database engine to be setup"
+
+
+@pytest.mark.asyncio
+async def test_dispose_without_instance_is_noop():
+    await DatabaseHelper.dispose()
+
+
+@pytest.mark.asyncio
+async def test_dispose_sync_engine(monkeypatch):
+    import python_publish_subscribe.src.db.DatabaseHelper as DBM
+    from unittest.mock import MagicMock
+    fake_engine = MagicMock()
+    monkeypatch.setattr(DBM, "create_engine_from_url", lambda url: (fake_engine, False))
+
+    DatabaseHelper.get_instance(DummyConfig({"DATABASE_URL": "sqlite:///:memory:"}))
+    await DatabaseHelper.dispose()
+
+    fake_engine.dispose.assert_called_once()
+
+
+def test_get_engine_options_only_includes_set_values(capfd):
+    from python_publish_subscribe.src.db.DatabaseHelper import get_engine_options
+    cfg = DummyConfig({
+        "DATABASE_POOL_SIZE": "20",
+        "DATABASE_MAX_OVERFLOW": 5,
+        "DATABASE_POOL_RECYCLE": "",
+        "DATABASE_POOL_PRE_PING": "true",
+        "DATABASE_POOL_TIMEOUT": "not-a-number",
+        "DATABASE_ECHO": False,
+    })
+
+    options = get_engine_options(cfg)
+
+    assert options == {"pool_size": 20, "max_overflow": 5, "pool_pre_ping": True, "echo": False}
+    assert "Warning: Ignoring DATABASE_POOL_TIMEOUT" in capfd.readouterr().out
+
+
+def test_create_engine_from_url_passes_pool_settings_to_async_engine(monkeypatch):
+    import python_publish_subscribe.src.db.DatabaseHelper as DBM
+    calls = []
+    monkeypatch.setattr(DBM, "create_async_engine", lambda url, **options: calls.append(options) or object())
+
+    create_engine_from_url(URL.create("postgresql+asyncpg", database="db"), pool_size=20, pool_pre_ping=True)
+
+    assert calls == [{"pool_size": 20, "pool_pre_ping": True}]
+
+
+def test_database_url_and_pool_settings_from_config(tmp_path):
+    # Given
+    cfg = Config({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'app.db'}",
+        "DATABASE_POOL_SIZE": "7",
+        "DATABASE_MAX_OVERFLOW": "3",
+        "DATABASE_POOL_PRE_PING": "1",
+    })
+
+    # When
+    helper = DatabaseHelper(cfg)
+
+    # Then
+    engine = helper.get_engine()
+    assert engine.url.database == str(tmp_path / 'app.db')
+    assert engine.pool.size() == 7
+    assert engine.pool._max_overflow == 3
+    assert engine.pool._pre_ping is True
+    assert engine.pool.checkedout() == 0, "No connection should be held open by the helper"
+    engine.dispose()
+
+
+def make_replicated_helper(tmp_path, replicas):
+    cfg = Config({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'primary.db'}",
+        "DATABASE_REPLICA_URLS": replicas,
+    })
+    return DatabaseHelper(cfg)
+
+
+def test_read_sessions_are_balanced_across_replicas(tmp_path):
+    # Given
+    make_replicated_helper(tmp_path, f"sqlite:///{tmp_path / 'a.db'}, sqlite:///{tmp_path / 'b.db'}")
+
+    # When
+    databases = [DatabaseHelper.create_read_session().get_bind().url.database for _ in range(4)]
+
+    # Then
+    assert DatabaseHelper.has_replicas()
+    assert databases == [str(tmp_path / name) for name in ('a.db', 'b.db', 'a.db', 'b.db')]
+    assert DatabaseHelper.create_session().get_bind().url.database == str(tmp_path / 'primary.db')
+
+
+def test_without_replicas_read_sessions_use_the_primary(tmp_path):
+    make_replicated_helper(tmp_path, [])
+
+    assert not DatabaseHelper.has_replicas()
+    assert DatabaseHelper.create_read_session().get_bind().url.database == str(tmp_path / 'primary.db')
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_replicas_are_skipped_until_they_recover(tmp_path, capfd):
+    # Given
+    missing = tmp_path / "missing"
+    make_replicated_helper(tmp_path, [f"sqlite:///{tmp_path / 'a.db'}", f"sqlite:///{missing / 'b.db'}"])
+
+    # When
+    healthy = await DatabaseHelper.check_replicas()
+
+    # Then
+    assert healthy == 1
+    assert "failed its health check and won't be used for reads" in capfd.readouterr().out
+    databases = {DatabaseHelper.create_read_session().get_bind().url.database for _ in range(4)}
+    assert databases == {str(tmp_path / 'a.db')}
+
+    # When the replica recovers
+    missing.mkdir()
+    healthy = await DatabaseHelper.check_replicas()
+
+    # Then
+    assert healthy == 2
+    assert "is healthy again" in capfd.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_read_sessions_fall_back_to_the_primary_when_no_replica_is_healthy(tmp_path):
+    make_replicated_helper(tmp_path, [f"sqlite:///{tmp_path / 'missing' / 'a.db'}"])
+
+    await DatabaseHelper.check_replicas()
+
+    assert DatabaseHelper.create_read_session().get_bind().url.database == str(tmp_path / 'primary.db')
+
+
+def test_replicas_with_a_different_driver_type_are_ignored(tmp_path, monkeypatch, capfd):
+    import python_publish_subscribe.src.db.DatabaseHelper as DBM
+    monkeypatch.setattr(
+        DBM, "create_engine_from_url",
+        lambda url, **options: (_orig_create_engine(url, **options)[0], url.database.endswith("a.db")),
+    )
+    make_replicated_helper(tmp_path, [f"sqlite:///{tmp_path / 'a.db'}"])
+
+    assert not DatabaseHelper.has_replicas()
+    assert "Error: Ignoring the replica" in capfd.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_handler_read_session_is_injected_from_a_replica(tmp_path, monkeypatch):
+    # Given
+    from python_publish_subscribe.src.Subscriber import _handle_message
+    make_replicated_helper(tmp_path, [f"sqlite:///{tmp_path / 'a.db'}"])
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    databases = []
+
+    def handler(message, session, read_session):
+        databases.append((session.get_bind().url.database, read_session.get_bind().url.database))
+
+    # When
+    await _handle_message(object(), handler)
+
+    # Then
+    assert databases == [(str(tmp_path / 'primary.db'), str(tmp_path / 'a.db'))]
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from python_publish_subscribe.src.Subscriber import _handle_message
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.Ledger import LEDGER_TABLE, MessageLedger
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+@pytest_asyncio.fixture
+async def async_database(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'ledger.db'}")
+    async with engine.begin() as connection:
+        await connection.execute(text("CREATE TABLE orders (id TEXT)"))
+    monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: True)
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: True)
+    monkeypatch.setattr(DatabaseHelper, "get_engine", lambda: engine)
+    monkeypatch.setattr(DatabaseHelper, "create_async_session", sessionmaker(bind=engine, class_=AsyncSession))
+    yield engine
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_duplicate_messages_are_skipped(sync_database, make_message, count):
+    # Given
+    ledger = MessageLedger("orders")
+    await ledger.create_table()
+    calls = []
+
+    def handler(message, session):
+        calls.append(message.message_id)
+        session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+
+    # When
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+
+    # Then
+    assert calls == ["1"]
+    assert count(sync_database, "orders") == 1
+    assert count(sync_database, LEDGER_TABLE.name) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_handler_is_not_recorded(sync_database, make_message, count):
+    ledger = MessageLedger("orders")
+    await ledger.create_table()
+
+    def handler(message, session):
+        session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await _handle_message(make_message("1"), handler, ledger=ledger)
+
+    assert count(sync_database, "orders") == 0
+    assert count(sync_database, LEDGER_TABLE.name) == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_is_treated_as_processed(sync_database, capfd, make_message, count):
+    # Given
+    ledger = MessageLedger("orders")
+    await ledger.create_table()
+
+    def handler(message):
+        # Another delivery of the same message commits first
+        with sync_database.begin() as connection:
+            connection.execute(ledger._record_statement(message.message_id))
+
+    # When
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+
+    # Then
+    assert count(sync_database, LEDGER_TABLE.name) == 1
+    assert "Info: Message 1 was processed by another delivery at the same time" in capfd.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_duplicate_messages_are_skipped_async(async_database, make_message):
+    ledger = MessageLedger("orders")
+    await ledger.create_table()
+    calls = []
+
+    async def handler(message, session):
+        calls.append(message.message_id)
+        await session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+    await _handle_message(make_message("2"), handler, ledger=ledger)
+
+    assert calls == ["1", "2"]
+    async with async_database.connect() as connection:
+        assert (await connection.execute(text(f"SELECT COUNT(*) FROM {LEDGER_TABLE.name}"))).scalar() == 2
+
+
+@pytest.mark.asyncio
+async def test_prune_removes_old_entries(sync_database):
+    # Given
+    ledger = MessageLedger("orders")
+    await ledger.create_table()
+    with sync_database.begin() as connection:
+        connection.execute(LEDGER_TABLE.insert().values(
+            subscription="orders", message_id="old", processed_at=datetime.now(timezone.utc) - timedelta(days=8),
+        ))
+        connection.execute(ledger._record_statement("new"))
+
+    # When
+    await ledger.prune(timedelta(days=7))
+
+    # Then
+    with sync_database.connect() as connection:
+        remaining = [row[0] for row in connection.execute(text(f"SELECT message_id FROM {LEDGER_TABLE.name}"))]
+    assert remaining == ["new"]
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import text
+
+import python_publish_subscribe.src.db.OffloadedSession as offloaded
+from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.Subscriber import _handle_message
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.Ledger import LEDGER_TABLE, MessageLedger
+from python_publish_subscribe.src.db.OffloadedSession import OffloadedSession, get_offload_executor
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+@pytest.mark.asyncio
+async def test_calls_run_on_the_database_thread_pool():
+    # Given
+    threads = []
+    session = OffloadedSession(MagicMock())
+
+    # When
+    await session.run_sync(lambda sync_session: threads.append(threading.current_thread().name))
+
+    # Then
+    assert threads[0].startswith("database")
+    assert threads[0] != threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_calls_are_made_one_at_a_time():
+    # Given
+    running = []
+    overlaps = []
+
+    def work(sync_session):
+        if running:
+            overlaps.append(True)
+        running.append(True)
+        threading.Event().wait(0.01)
+        running.pop()
+
+    session = OffloadedSession(MagicMock(), executor=ThreadPoolExecutor(max_workers=4))
+
+    # When
+    await asyncio.gather(*(session.run_sync(work) for _ in range(5)))
+
+    # Then
+    assert overlaps == []
+
+
+def test_executor_is_bounded_by_config(monkeypatch):
+    # Given
+    monkeypatch.setattr(offloaded, "_executor", None)
+    monkeypatch.setattr(DatabaseHelper, "get_config", lambda: {Config.ConfigKeys.DATABASE_OFFLOAD_WORKERS.name: "3"})
+
+    # When
+    executor = get_offload_executor()
+
+    # Then
+    assert executor._max_workers == 3
+    assert get_offload_executor() is executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_async_handler_writes_with_sync_engine(sync_database, make_message, count):
+    # Given
+    async def handler(message, session, read_session):
+        assert isinstance(read_session, OffloadedSession)
+        assert await read_session.scalar(text("SELECT COUNT(*) FROM orders")) == 0
+        await session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+
+    # When
+    await _handle_message(make_message("1"), handler)
+
+    # Then
+    assert count(sync_database, "orders") == 1
+
+
+@pytest.mark.asyncio
+async def test_async_handler_failure_rolls_back_with_sync_engine(sync_database, make_message, count):
+    async def handler(message, session):
+        await session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await _handle_message(make_message("1"), handler)
+
+    assert count(sync_database, "orders") == 0
+
+
+@pytest.mark.asyncio
+async def test_ledger_with_async_handler_and_sync_engine(sync_database, make_message, count):
+    # Given
+    ledger = MessageLedger("orders")
+    await ledger.create_table()
+    calls = []
+
+    async def handler(message, session):
+        calls.append(message.message_id)
+        await session.execute(text("INSERT INTO orders (id) VALUES (:id)"), {"id": message.message_id})
+
+    # When
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+    await _handle_message(make_message("1"), handler, ledger=ledger)
+
+    # Then
+    assert calls == ["1"]
+    assert count(sync_database, "orders") == 1
+    assert count(sync_database, LEDGER_TABLE.name) == 1
@@ -0,0 +1,112 @@
+import pytest
+from sqlalchemy import text
+
+from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.Subscriber import _handle_message
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.Sharding import ShardRouter
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+@pytest.fixture(autouse=True)
+def reset_database_helper():
+    DatabaseHelper._instance = None
+    yield
+    DatabaseHelper._instance = None
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    DatabaseHelper(Config({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'primary.db'}",
+        "DATABASE_ENGINES": f"shard-a=sqlite:///{tmp_path / 'a.db'}, shard-b=sqlite:///{tmp_path / 'b.db'}",
+    }))
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    for name in ("shard-a", "shard-b"):
+        with DatabaseHelper.get_engine(name).begin() as connection:
+            connection.execute(text("CREATE TABLE orders (customer TEXT)"))
+    return ["shard-a", "shard-b"]
+
+
+def customers_in(database):
+    with DatabaseHelper.get_engine(database).connect() as connection:
+        return {row[0] for row in connection.execute(text("SELECT customer FROM orders"))}
+
+
+def test_router_sends_the_same_key_to_the_same_shard(make_message):
+    router = ShardRouter(["a", "b", "c"], attribute="customer")
+
+    routes = {router.route(make_message(attributes={"customer": str(key)})) for key in range(5) for _ in range(3)}
+    assignments = {router.shard_for(str(key)) for key in range(300)}
+
+    assert all(router.route(make_message(attributes={"customer": "42"})) == router.shard_for("42") for _ in range(3))
+    assert routes <= {"a", "b", "c"}
+    assert assignments == {"a", "b", "c"}
+
+
+def test_adding_a_shard_only_moves_keys_to_the_new_shard():
+    before = ShardRouter(["a", "b", "c"])
+    after = ShardRouter(["a", "b", "c", "d"])
+
+    moved = [key for key in map(str, range(1000)) if before.shard_for(key) != after.shard_for(key)]
+
+    assert moved, "Some keys should move to the new shard"
+    assert all(after.shard_for(key) == "d" for key in moved)
+
+
+def test_router_keys(make_message):
+    message = make_message(attributes={"customer": "1"})
+    message.ordering_key = "order-key"
+
+    assert ShardRouter(["a"]).get_key(message) == "order-key"
+    assert ShardRouter(["a"], attribute="customer").get_key(message) == "1"
+    assert ShardRouter(["a"], key=lambda m: "custom").get_key(message) == "custom"
+
+
+def test_router_rejects_messages_without_a_key(make_message):
+    with pytest.raises(ValueError):
+        ShardRouter(["a"], attribute="customer").route(make_message())
+    with pytest.raises(ValueError):
+        ShardRouter([])
+
+
+def test_named_databases(shards, tmp_path):
+    assert DatabaseHelper.has_engine("shard-a")
+    assert not DatabaseHelper.has_engine("shard-c")
+    assert DatabaseHelper.create_session("shard-b").get_bind().url.database == str(tmp_path / 'b.db')
+    assert DatabaseHelper.create_session().get_bind().url.database == str(tmp_path / 'primary.db')
+    with pytest.raises(ValueError):
+        DatabaseHelper.create_session("shard-c")
+    with pytest.raises(ValueError):
+        DatabaseHelper.get_engine("shard-c")
+
+
+@pytest.mark.asyncio
+async def test_handler_sessions_follow_the_shard_router(shards, make_message):
+    # Given
+    router = ShardRouter(shards, attribute="customer")
+
+    def handler(message, session):
+        session.execute(text("INSERT INTO orders (customer) VALUES (:customer)"), message.attributes)
+
+    # When
+    for customer in map(str, range(20)):
+        await _handle_message(make_message(attributes={"customer": customer}), handler, database=router)
+
+    # Then
+    for shard in shards:
+        assert customers_in(shard) == {str(key) for key in range(20) if router.shard_for(str(key)) == shard}
+    assert customers_in("shard-a") and customers_in("shard-b")
+
+
+@pytest.mark.asyncio
+async def test_handler_sessions_use_a_named_database(shards, make_message):
+    def handler(message, session, read_session):
+        assert read_session.get_bind() is session.get_bind()
+        session.execute(text("INSERT INTO orders (customer) VALUES ('1')"))
+
+    await _handle_message(make_message(), handler, database="shard-b")
+
+    assert customers_in("shard-b") == {"1"}
+    assert customers_in("shard-a") == set()
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from python_publish_subscribe.src.Concurrency import AdaptiveConcurrencyLimiter
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter(max_limit=5, min_limit=10)
+
+
+@pytest.mark.asyncio
+async def test_bounds_concurrency_to_limit():
+    # Given
+    limiter = AdaptiveConcurrencyLimiter(max_limit=3, initial_limit=3)
+    running = {"now": 0, "max": 0}
+
+    async def handle():
+        async with limiter:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+
+    # When
+    await asyncio.gather(*[handle() for _ in range(10)])
+
+    # Then
+    assert running["max"] == 3
+    assert limiter.in_flight == 0
+
+
+def test_limit_grows_while_fast_and_used():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=20, initial_limit=2)
+
+    for _ in range(20):
+        limiter._in_flight = int(limiter.limit) - 1
+        limiter._update(0.01, failed=False)
+    used = limiter.limit
+    limiter._in_flight = 0
+    limiter._update(0.01, failed=False)
+
+    assert used > 4
+    assert limiter.limit == used
+
+
+def test_limit_is_cut_on_errors():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=20, initial_limit=10)
+
+    limiter._update(0.01, failed=True)
+
+    assert limiter.limit == pytest.approx(9)
+
+
+def test_limit_is_cut_when_latency_rises():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=20, initial_limit=10, smoothing=1.0)
+    limiter._update(0.01, failed=False)
+
+    limiter._update(0.05, failed=False)
+
+    assert limiter.limit < 10
+    assert limiter.limit >= limiter.min_limit
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_frees_its_place():
+    # Given
+    limiter = AdaptiveConcurrencyLimiter(max_limit=1, initial_limit=1)
+    await limiter.__aenter__()
+    waiting = asyncio.ensure_future(limiter.__aenter__())
+    await asyncio.sleep(0)
+
+    # When
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    await limiter.__aexit__(None, None, None)
+
+    # Then
+    assert limiter.in_flight == 0
+    assert not limiter._waiters
@@ -0,0 +1,121 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from python_publish_subscribe.src.Metrics import MetricsRegistry, metrics, serve_metrics, HANDLER_LATENCY
+from python_publish_subscribe.src.Subscriber import _handle_message_limited
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+
+
+def test_render_counter_gauge_and_histogram():
+    # Given
+    registry = MetricsRegistry()
+    received = registry.counter('received_total', 'Messages received', ['subscription'])
+    registry.gauge('queue_depth', 'Queue depth', function=lambda: 3)
+    latency = registry.histogram('latency_seconds', 'Latency', ['subscription'], buckets=(0.1, 1))
+
+    # When
+    received.inc('orders')
+    received.inc('orders')
+    latency.observe(0.05, 'orders')
+    latency.observe(0.5, 'orders')
+    latency.observe(5, 'orders')
+    output = registry.render()
+
+    # Then
+    assert '# TYPE received_total counter' in output
+    assert 'received_total{subscription="orders"} 2' in output
+    assert 'queue_depth 3' in output
+    assert 'latency_seconds_bucket{subscription="orders",le="0.1"} 1' in output
+    assert 'latency_seconds_bucket{subscription="orders",le="1"} 2' in output
+    assert 'latency_seconds_bucket{subscription="orders",le="+Inf"} 3' in output
+    assert 'latency_seconds_sum{subscription="orders"} 5.55' in output
+    assert 'latency_seconds_count{subscription="orders"} 3' in output
+
+
+def test_duplicate_metric_raises():
+    registry = MetricsRegistry()
+    registry.counter('received_total', 'Messages received')
+    with pytest.raises(ValueError):
+        registry.counter('received_total', 'Messages received')
+
+
+@pytest.mark.asyncio
+async def test_handler_latency_only_recorded_when_enabled(enabled_metrics):
+    async def cb(message):
+        pass
+    before = HANDLER_LATENCY.count('metrics-sub')
+
+    await _handle_message_limited(MagicMock(attributes={}, message_id='1'), cb, subscription_name='metrics-sub')
+    metrics.disable()
+    await _handle_message_limited(MagicMock(attributes={}, message_id='1'), cb, subscription_name='metrics-sub')
+
+    assert HANDLER_LATENCY.count('metrics-sub') == before + 1
+
+
+def test_publish_records_latency_when_enabled(app, enabled_metrics):
+    # Given
+    future = MagicMock()
+    future.exception.return_value = None
+    future.add_done_callback.side_effect = lambda done: done(future)
+    with patch.object(app.publisher, '_publisher') as client:
+        client.publish.return_value = future
+        before = metrics._metrics['pubsub_publish_latency_seconds'].count('metrics-topic')
+
+        # When
+        app.publisher.publish('projects/test/topics/metrics-topic', {'a': 1}, asynchronous=True)
+
+    # Then
+    assert metrics._metrics['pubsub_publish_latency_seconds'].count('metrics-topic') == before + 1
+
+
+@pytest.mark.asyncio
+async def test_serve_metrics():
+    # Given
+    servers = []
+    original = asyncio.start_server
+
+    async def start_server(*args, **kwargs):
+        server = await original(*args, **kwargs)
+        servers.append(server)
+        return server
+
+    with patch('asyncio.start_server', start_server):
+        task = asyncio.ensure_future(serve_metrics(0, '127.0.0.1'))
+        while not servers:
+            await asyncio.sleep(0.01)
+        port = servers[0].sockets[0].getsockname()[1]
+
+        # When
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = (await reader.read()).decode()
+        writer.close()
+        task.cancel()
+
+    # Then
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert '# TYPE pubsub_messages_received_total counter' in response
+
+
+def test_app_run_enables_metrics_when_port_set(app):
+    # Given
+    app.config.set('METRICS_PORT', '9100')
+
+    # When
+    with patch.object(app.subscriber, 'start_subscription_tasks') as mock_run:
+        app.run()
+    enabled = metrics.enabled
+    metrics.disable()
+
+    # Then
+    mock_run.assert_called_once()
+    assert enabled
+    assert len(app.subscriber._background_tasks) == 2
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from python_publish_subscribe.src.Ordering import OrderingKeyError, OrderingKeyScheduler
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+async def record(events, name, delay=0.0):
+    events.append(f"{name}-start")
+    await asyncio.sleep(delay)
+    events.append(f"{name}-end")
+
+
+@pytest.mark.asyncio
+async def test_same_key_runs_in_order():
+    # Given
+    scheduler = OrderingKeyScheduler()
+    events = []
+
+    # When
+    await asyncio.gather(
+        scheduler.run_in_order("a", record(events, "first", 0.02)),
+        scheduler.run_in_order("a", record(events, "second")),
+    )
+
+    # Then
+    assert events == ["first-start", "first-end", "second-start", "second-end"]
+
+
+@pytest.mark.asyncio
+async def test_different_keys_run_concurrently():
+    scheduler = OrderingKeyScheduler()
+    events = []
+
+    await asyncio.gather(
+        scheduler.run_in_order("a", record(events, "a", 0.02)),
+        scheduler.run_in_order("b", record(events, "b", 0.02)),
+    )
+
+    assert events[:2] == ["a-start", "b-start"]
+
+
+@pytest.mark.asyncio
+async def test_idle_keys_are_evicted():
+    scheduler = OrderingKeyScheduler()
+    pending = [scheduler.run_in_order(str(key), asyncio.sleep(0)) for key in range(100)]
+    assert len(scheduler) == 100
+
+    await asyncio.gather(*pending)
+
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_handler_fails_messages_queued_behind_it():
+    # Given
+    scheduler = OrderingKeyScheduler()
+    events = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    # When
+    results = await asyncio.gather(
+        scheduler.run_in_order("a", fail()),
+        scheduler.run_in_order("a", record(events, "next")),
+        scheduler.run_in_order("a", record(events, "last")),
+        scheduler.run_in_order("b", record(events, "other")),
+        return_exceptions=True,
+    )
+
+    # Then the queued messages of the key aren't handled before the failed one is redelivered
+    assert isinstance(results[0], RuntimeError)
+    assert isinstance(results[1], OrderingKeyError)
+    assert isinstance(results[2], OrderingKeyError)
+    assert events == ["other-start", "other-end"]
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_key_is_usable_after_a_failure():
+    scheduler = OrderingKeyScheduler()
+    events = []
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await scheduler.run_in_order("a", fail())
+    await scheduler.run_in_order("a", record(events, "redelivered"))
+
+    assert events == ["redelivered-start", "redelivered-end"]
+
+
+@pytest.mark.asyncio
+async def test_messages_without_key_are_not_ordered():
+    scheduler = OrderingKeyScheduler()
+    coroutine = asyncio.sleep(0)
+
+    assert scheduler.run_in_order("", coroutine) is coroutine
+    await coroutine
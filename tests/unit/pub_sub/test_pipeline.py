@@ -0,0 +1,97 @@
+import asyncio
+import json
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+def message_with(data, attributes=None):
+    message = MagicMock()
+    message.data = json.dumps(data).encode('utf-8')
+    message.attributes = attributes or {}
+    return message
+
+
+def published_future(result="message-id"):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def test_pipeline_registers_subscription(app):
+    # Given
+    with patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+        # When
+        pipeline = app.pipeline("orders", max_in_flight=10).transform(lambda data: data).to("enriched-orders")
+
+    # Then
+    mock_add_subscription.assert_called_once_with("orders", pipeline._handle, max_concurrency=10)
+
+
+def test_pipeline_rejects_max_concurrency(app):
+    with pytest.raises(ValueError, match="max_in_flight"):
+        app.pipeline("orders", max_concurrency=10)
+
+
+def test_pipeline_stages_cannot_be_added_after_output(app):
+    pipeline = app.pipeline("orders").to("enriched-orders")
+
+    with pytest.raises(RuntimeError):
+        pipeline.transform(lambda data: data)
+    with pytest.raises(RuntimeError):
+        pipeline.to("other-topic")
+
+
+@pytest.mark.asyncio
+async def test_pipeline_transforms_and_publishes(app):
+    async def add_tax(data):
+        return {**data, "total": data["price"] * 2}
+
+    pipeline = app.pipeline("orders").transform(lambda data: {"price": data["price"] + 1}).transform(add_tax)
+    pipeline.to("enriched-orders", attributes={"source": "pipeline"})
+
+    with patch.object(app.publisher, "publish", return_value=published_future()) as mock_publish:
+        await pipeline._handle(message_with({"price": 1}))
+
+    mock_publish.assert_called_once_with(
+        "enriched-orders", {"price": 2, "total": 4}, attributes={"source": "pipeline"}, asynchronous=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_pipeline_forwards_attributes(app):
+    pipeline = app.pipeline("orders", forward_attributes=True).to("enriched-orders", attributes={"source": "pipeline"})
+
+    with patch.object(app.publisher, "publish", return_value=published_future()) as mock_publish:
+        await pipeline._handle(message_with("data", {"type": "order"}))
+
+    assert mock_publish.call_args[1]["attributes"] == {"type": "order", "source": "pipeline"}
+
+
+@pytest.mark.asyncio
+async def test_pipeline_filters_none(app):
+    pipeline = app.pipeline("orders").transform(lambda data: None).transform(MagicMock()).to("enriched-orders")
+
+    with patch.object(app.publisher, "publish") as mock_publish:
+        await pipeline._handle(message_with("data"))
+
+    mock_publish.assert_not_called()
+    pipeline._stages[1].assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_waits_for_publish_to_be_confirmed(app):
+    pipeline = app.pipeline("orders").to("enriched-orders")
+    future = Future()
+
+    with patch.object(app.publisher, "publish", return_value=future):
+        handling = asyncio.ensure_future(pipeline._handle(message_with("data")))
+        await asyncio.sleep(0.01)
+        assert not handling.done()
+
+        future.set_exception(RuntimeError("publish failed"))
+        with pytest.raises(RuntimeError):
+            await handling
@@ -0,0 +1,88 @@
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+from python_publish_subscribe.src.Profiling import Profiler, profiler
+from python_publish_subscribe.src.Subscriber import _handle_message
+
+
+@pytest.fixture
+def phases():
+    recorded = []
+
+    def hook(subscription_name, phase, seconds):
+        recorded.append((subscription_name, phase))
+        assert seconds >= 0
+
+    profiler.add_phase_hook(hook)
+    yield recorded
+    profiler.remove_phase_hook(hook)
+
+
+def test_no_timer_without_metrics_or_hooks():
+    assert Profiler().timer("sub") is None
+
+
+@pytest.mark.asyncio
+async def test_phases_of_async_handler(phases):
+    async def cb(message):
+        pass
+
+    await _handle_message(MagicMock(), cb, timer=profiler.timer("sub"))
+
+    assert phases == [("sub", "queue_wait"), ("sub", "dispatch"), ("sub", "handler")]
+
+
+@pytest.mark.asyncio
+async def test_phases_of_sync_handler_with_session(monkeypatch, phases):
+    session = MagicMock()
+    monkeypatch.setattr("python_publish_subscribe.src.Subscriber.DatabaseHelper.create_session", lambda: session)
+
+    def cb(message, session):
+        pass
+
+    await _handle_message(MagicMock(), cb, timer=profiler.timer("sub"))
+
+    assert [phase for _, phase in phases] == ["queue_wait", "dispatch", "handler", "commit"]
+    session.commit.assert_called_once()
+
+
+def test_sample_attributes_stack_to_handler(tmp_path):
+    # Given
+    sampler = Profiler()
+    samples = []
+
+    def handler(message):
+        inner()
+
+    def inner():
+        sampler.sample(sys._getframe())
+        samples.append(True)
+
+    sampler.register_handler("projects/p/subscriptions/orders", handler)
+
+    # When
+    handler(None)
+    sampler.sample(sys._getframe())
+    paths = sampler.dump(str(tmp_path))
+
+    # Then
+    stacks = sampler.collapsed_stacks()["projects/p/subscriptions/orders"]
+    assert len(stacks) == 1
+    stack, count = stacks[0].rsplit(" ", 1)
+    assert count == "1"
+    assert stack.split(";")[0].startswith("handler (")
+    assert stack.split(";")[-1].startswith("inner (")
+    assert paths == [str(tmp_path / "orders.folded")]
+    assert (tmp_path / "orders.folded").read_text() == stacks[0] + "\n"
+
+
+def test_start_and_stop_sampling():
+    sampler = Profiler()
+
+    sampler.start_sampling(interval=0.001)
+    assert sampler.sampling
+    sampler.stop_sampling()
+
+    assert not sampler.sampling
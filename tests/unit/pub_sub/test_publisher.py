@@ -2,12 +2,13 @@ import json
 from unittest.mock import MagicMock, patch
 
 import pytest
-from google.api_core.exceptions import AlreadyExists, InvalidArgument
+from google.api_core.exceptions import AlreadyExists, InvalidArgument, NotFound
 from google.cloud.pubsub_v1.futures import Future
 
 from python_publish_subscribe.src.Publisher import Publisher
-from python_publish_subscribe.src.Publisher import convert_data_to_string
+from python_publish_subscribe.src.Publisher import convert_data_to_string, convert_bytes_to_data
 from python_publish_subscribe.config import Config
+import python_publish_subscribe.src.db.Cache as Cache
 
 TEST_TOPIC_NAME = "test-topic"
 TEST_TOPIC = "projects/project_name/topics/topic_name"
@@ -164,6 +165,18 @@ def test_error_when_creating_topic(app, mock_publisher_client, capfd):
     assert f"Error: Something when wrong when creating topic {topic_name}: Some Error" in capfd.readouterr().out, "Expected an error message"
     assert not is_topic_created, "Expected the topic not to be created"
 
+def test_topic_exists(app, mock_publisher_client):
+    # Given
+    mock_publisher_client.get_topic.side_effect = [MagicMock(), NotFound("Topic not found")]
+
+    # When
+    exists = app.publisher.topic_exists("test-topic")
+    deleted = app.publisher.topic_exists("test-topic")
+
+    # Then
+    assert exists and not deleted
+    mock_publisher_client.get_topic.assert_called_with(topic="projects/test-project/topics/test-topic")
+
 def test_getting_topic(app):
     # Given
     topic_name = "test-topic"
@@ -318,7 +331,8 @@ def test_crate_subscribe_wrapper_success(app):
     subscription_name = "test-sub"
     topic_name = "test-topic"
 
-    with patch.object(app.subscriber, "create_subscription", return_value='mocked_create_response') as mock_create_subscription:
+    with patch.object(app.topology, "add_subscription") as mock_declare_subscription, \
+            patch.object(app.subscriber, "create_subscription") as mock_create_subscription:
         with patch.object(app.subscriber, "add_subscription", return_value='mocked_add_response') as mock_add_subscription:
             @app.subscribe(subscription_name, topic_name)
             def subscribe(message):
@@ -326,7 +340,8 @@ def test_crate_subscribe_wrapper_success(app):
 
         # When
         # Then
-            mock_create_subscription.assert_called_once_with(subscription_name, topic_name), "A subscription was created"
+            mock_declare_subscription.assert_called_once_with(subscription_name, topic_name), "A subscription was declared"
+            mock_create_subscription.assert_not_called(), "The subscription is only created when the app is run"
             mock_add_subscription.assert_called_once_with(subscription_name, subscribe), "Subscription should've been added"
 
 
@@ -383,4 +398,98 @@ def test_config_timeout(monkeypatch):
 
     publisher = Publisher.Publisher(Config(), timout=100)
 
-    assert publisher._timout == 100, "Timeout should've been configured"
\ No newline at end of file
+    assert publisher._timout == 100, "Timeout should've been configured"
+
+def test_subscribe_wrapper_passes_subscription_options(app):
+    with patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+        @app.subscribe("test-sub", max_concurrency=4)
+        def subscribe(message):
+            return message
+
+        mock_add_subscription.assert_called_once_with("test-sub", subscribe, max_concurrency=4)
+
+
+def test_stop_waits_for_asynchronous_publishes(app, mock_publisher_client, mock_get_topic):
+    future = Future()
+    mock_publisher_client.publish.return_value = future
+    app.publisher.publish("test-topic", "data", asynchronous=True)
+    assert future in app.publisher._pending_futures
+
+    future.set_result("message-id")
+    app.publisher.stop(timeout=1)
+
+    mock_publisher_client.stop.assert_called_once()
+    assert not app.publisher._pending_futures
+
+
+def test_stop_timeout_from_env_string(app, mock_publisher_client, mock_get_topic):
+    # Given values loaded from a .env file are strings
+    app.publisher._config.set(Config.ConfigKeys.SHUTDOWN_TIMEOUT.name, "1")
+    future = Future()
+    mock_publisher_client.publish.return_value = future
+    app.publisher.publish("test-topic", "data", asynchronous=True)
+    future.set_result("message-id")
+
+    # When
+    app.publisher.stop()
+
+    # Then
+    assert not app.publisher._pending_futures
+
+
+def test_stop_with_no_time_left_does_not_wait(app, mock_publisher_client, mock_get_topic, capfd):
+    # Given a shutdown whose deadline has already passed
+    app.publisher._config.set(Config.ConfigKeys.SHUTDOWN_TIMEOUT.name, "10")
+    mock_publisher_client.publish.return_value = Future()
+    app.publisher.publish("test-topic", "data", asynchronous=True)
+
+    # When
+    app.publisher.stop(timeout=0)
+
+    # Then
+    assert "Warning: 1 messages were not published" in capfd.readouterr().out
+
+
+def test_subscribe_wrapper_creates_subscription_with_dead_letter_topic(app):
+    with patch.object(app.topology, "add_subscription") as mock_create_subscription:
+        with patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+            @app.subscribe("test-sub", "test-topic", dead_letter_topic="dead-letters", min_retry_backoff=10)
+            def subscribe(message):
+                return message
+
+            mock_create_subscription.assert_called_once_with("test-sub", "test-topic", dead_letter_topic="dead-letters")
+            mock_add_subscription.assert_called_once_with("test-sub", subscribe, min_retry_backoff=10)
+
+
+def test_convert_bytes_to_data():
+    assert convert_bytes_to_data(b'{"foo": [1, 2]}') == {"foo": [1, 2]}
+    assert convert_bytes_to_data(b'hello') == "hello"
+
+
+def test_subscribe_wrapper_creates_subscription_with_filter_and_exactly_once(app):
+    with patch.object(app.topology, "add_subscription") as mock_create_subscription:
+        with patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+            @app.subscribe("test-sub", "test-topic", filter='attributes.type = "order"', exactly_once_delivery=True)
+            def subscribe(message):
+                return message
+
+            mock_create_subscription.assert_called_once_with(
+                "test-sub", "test-topic", filter='attributes.type = "order"', enable_exactly_once_delivery=True
+            )
+            mock_add_subscription.assert_called_once_with("test-sub", subscribe, exactly_once_delivery=True)
+
+
+def test_app_invalidates_caches_on_a_subscription(app):
+    with patch.object(app.subscriber, "add_subscription") as add_subscription, \
+            patch.object(app.topology, "add_subscription") as declare_subscription:
+        app.invalidate_caches_on("cache-invalidation", "cache-updates")
+
+    add_subscription.assert_called_once_with("cache-invalidation", Cache.invalidate_from_message)
+    declare_subscription.assert_called_once_with("cache-invalidation", "cache-updates")
+
+
+def test_app_publishes_cache_invalidations(app):
+    with patch.object(app.publisher, "publish", return_value="1") as publish:
+        app.publish_cache_invalidation("cache-updates", "customers", 42)
+
+    publish.assert_called_once_with("cache-updates", "invalidate", attributes={"cache": "customers", "key": "42"})
@@ -0,0 +1,224 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from python_publish_subscribe.src.Replay import Replay
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.Sharding import ShardRouter
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+def test_replay_registers_with_raised_flow_control_without_seeking(app):
+    # Given
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    with patch.object(app.subscriber, "seek", return_value=True) as mock_seek, \
+            patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+        # When
+        @app.replay("orders", from_time=since, max_in_flight=2000)
+        def handle(message, session):
+            pass
+
+    # Then the seek is left until the app is run
+    mock_seek.assert_not_called()
+    assert mock_add_subscription.call_args.kwargs == {"max_concurrency": 2000}
+
+
+def test_run_with_replay_seeks_after_provisioning(app):
+    # Given
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    calls = []
+    app.topology = MagicMock()
+    app.topology.provision.side_effect = lambda: calls.append("provision")
+    with patch.object(app.subscriber, "add_subscription"):
+        @app.replay("orders", from_time=since)
+        def handle(message, session):
+            pass
+
+    with patch.object(app.subscriber, "seek", side_effect=lambda *args, **kwargs: calls.append("seek") or True) as mock_seek, \
+            patch.object(app.subscriber, "start_subscription_tasks"):
+        # When
+        app.run(replay=True)
+
+    # Then
+    mock_seek.assert_called_once_with("orders", time=since, snapshot=None)
+    assert calls == ["provision", "seek"]
+
+
+def test_run_without_replay_resumes(app, capfd):
+    # Given
+    app.topology = MagicMock()
+    with patch.object(app.subscriber, "add_subscription"):
+        @app.replay("orders", snapshot="before-deploy")
+        def handle(message, session):
+            pass
+
+    with patch.object(app.subscriber, "seek") as mock_seek, patch.object(app.subscriber, "start_subscription_tasks"):
+        # When
+        app.run()
+
+    # Then
+    mock_seek.assert_not_called()
+    assert "run with replay=True to seek them back" in capfd.readouterr().out
+
+
+def test_replay_rejects_max_concurrency(app):
+    with pytest.raises(ValueError, match="max_in_flight"):
+        Replay("orders", lambda message: None, app.subscriber, max_concurrency=10)
+
+
+def test_replay_fails_if_seek_fails(app):
+    with patch.object(app.subscriber, "seek", return_value=False):
+        replay = Replay("orders", lambda message: None, app.subscriber, snapshot="before-deploy")
+        with pytest.raises(RuntimeError):
+            replay.seek()
+
+
+@pytest.mark.asyncio
+async def test_replay_writes_batches_with_one_commit(app, sync_database, make_message):
+    # Given
+    def handle(message, session):
+        value = int(message.data)
+        session.execute(text("INSERT INTO events (value) VALUES (:value)"), {"value": value})
+        if value == 3:
+            raise ValueError("bad message")
+
+    replay = Replay("orders", handle, app.subscriber, batch_size=5, batch_latency=10)
+
+    # When
+    results = await asyncio.gather(
+        *[replay._handle(make_message(data=str(value).encode('utf-8'))) for value in range(5)], return_exceptions=True
+    )
+
+    # Then
+    assert [isinstance(result, ValueError) for result in results] == [False, False, False, True, False]
+    with sync_database.connect() as connection:
+        values = [row[0] for row in connection.execute(text("SELECT value FROM events ORDER BY value"))]
+    assert values == [0, 1, 2, 4]
+    assert replay.progress()["handled"] == 4
+
+
+@pytest.mark.asyncio
+async def test_replay_async_callback_with_sync_engine(app, sync_database, make_message):
+    # Given
+    async def handle(message, session):
+        value = int(message.data)
+        await session.execute(text("INSERT INTO events (value) VALUES (:value)"), {"value": value})
+        if value == 1:
+            raise ValueError("bad message")
+
+    replay = Replay("orders", handle, app.subscriber, batch_size=3, batch_latency=10)
+
+    # When
+    results = await asyncio.gather(
+        *[replay._handle(make_message(data=str(value).encode('utf-8'))) for value in range(3)], return_exceptions=True
+    )
+
+    # Then only the failed message's savepoint is rolled back
+    assert [isinstance(result, ValueError) for result in results] == [False, True, False]
+    with sync_database.connect() as connection:
+        values = [row[0] for row in connection.execute(text("SELECT value FROM events ORDER BY value"))]
+    assert values == [0, 2]
+
+
+@pytest.mark.asyncio
+async def test_replay_flushes_partial_batch_after_latency(app, sync_database, make_message):
+    def handle(message, session):
+        session.execute(text("INSERT INTO events (value) VALUES (1)"))
+
+    replay = Replay("orders", handle, app.subscriber, batch_size=100, batch_latency=0.01)
+
+    await asyncio.wait_for(replay._handle(make_message(data=b"1")), timeout=1)
+
+    with sync_database.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM events")).scalar() == 1
+
+
+@pytest.mark.asyncio
+async def test_replay_batches_per_shard(app, tmp_path, monkeypatch, make_message):
+    # Given
+    engines = {}
+    for name in ("first", "second"):
+        engines[name] = create_engine(f"sqlite:///{tmp_path / f'{name}.db'}")
+        with engines[name].begin() as connection:
+            connection.execute(text("CREATE TABLE events (value INTEGER)"))
+    makers = {name: sessionmaker(bind=engine) for name, engine in engines.items()}
+    monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: True)
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    monkeypatch.setattr(DatabaseHelper, "create_session", lambda name=None: makers[name]())
+    router = ShardRouter(["first", "second"], key=lambda message: message.data.decode())
+
+    def handle(message, session):
+        session.execute(text("INSERT INTO events (value) VALUES (:value)"), {"value": int(message.data)})
+
+    replay = Replay("orders", handle, app.subscriber, batch_size=100, batch_latency=0.01, database=router)
+
+    # When
+    await asyncio.gather(*[replay._handle(make_message(data=str(value).encode('utf-8'))) for value in range(10)])
+
+    # Then every message is written to its shard
+    for name, engine in engines.items():
+        with engine.connect() as connection:
+            values = [row[0] for row in connection.execute(text("SELECT value FROM events"))]
+        assert values and all(router.shard_for(str(value)) == name for value in values)
+        engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_replay_progress(app, monkeypatch, capfd, make_message):
+    # Given
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    monkeypatch.setattr(app.subscriber, "seek", lambda *args, **kwargs: True)
+
+    async def handle(message):
+        pass
+
+    replay = Replay("orders", handle, app.subscriber, from_time=since, progress_interval=0)
+    replay.seek()
+    halfway = datetime.fromtimestamp((since.timestamp() + replay._started) / 2, tz=timezone.utc)
+
+    # When
+    await replay._handle(make_message(data=b"1", publish_time=halfway))
+
+    # Then
+    progress = replay.progress()
+    assert progress["handled"] == 1
+    assert progress["percent"] == pytest.approx(50, abs=0.1)
+    assert "Info: Replay of orders: 50.0%, 1 messages" in capfd.readouterr().out
+
+
+def test_replay_is_timed_from_the_seek(app, monkeypatch):
+    # Given a replay registered long before the app is run
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    monkeypatch.setattr(app.subscriber, "seek", lambda *args, **kwargs: True)
+    monkeypatch.setattr("python_publish_subscribe.src.Replay.time.time", lambda: 1000.0)
+    replay = Replay("orders", lambda message: None, app.subscriber, from_time=since)
+    assert replay.progress()["rate"] == 0.0
+
+    # When
+    monkeypatch.setattr("python_publish_subscribe.src.Replay.time.time", lambda: 2000.0)
+    replay.seek()
+
+    # Then
+    assert replay._started == 2000.0
+
+
+@pytest.mark.asyncio
+async def test_replay_without_a_seek_is_timed_from_the_first_message(app, monkeypatch, make_message):
+    # Given
+    async def handle(message):
+        pass
+
+    replay = Replay("orders", handle, app.subscriber)
+    monkeypatch.setattr("python_publish_subscribe.src.Replay.time.time", lambda: 2000.0)
+
+    # When
+    await replay._handle(make_message(publish_time=datetime.fromtimestamp(1500.0, tz=timezone.utc)))
+
+    # Then the message published before the replay started isn't treated as caught up
+    assert replay._started == 2000.0
+    assert not replay._caught_up
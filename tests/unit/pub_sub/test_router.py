@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from python_publish_subscribe.src.Router import MessageRouter
+
+
+def message_with(attributes):
+    message = MagicMock()
+    message.attributes = attributes
+    return message
+
+
+def test_route_by_attribute():
+    # Given
+    router = MessageRouter()
+    orders, refunds = MagicMock(), MagicMock()
+    router.add_route(orders, {"type": "order"})
+    router.add_route(refunds, {"type": "refund"})
+
+    # When / Then
+    assert router.route(message_with({"type": "order"})) is orders
+    assert router.route(message_with({"type": "refund"})) is refunds
+
+
+def test_route_falls_back_to_default():
+    router = MessageRouter()
+    default = MagicMock()
+    router.add_route(MagicMock(), {"type": "order"})
+    router.add_route(default)
+
+    assert router.route(message_with({"type": "other"})) is default
+    assert router.route(message_with({})) is default
+
+
+def test_route_without_match_or_default():
+    router = MessageRouter()
+    router.add_route(MagicMock(), {"type": "order"})
+
+    assert router.route(message_with({"type": "other"})) is None
+
+
+def test_more_specific_route_wins():
+    router = MessageRouter()
+    orders, eu_orders = MagicMock(), MagicMock()
+    router.add_route(orders, {"type": "order"})
+    router.add_route(eu_orders, {"type": "order", "region": "eu"})
+
+    assert router.route(message_with({"type": "order", "region": "eu"})) is eu_orders
+    assert router.route(message_with({"type": "order", "region": "us"})) is orders
+
+
+def test_route_values_are_compared_as_strings():
+    router = MessageRouter()
+    version_two = MagicMock()
+    router.add_route(version_two, {"version": 2})
+
+    assert router.route(message_with({"version": "2"})) is version_two
+
+
+def test_duplicate_routes_raise():
+    router = MessageRouter()
+    router.add_route(MagicMock(), {"type": "order"})
+    router.add_route(MagicMock())
+
+    with pytest.raises(ValueError):
+        router.add_route(MagicMock(), {"type": "order"})
+    with pytest.raises(ValueError):
+        router.add_route(MagicMock())
@@ -0,0 +1,101 @@
+import pytest
+
+from python_publish_subscribe.src.StateStore import StateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(str(tmp_path / "state" / "sub.sqlite"), checkpoint_interval=60)
+    yield store
+    if not store._closed.is_set():
+        store.close()
+
+
+def test_get_set_delete(store):
+    # Given
+    store.set("count", 1)
+    store.set("totals", {"eu": 2})
+
+    # When
+    store.delete("count")
+
+    # Then
+    assert store.get("count") is None
+    assert store.get("count", 0) == 0
+    assert store.get("totals") == {"eu": 2}
+    assert "totals" in store
+    assert "count" not in store
+
+
+def test_writes_are_cached_until_checkpoint(store):
+    store.set("count", 1)
+    assert store._connection.execute("SELECT COUNT(*) FROM state").fetchone()[0] == 0
+
+    store.checkpoint()
+
+    assert store._connection.execute("SELECT value FROM state WHERE key = 'count'").fetchone()[0] == "1"
+    assert store.get("count") == 1
+
+
+def test_values_are_copied_when_set(store):
+    # Given
+    totals = {"eu": 2}
+    store.set("totals", totals)
+
+    # When
+    totals["eu"] = 3
+
+    # Then the store keeps the value it was set to, before and after a checkpoint
+    assert store.get("totals") == {"eu": 2}
+    store.checkpoint()
+    assert store.get("totals") == {"eu": 2}
+
+
+def test_values_that_arent_json_serialisable_are_rejected(store):
+    # Given
+    store.set("count", 1)
+
+    # When
+    with pytest.raises(TypeError):
+        store.set("bad", object())
+
+    # Then the other keys are still checkpointed
+    store.checkpoint()
+    assert "bad" not in store
+    assert store._connection.execute("SELECT COUNT(*) FROM state").fetchone()[0] == 1
+
+
+def test_checkpoint_is_compacted(tmp_path):
+    checkpoints = []
+    store = StateStore(str(tmp_path / "sub.sqlite"), on_checkpoint=checkpoints.append)
+    for count in range(100):
+        store.set("count", count)
+    store.set("old", True)
+    store.checkpoint()
+    store.delete("old")
+
+    store.close()
+
+    assert checkpoints == [{"count": 99, "old": True}, {"old": None}]
+
+
+def test_state_persists_after_close(tmp_path):
+    path = str(tmp_path / "sub.sqlite")
+    store = StateStore(path)
+    store.set("count", 5)
+    store.close()
+
+    reopened = StateStore(path)
+    assert reopened.get("count") == 5
+    assert reopened._connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    reopened.close()
+
+
+def test_checkpoints_periodically(tmp_path):
+    store = StateStore(str(tmp_path / "sub.sqlite"), checkpoint_interval=0.01)
+    store.set("count", 1)
+
+    store._closed.wait(0.2)
+
+    assert not store._dirty
+    store.close()
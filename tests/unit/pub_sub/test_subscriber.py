@@ -1,14 +1,19 @@
 import asyncio
 import inspect
+import signal
+import time
 import pytest
+from concurrent.futures import Future
 from unittest.mock import MagicMock, AsyncMock, patch
 
-from google.api_core.exceptions import AlreadyExists
+from google.api_core.exceptions import AlreadyExists, NotFound
 from google.pubsub_v1.types import Subscription
 from google.cloud.pubsub_v1.subscriber.message import Message
+from sqlalchemy.exc import IntegrityError
 
-from python_publish_subscribe.src.Subscriber import Subscriber, _handle_message
+from python_publish_subscribe.src.Subscriber import Subscriber, _handle_message, _handle_message_limited, _build_flow_control
 from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.OffloadedSession import OffloadedSession
 from python_publish_subscribe.config import Config
 
 pytest_plugins = ("pytest_asyncio",)
@@ -63,6 +68,58 @@ def test_add_subscription_registers_callback(app):
     assert entry["exactly_once_delivery"] is True
 
 
+def test_add_subscription_max_concurrency(app):
+    app.subscriber.add_subscription("s1", lambda msg: None, max_concurrency=5)
+    assert app.subscriber._subscriptions["s1"]["max_concurrency"] == 5
+
+
+def test_add_subscription_invalid_max_concurrency(app):
+    with pytest.raises(ValueError):
+        app.subscriber.add_subscription("s1", lambda msg: None, max_concurrency=0)
+
+
+def test_build_flow_control():
+    assert _build_flow_control({"max_concurrency": 3}).max_messages == 3
+    assert _build_flow_control({"callback": None}).max_messages == 1000
+
+
+def test_build_flow_control_lease_settings():
+    flow_control = _build_flow_control({
+        "max_lease_duration": 1800,
+        "min_lease_extension": 30,
+        "max_lease_extension": 120,
+    })
+    assert flow_control.max_lease_duration == 1800
+    assert flow_control.min_duration_per_lease_extension == 30
+    assert flow_control.max_duration_per_lease_extension == 120
+
+
+@pytest.mark.parametrize("settings", [
+    {"min_lease_extension": 5},
+    {"max_lease_extension": 601},
+    {"min_lease_extension": 60, "max_lease_extension": 30},
+])
+def test_add_subscription_invalid_lease_settings(app, settings):
+    with pytest.raises(ValueError):
+        app.subscriber.add_subscription("s1", lambda msg: None, **settings)
+
+
+@pytest.mark.asyncio
+async def test_handle_message_limited_bounds_concurrency(monkeypatch):
+    monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: False)
+    running = {"now": 0, "max": 0}
+
+    async def cb(msg):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+
+    limiter = asyncio.Semaphore(2)
+    await asyncio.gather(*[_handle_message_limited(MagicMock(attributes={}, message_id="1"), cb, limiter) for _ in range(10)])
+    assert running["max"] == 2
+
+
 def test_create_subscription_success(app, mock_subscriber_client, monkeypatch):
     name = "sub1"
     path = f"projects/test_project/subscriptions/{name}"
@@ -123,6 +180,15 @@ def test_create_subscription_already_exists(app, mock_subscriber_client, capfd,
     mock_subscriber_client.get_subscription.assert_called_once_with({"subscription": path})
 
 
+def test_subscription_exists(app, mock_subscriber_client):
+    path = "projects/test-project/subscriptions/sub"
+    mock_subscriber_client.get_subscription.side_effect = [MagicMock(spec=Subscription), NotFound("not found")]
+
+    assert app.subscriber.subscription_exists(path)
+    assert not app.subscriber.subscription_exists(path)
+    mock_subscriber_client.get_subscription.assert_called_with({"subscription": path})
+
+
 def test_create_subscription_error(app, mock_subscriber_client, capfd, monkeypatch):
     name = "sub3"
     path = f"projects/test_project/subscriptions/{name}"
@@ -199,15 +265,41 @@ async def test_handle_message_async_callback_false_raises(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_handle_message_async_with_sync_db_error(monkeypatch):
+async def test_handle_message_async_with_sync_db_offloads_session(monkeypatch):
+    # Given
+    sync_session = MagicMock()
+    received = []
+
     async def real_cb(message, session):
+        received.append(session)
+        await session.execute("SELECT 1")
         return True
 
     monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: True)
     monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    monkeypatch.setattr(DatabaseHelper, "create_session", lambda: sync_session)
 
-    with pytest.raises(RuntimeError):
-        await _handle_message(MagicMock(), real_cb)
+    # When
+    await _handle_message(MagicMock(), real_cb)
+
+    # Then
+    assert isinstance(received[0], OffloadedSession)
+    sync_session.execute.assert_called_once_with("SELECT 1")
+    sync_session.commit.assert_called_once()
+    sync_session.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_handle_message_sync_integrity_error_without_session_is_raised(monkeypatch):
+    # Given
+    def cb(msg):
+        raise IntegrityError("INSERT", {}, Exception("duplicate key"))
+
+    monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: False)
+
+    # When/Then the handler's error isn't hidden and the message is nacked
+    with pytest.raises(IntegrityError):
+        await _handle_message(MagicMock(), cb)
 
 
 @pytest.mark.asyncio
@@ -406,8 +498,8 @@ async def test_subscribe_to_subscription_exactly_once_success(app, mock_subscrib
 
     cb(msg)
 
-    ack_fut.ack.assert_called_once()
-    ack_fut.nack.assert_not_called()
+    msg.ack_with_response.assert_called_once()
+    ack_fut.add_done_callback.assert_called_once()
     msg.nack.assert_not_called()
 
 
@@ -440,8 +532,8 @@ async def test_subscribe_to_subscription_exactly_once_error(app, mock_subscriber
 
     out = capfd.readouterr().out
     assert "Error in handler:" in out
-    ack_fut.nack.assert_called_once()
-    ack_fut.ack.assert_not_called()
+    msg.nack.assert_called_once()
+    msg.ack_with_response.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -494,4 +586,582 @@ def test_publish_wrapper_success(app):
         assert result == 'mocked_response', "Expected the topic to be published"
         mock_publish.assert_called_once_with(
             "test-topic", "test-data", 20, "retry_option"
-        ), "Expected publish function to be called with correct arguments"
\ No newline at end of file
+        ), "Expected publish function to be called with correct arguments"
+
+def test_start_subscription_tasks_adds_signal_handlers(app, mock_loop):
+    app.subscriber._loop = mock_loop
+
+    app.subscriber.start_subscription_tasks()
+
+    handled = {call.args[0] for call in mock_loop.add_signal_handler.call_args_list}
+    assert handled == {signal.SIGTERM, signal.SIGINT, signal.SIGUSR1}
+    mock_loop.create_task.call_args[0][0].close()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_to_subscription_nacks_while_shutting_down(app, mock_subscriber_client, monkeypatch):
+    config = {'callback': MagicMock(), 'exactly_once_delivery': False}
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: "projects/p/subscriptions/s")
+    monkeypatch.setattr(asyncio, "wrap_future", lambda fut: (_ for _ in ()).throw(asyncio.CancelledError()))
+    run = MagicMock()
+    monkeypatch.setattr(asyncio, "run_coroutine_threadsafe", run)
+
+    await app.subscriber._subscribe_to_subscription("sub", config)
+    cb = mock_subscriber_client.subscribe.call_args[1]['callback']
+    app.subscriber._shutting_down = True
+
+    msg = MagicMock(spec=Message)
+    cb(msg)
+
+    msg.nack.assert_called_once()
+    run.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_in_flight_messages(app):
+    loop = asyncio.get_running_loop()
+    app.subscriber._loop = MagicMock()
+    order = []
+
+    async def handler():
+        await asyncio.sleep(0.01)
+        order.append("handled")
+
+    in_flight = asyncio.run_coroutine_threadsafe(handler(), loop)
+    app.subscriber._track_in_flight(in_flight)
+
+    streaming_pull_future = MagicMock()
+    streaming_pull_future.cancel.side_effect = lambda: order.append("cancelled")
+    app.subscriber._streaming_pull_futures["sub"] = streaming_pull_future
+
+    async def async_callback():
+        order.append("async_callback")
+    app.subscriber.add_shutdown_callback(async_callback)
+    app.subscriber.add_shutdown_callback(lambda: order.append("sync_callback"))
+
+    await app.subscriber.shutdown(timeout=1)
+
+    assert order == ["handled", "cancelled", "async_callback", "sync_callback"]
+    assert not app.subscriber._in_flight
+    streaming_pull_future.result.assert_called_once()
+    assert 0 < streaming_pull_future.result.call_args[0][0] <= 1
+    app.subscriber._loop.stop.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_gives_up_after_timeout(app, capfd):
+    app.subscriber._loop = MagicMock()
+    never_done = asyncio.run_coroutine_threadsafe(asyncio.sleep(10), asyncio.get_running_loop())
+    app.subscriber._track_in_flight(never_done)
+
+    await app.subscriber.shutdown(timeout=0.01)
+
+    assert "Warning: 1 messages were still being handled" in capfd.readouterr().out
+    never_done.cancel()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_timeout_is_a_deadline_for_every_step(app, monkeypatch):
+    # Given an in-flight message using up the whole timeout, and a subscription and publisher to close
+    app.subscriber._loop = MagicMock()
+    never_done = asyncio.run_coroutine_threadsafe(asyncio.sleep(10), asyncio.get_running_loop())
+    app.subscriber._track_in_flight(never_done)
+    streaming_pull_future = MagicMock()
+    app.subscriber._streaming_pull_futures["sub"] = streaming_pull_future
+    stop_timeouts = []
+    app.subscriber.add_shutdown_callback(lambda timeout: stop_timeouts.append(timeout))
+    app.subscriber.add_shutdown_callback(lambda: stop_timeouts.append("no timeout"))
+
+    # When
+    started = time.monotonic()
+    await app.subscriber.shutdown(timeout=0.05)
+
+    # Then the later steps only get what's left of the timeout
+    assert time.monotonic() - started < 0.5
+    assert streaming_pull_future.result.call_args[0][0] == 0
+    assert stop_timeouts == [0, "no timeout"]
+    never_done.cancel()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_subscription_and_background_tasks(app):
+    # Given
+    app.subscriber._loop = MagicMock()
+    subscription_task = asyncio.ensure_future(asyncio.sleep(10))
+    background_task = asyncio.ensure_future(asyncio.sleep(10))
+    app.subscriber._subscription_tasks["sub"] = subscription_task
+    app.subscriber._running_background_tasks.append(background_task)
+
+    # When
+    await app.subscriber.shutdown(timeout=0.01)
+
+    # Then
+    assert subscription_task.cancelled() and background_task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_timeout_from_env_string(app, capfd):
+    # Given values loaded from a .env file are strings
+    app.subscriber._config.set(Config.ConfigKeys.SHUTDOWN_TIMEOUT.name, "0.01")
+    app.subscriber._loop = MagicMock()
+    never_done = asyncio.run_coroutine_threadsafe(asyncio.sleep(10), asyncio.get_running_loop())
+    app.subscriber._track_in_flight(never_done)
+
+    # When
+    await app.subscriber.shutdown()
+
+    # Then
+    assert "Warning: 1 messages were still being handled" in capfd.readouterr().out
+    never_done.cancel()
+
+
+def test_create_subscription_with_dead_letter_and_retry_policy(app, mock_subscriber_client, monkeypatch):
+    monkeypatch.setattr(
+        "python_publish_subscribe.src.Subscriber.build_and_save_topic_string",
+        lambda t, p, c: ("projects/test-project/topics/topic", "topic"),
+    )
+    mock_subscriber_client.subscription_path.return_value = "projects/test-project/subscriptions/sub"
+
+    app.subscriber.create_subscription(
+        "sub", "topic", dead_letter_topic="dead-letters", max_delivery_attempts=10,
+        min_retry_backoff=10, max_retry_backoff=300,
+    )
+
+    request = mock_subscriber_client.create_subscription.call_args[1]
+    assert request["dead_letter_policy"].dead_letter_topic == "projects/test-project/topics/dead-letters"
+    assert request["dead_letter_policy"].max_delivery_attempts == 10
+    assert request["retry_policy"].minimum_backoff.total_seconds() == 10
+    assert request["retry_policy"].maximum_backoff.total_seconds() == 300
+
+
+def test_create_subscription_with_delivery_options(app, mock_subscriber_client, monkeypatch):
+    # Given
+    monkeypatch.setattr(
+        "python_publish_subscribe.src.Subscriber.build_and_save_topic_string",
+        lambda t, p, c: ("projects/test-project/topics/topic", "topic"),
+    )
+    mock_subscriber_client.subscription_path.return_value = "projects/test-project/subscriptions/sub"
+
+    # When
+    app.subscriber.create_subscription(
+        "sub", "topic", filter='attributes.type = "order"', ack_deadline=60, enable_message_ordering=True,
+        enable_exactly_once_delivery=True, message_retention_duration=86400, retain_acked_messages=True,
+        expiration_ttl=0,
+    )
+
+    # Then
+    request = mock_subscriber_client.create_subscription.call_args[1]
+    assert request["filter"] == 'attributes.type = "order"'
+    assert request["ack_deadline_seconds"] == 60
+    assert request["enable_message_ordering"] is True
+    assert request["enable_exactly_once_delivery"] is True
+    assert request["message_retention_duration"].total_seconds() == 86400
+    assert request["retain_acked_messages"] is True
+    assert "ttl" not in request["expiration_policy"], "A policy without a ttl never expires"
+
+
+def test_create_subscription_with_expiration(app, mock_subscriber_client, monkeypatch):
+    monkeypatch.setattr(
+        "python_publish_subscribe.src.Subscriber.build_and_save_topic_string",
+        lambda t, p, c: ("projects/test-project/topics/topic", "topic"),
+    )
+    mock_subscriber_client.subscription_path.return_value = "projects/test-project/subscriptions/sub"
+
+    app.subscriber.create_subscription("sub", "topic", expiration_ttl=86400)
+
+    request = mock_subscriber_client.create_subscription.call_args[1]
+    assert request["expiration_policy"].ttl.total_seconds() == 86400
+    assert "filter" not in request
+
+
+def test_create_subscription_existing_with_other_filter(app, mock_subscriber_client, capfd, monkeypatch):
+    # Given
+    monkeypatch.setattr(
+        "python_publish_subscribe.src.Subscriber.build_and_save_topic_string",
+        lambda t, p, c: ("projects/test-project/topics/topic", "topic"),
+    )
+    mock_subscriber_client.subscription_path.return_value = "projects/test-project/subscriptions/sub"
+    mock_subscriber_client.create_subscription.side_effect = AlreadyExists("exists")
+    mock_subscriber_client.get_subscription.return_value = Subscription(filter='attributes.type = "refund"')
+
+    # When
+    app.subscriber.create_subscription("sub", "topic", filter='attributes.type = "order"')
+
+    # Then
+    assert "Warning: Subscription sub has the filter 'attributes.type = \"refund\"' instead of " \
+           "'attributes.type = \"order\"'" in capfd.readouterr().out
+
+
+def test_nack_without_backoff_nacks_straight_away(app):
+    msg = MagicMock(spec=Message)
+
+    app.subscriber._nack(msg, {"callback": None})
+
+    msg.nack.assert_called_once()
+    msg.modify_ack_deadline.assert_not_called()
+
+
+def test_nack_with_backoff_uses_delivery_attempt(app):
+    msg = MagicMock(spec=Message)
+    msg.delivery_attempt = 4
+
+    app.subscriber._nack(msg, {"min_retry_backoff": 10, "max_retry_backoff": 60})
+
+    msg.modify_ack_deadline.assert_called_once_with(60)
+    msg.drop.assert_called_once()
+    msg.nack.assert_not_called()
+
+
+def test_nack_with_backoff_counts_attempts_locally(app):
+    config = {"min_retry_backoff": 10}
+    deadlines = []
+    for _ in range(3):
+        msg = MagicMock(spec=Message)
+        msg.delivery_attempt = None
+        msg.message_id = "message-1"
+        app.subscriber._nack(msg, config)
+        deadlines.append(msg.modify_ack_deadline.call_args[0][0])
+
+    assert deadlines == [10, 20, 40]
+
+    app.subscriber._ack(msg)
+    assert "message-1" not in app.subscriber._retry_attempts
+
+
+def test_nack_with_sub_second_backoff_waits_at_least_a_second(app):
+    msg = MagicMock(spec=Message)
+    msg.delivery_attempt = 1
+
+    app.subscriber._nack(msg, {"min_retry_backoff": 0.5})
+
+    msg.modify_ack_deadline.assert_called_once_with(1)
+    msg.nack.assert_not_called()
+
+
+def received_message(message_id="1", attributes=None):
+    msg = MagicMock(spec=Message)
+    msg.message_id = message_id
+    msg.attributes = attributes or {}
+    return msg
+
+
+def handled_with(exception):
+    def fake_run(coro, loop):
+        coro.close()
+
+        class Dummy:
+            def add_done_callback(self, cb):
+                class F:
+                    def exception(self): return exception
+                cb(F())
+        return Dummy()
+    return fake_run
+
+
+@pytest.mark.asyncio
+async def test_exactly_once_failure_uses_retry_backoff(app, mock_subscriber_client, monkeypatch):
+    # Given
+    config = {'callback': MagicMock(), 'exactly_once_delivery': True, 'min_retry_backoff': 10}
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: "projects/p/subscriptions/sub")
+    monkeypatch.setattr(asyncio, "wrap_future", lambda fut: (_ for _ in ()).throw(asyncio.CancelledError()))
+    monkeypatch.setattr(asyncio, "run_coroutine_threadsafe", handled_with(ValueError("boom")))
+    await app.subscriber._subscribe_to_subscription("sub", config)
+    cb = mock_subscriber_client.subscribe.call_args[1]['callback']
+    msg = MagicMock(spec=Message)
+    msg.delivery_attempt = 2
+
+    # When
+    cb(msg)
+
+    # Then the message isn't acked before it's handled, and is redelivered after the backoff
+    msg.ack_with_response.assert_not_called()
+    msg.modify_ack_deadline.assert_called_once_with(20)
+    msg.drop.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_exactly_once_success_confirms_ack(app, mock_subscriber_client, monkeypatch, capfd):
+    # Given
+    config = {'callback': MagicMock(), 'exactly_once_delivery': True}
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: "projects/p/subscriptions/sub")
+    monkeypatch.setattr(asyncio, "wrap_future", lambda fut: (_ for _ in ()).throw(asyncio.CancelledError()))
+    monkeypatch.setattr(asyncio, "run_coroutine_threadsafe", handled_with(None))
+    await app.subscriber._subscribe_to_subscription("sub", config)
+    cb = mock_subscriber_client.subscribe.call_args[1]['callback']
+    msg = MagicMock(spec=Message)
+    msg.message_id = "message-1"
+    ack_future = Future()
+    msg.ack_with_response.return_value = ack_future
+
+    # When
+    cb(msg)
+    ack_future.set_exception(RuntimeError("ack failed"))
+
+    # Then
+    msg.ack_with_response.assert_called_once()
+    msg.ack.assert_not_called()
+    assert "Warning: Ack of message" in capfd.readouterr().out
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("options", [{"database": "missing"}, {"ledger": True}])
+async def test_subscription_that_cant_start_stops_the_subscriber(app, mock_subscriber_client, monkeypatch, capfd, options):
+    # Given
+    app.subscriber.add_subscription("sub", lambda message: None, **options)
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: "projects/p/subscriptions/sub")
+    shutdown = AsyncMock()
+    monkeypatch.setattr(app.subscriber, "shutdown", shutdown)
+
+    # When
+    await app.subscriber._subscribe_to_subscription("sub", app.subscriber._subscriptions["sub"])
+    await asyncio.sleep(0)
+
+    # Then
+    assert "Error: Unable to start subscription sub, stopping the subscriber" in capfd.readouterr().out
+    shutdown.assert_awaited_once()
+    mock_subscriber_client.assert_not_called()
+
+
+def test_add_subscription_invalid_retry_backoff(app):
+    with pytest.raises(ValueError):
+        app.subscriber.add_subscription("s1", lambda msg: None, min_retry_backoff=10, max_retry_backoff=601)
+
+
+def test_add_subscription_with_routes(app):
+    orders, default = MagicMock(), MagicMock()
+    app.subscriber.add_subscription("s1", orders, when={"type": "order"}, max_concurrency=2)
+    app.subscriber.add_subscription("s1", default, min_retry_backoff=10)
+
+    entry = app.subscriber._subscriptions["s1"]
+    assert entry["callback"] is default
+    assert entry["max_concurrency"] == 2
+    assert entry["min_retry_backoff"] == 10
+    order = MagicMock(attributes={"type": "order"})
+    assert entry["router"].route(order) is orders
+    assert entry["router"].route(MagicMock(attributes={})) is default
+
+
+def test_add_subscription_route_keeps_existing_callback_as_default(app):
+    default, orders = MagicMock(), MagicMock()
+    app.subscriber.add_subscription("s1", default)
+    app.subscriber.add_subscription("s1", orders, when={"type": "order"})
+
+    router = app.subscriber._subscriptions["s1"]["router"]
+    assert router.route(MagicMock(attributes={"type": "order"})) is orders
+    assert router.route(MagicMock(attributes={"type": "refund"})) is default
+
+
+@pytest.mark.asyncio
+async def test_subscribe_to_subscription_routes_messages(app, mock_subscriber_client, monkeypatch, capfd):
+    orders = MagicMock()
+    app.subscriber.add_subscription("sub", orders, when={"type": "order"})
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: "projects/p/subscriptions/sub")
+    monkeypatch.setattr(asyncio, "wrap_future", lambda fut: (_ for _ in ()).throw(asyncio.CancelledError()))
+    handled = []
+
+    def fake_run(coro, loop):
+        handled.append(coro.cr_frame.f_locals["callback"])
+        coro.close()
+        return MagicMock()
+    monkeypatch.setattr(asyncio, "run_coroutine_threadsafe", fake_run)
+
+    await app.subscriber._subscribe_to_subscription("sub", app.subscriber._subscriptions["sub"])
+    cb = mock_subscriber_client.subscribe.call_args[1]['callback']
+
+    cb(MagicMock(spec=Message, attributes={"type": "order"}))
+    unmatched = MagicMock(spec=Message, attributes={"type": "refund"}, message_id="1")
+    cb(unmatched)
+
+    assert handled == [orders]
+    unmatched.ack.assert_called_once()
+    assert "Warning: No handler matches message 1 on sub" in capfd.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_subscribe_to_subscription_ordered_by_attribute(app, mock_subscriber_client, monkeypatch):
+    app.subscriber.add_subscription("sub", MagicMock(), ordered=True, ordering_attribute="customer")
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: "projects/p/subscriptions/sub")
+    monkeypatch.setattr(asyncio, "wrap_future", lambda fut: (_ for _ in ()).throw(asyncio.CancelledError()))
+    scheduled = []
+
+    def fake_run(coro, loop):
+        scheduled.append(coro)
+        return MagicMock()
+    monkeypatch.setattr(asyncio, "run_coroutine_threadsafe", fake_run)
+
+    await app.subscriber._subscribe_to_subscription("sub", app.subscriber._subscriptions["sub"])
+    cb = mock_subscriber_client.subscribe.call_args[1]['callback']
+    cb(MagicMock(spec=Message, attributes={"customer": "42"}))
+
+    assert scheduled[0].cr_code.co_name == "_run_after"
+    assert scheduled[0].cr_frame.f_locals["key"] == "42"
+    scheduled[0].cr_frame.f_locals["awaitable"].close()
+    scheduled[0].close()
+
+
+@pytest.mark.asyncio
+async def test_handle_message_injects_state(monkeypatch):
+    monkeypatch.setattr(DatabaseHelper, "is_setup", lambda: False)
+    state = MagicMock()
+    calls = []
+
+    def sync_cb(msg, state):
+        calls.append(state)
+
+    async def async_cb(msg, state):
+        calls.append(state)
+
+    await _handle_message(MagicMock(), sync_cb, state)
+    await _handle_message(MagicMock(), async_cb, state)
+
+    assert calls == [state, state]
+
+
+def test_get_state_store(app, tmp_path):
+    app.config.set("STATE_STORE_PATH", str(tmp_path))
+
+    store = app.subscriber.get_state_store("projects/p/subscriptions/sub")
+
+    assert app.subscriber.get_state_store("projects/p/subscriptions/sub") is store
+    assert (tmp_path / "sub.sqlite").exists()
+    store.close()
+
+
+def test_get_state_store_with_checkpoint_callback(app, tmp_path):
+    # Given
+    app.config.set("STATE_STORE_PATH", str(tmp_path))
+    checkpoints = []
+    store = app.subscriber.get_state_store("sub", on_checkpoint=checkpoints.append)
+
+    # When
+    store.set("count", 1)
+    store.set("count", 2)
+    store.close()
+
+    # Then
+    assert checkpoints == [{"count": 2}]
+
+
+class FakeStreamingPullFuture(Future):
+    """
+    Like StreamingPullFuture, resolves with None once cancelled.
+    """
+    def cancel(self):
+        if not self.done():
+            self.set_result(None)
+        return True
+
+
+async def _wait_for(condition, timeout=1.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition() and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+    return condition()
+
+
+@pytest.mark.asyncio
+async def test_start_and_stop_subscription_at_runtime(app, mock_subscriber_client, monkeypatch):
+    # Given
+    loop = asyncio.get_running_loop()
+    app.subscriber._loop = loop
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: name)
+    streaming_pull_future = FakeStreamingPullFuture()
+    mock_subscriber_client.subscribe.return_value = streaming_pull_future
+
+    async def cb(message):
+        pass
+
+    # When
+    app.subscriber.start_subscription("orders", cb, max_concurrency=5)
+    assert await _wait_for(lambda: "orders" in app.subscriber._streaming_pull_futures)
+    callback = mock_subscriber_client.subscribe.call_args[1]["callback"]
+    msg = received_message()
+    await loop.run_in_executor(None, callback, msg)
+    assert await _wait_for(lambda: msg.ack.called)
+    stopped = await app.subscriber.stop_subscription("orders", timeout=1)
+
+    # Then
+    assert stopped
+    assert streaming_pull_future.done()
+    assert "orders" not in app.subscriber._streaming_pull_futures
+    assert "orders" not in app.subscriber._subscription_tasks
+    assert "orders" in app.subscriber._subscriptions
+    assert not await app.subscriber.stop_subscription("orders")
+
+
+@pytest.mark.asyncio
+async def test_pause_holds_messages_until_resumed(app, mock_subscriber_client, monkeypatch):
+    # Given
+    loop = asyncio.get_running_loop()
+    app.subscriber._loop = loop
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: name)
+    mock_subscriber_client.subscribe.return_value = FakeStreamingPullFuture()
+
+    async def cb(message):
+        pass
+
+    app.subscriber.add_subscription("orders", cb)
+    app.subscriber._start_subscription_task("orders")
+    assert await _wait_for(lambda: "orders" in app.subscriber._streaming_pull_futures)
+    callback = mock_subscriber_client.subscribe.call_args[1]["callback"]
+    msg = received_message()
+
+    # When
+    assert app.subscriber.pause("orders")
+    delivered = loop.run_in_executor(None, callback, msg)
+    await asyncio.sleep(0.05)
+    held = not msg.ack.called and not delivered.done()
+    assert app.subscriber.resume("orders")
+    await delivered
+
+    # Then
+    assert held
+    assert await _wait_for(lambda: msg.ack.called)
+    await app.subscriber.stop_subscription("orders", timeout=1)
+
+
+def test_pause_unknown_subscription(app, capfd):
+    assert not app.subscriber.pause("missing")
+    assert "Warning: Subscription missing isn't running" in capfd.readouterr().out
+
+
+def test_add_subscription_adaptive_concurrency(app):
+    app.subscriber.add_subscription("s1", lambda msg: None, max_concurrency=50, adaptive_concurrency=True)
+    assert app.subscriber._subscriptions["s1"]["adaptive_concurrency"] is True
+
+
+def test_create_snapshot(app, mock_subscriber_client, monkeypatch):
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: f"projects/p/subscriptions/{name}")
+    mock_subscriber_client.snapshot_path.return_value = "projects/p/snapshots/before-deploy"
+
+    app.subscriber.create_snapshot("before-deploy", "orders")
+
+    mock_subscriber_client.create_snapshot.assert_called_once_with(
+        name="projects/p/snapshots/before-deploy", subscription="projects/p/subscriptions/orders"
+    )
+
+
+def test_seek_to_time_and_snapshot(app, mock_subscriber_client, monkeypatch):
+    from datetime import datetime, timezone
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: f"projects/p/subscriptions/{name}")
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    assert app.subscriber.seek("orders", time=since)
+    assert app.subscriber.seek("orders", snapshot="projects/p/snapshots/before-deploy")
+
+    requests = [call.kwargs["request"] for call in mock_subscriber_client.seek.call_args_list]
+    assert requests == [
+        {"subscription": "projects/p/subscriptions/orders", "time": since},
+        {"subscription": "projects/p/subscriptions/orders", "snapshot": "projects/p/snapshots/before-deploy"},
+    ]
+    with pytest.raises(ValueError):
+        app.subscriber.seek("orders")
+
+
+def test_seek_error(app, mock_subscriber_client, monkeypatch, capfd):
+    monkeypatch.setattr(app.subscriber, "get_subscription_path", lambda name: name)
+    mock_subscriber_client.seek.side_effect = ValueError("boom")
+
+    assert not app.subscriber.seek("orders", snapshot="projects/p/snapshots/s")
+    assert "Error: Something went wrong when seeking orders: boom" in capfd.readouterr().out
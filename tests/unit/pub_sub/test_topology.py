@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+from python_publish_subscribe.config import Config
+from python_publish_subscribe.src.Topology import Topology
+
+
+def make_topology(tmp_path, **config):
+    publisher = MagicMock()
+    publisher.create_topic.return_value = True
+    subscriber = MagicMock()
+    subscriber.create_subscription.return_value = MagicMock()
+    config = Config({'PROJECT_ID': 'test-project', 'TOPOLOGY_CACHE_PATH': str(tmp_path / 'topology.json'), **config})
+    return Topology(publisher, subscriber, config), publisher, subscriber
+
+
+def test_provision_creates_topics_then_subscriptions(tmp_path):
+    # Given
+    topology, publisher, subscriber = make_topology(tmp_path)
+    order = []
+    publisher.create_topic.side_effect = lambda topic: order.append(topic) or True
+    subscriber.create_subscription.side_effect = lambda name, topic, **options: order.append(name) or MagicMock()
+    topology.add_topic("orders")
+    topology.add_subscription("orders-sub", "orders", filter='attributes.type = "order"')
+
+    # When
+    provisioned = topology.provision()
+
+    # Then
+    assert provisioned
+    assert order == ["orders", "orders-sub"]
+    subscriber.create_subscription.assert_called_once_with("orders-sub", "orders", filter='attributes.type = "order"')
+
+
+def test_provision_skips_cached_resources(tmp_path):
+    # Given
+    topology, _, _ = make_topology(tmp_path)
+    topology.add_topic("orders")
+    topology.add_subscription("orders-sub", "orders")
+    topology.provision()
+
+    restarted, publisher, subscriber = make_topology(tmp_path)
+    restarted.add_topic("orders")
+    restarted.add_subscription("orders-sub", "orders")
+
+    # When
+    provisioned = restarted.provision()
+
+    # Then
+    assert provisioned
+    publisher.topic_exists.assert_called_once_with("orders")
+    subscriber.subscription_exists.assert_called_once_with("orders-sub")
+    publisher.create_topic.assert_not_called()
+    subscriber.create_subscription.assert_not_called()
+    assert set(json.loads((tmp_path / 'topology.json').read_text())) == {'test-project'}
+
+
+def test_provision_recreates_cached_resources_that_were_deleted(tmp_path, capfd):
+    # Given
+    topology, _, _ = make_topology(tmp_path)
+    topology.add_topic("orders")
+    topology.add_subscription("orders-sub", "orders", expiration_ttl=86400)
+    topology.provision()
+
+    restarted, publisher, subscriber = make_topology(tmp_path)
+    restarted.add_topic("orders")
+    restarted.add_subscription("orders-sub", "orders", expiration_ttl=86400)
+    publisher.topic_exists.return_value = True
+    subscriber.subscription_exists.return_value = False
+
+    # When the subscription expired since it was cached
+    provisioned = restarted.provision()
+
+    # Then
+    assert provisioned
+    publisher.create_topic.assert_not_called()
+    subscriber.create_subscription.assert_called_once_with("orders-sub", "orders", expiration_ttl=86400)
+    assert "Warning: Subscription orders-sub was deleted" in capfd.readouterr().out
+
+
+def test_provision_trusts_the_cache_if_a_resource_cant_be_checked(tmp_path, capfd):
+    topology, _, _ = make_topology(tmp_path)
+    topology.add_topic("orders")
+    topology.provision()
+
+    restarted, publisher, _ = make_topology(tmp_path)
+    restarted.add_topic("orders")
+    publisher.topic_exists.side_effect = RuntimeError("unavailable")
+
+    assert restarted.provision()
+    publisher.create_topic.assert_not_called()
+    assert "Warning: Unable to check if orders exists" in capfd.readouterr().out
+
+
+def test_provision_recreates_changed_or_other_project_resources(tmp_path):
+    topology, _, _ = make_topology(tmp_path)
+    topology.add_subscription("orders-sub", "orders")
+    topology.provision()
+
+    changed, _, subscriber = make_topology(tmp_path)
+    changed.add_subscription("orders-sub", "orders", ack_deadline=60)
+    changed.provision()
+    subscriber.create_subscription.assert_called_once_with("orders-sub", "orders", ack_deadline=60)
+
+    other_project, _, subscriber = make_topology(tmp_path, PROJECT_ID='other-project')
+    other_project.add_subscription("orders-sub", "orders", ack_deadline=60)
+    other_project.provision()
+    subscriber.create_subscription.assert_called_once()
+
+
+def test_provision_does_not_cache_failures(tmp_path):
+    # Given
+    topology, publisher, subscriber = make_topology(tmp_path)
+    publisher.create_topic.return_value = False
+    subscriber.create_subscription.return_value = None
+    topology.add_topic("orders")
+    topology.add_subscription("orders-sub", "orders")
+
+    # When
+    provisioned = topology.provision()
+
+    # Then
+    assert not provisioned
+    assert json.loads((tmp_path / 'topology.json').read_text()) == {
+        'test-project': {'topics': {}, 'subscriptions': {}}
+    }
+
+
+def test_provision_is_concurrent_and_bounded(tmp_path):
+    # Given
+    topology, _, subscriber = make_topology(tmp_path, TOPOLOGY_MAX_WORKERS=4)
+    lock = threading.Lock()
+    running = [0]
+    most_running = [0]
+
+    def create_subscription(name, topic, **options):
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return MagicMock()
+
+    subscriber.create_subscription.side_effect = create_subscription
+    for index in range(12):
+        topology.add_subscription(f"sub-{index}", "topic")
+
+    # When
+    started = time.monotonic()
+    topology.provision()
+
+    # Then
+    assert subscriber.create_subscription.call_count == 12
+    assert most_running[0] == 4
+    assert time.monotonic() - started < 0.5
+
+
+def test_provision_with_max_workers_from_env_string(tmp_path):
+    # Given values loaded from a .env file are strings
+    topology, publisher, _ = make_topology(tmp_path, TOPOLOGY_MAX_WORKERS="8")
+    topology.add_topic("orders")
+
+    # When
+    provisioned = topology.provision()
+
+    # Then
+    assert provisioned
+    publisher.create_topic.assert_called_once_with("orders")
+
+
+def test_provision_ignores_an_unreadable_cache(tmp_path, capfd):
+    (tmp_path / 'topology.json').write_text("{not json")
+    topology, publisher, _ = make_topology(tmp_path)
+    topology.add_topic("orders")
+
+    assert topology.provision()
+    publisher.create_topic.assert_called_once_with("orders")
+    assert "Warning: Unable to read the topology cache" in capfd.readouterr().out
+
+
+def test_app_run_provisions_declared_topology(app):
+    # Given
+    app.topology = MagicMock()
+    app.subscriber = MagicMock()
+
+    # When
+    app.run()
+
+    # Then
+    app.topology.provision.assert_called_once()
+    app.subscriber.start_subscription_tasks.assert_called_once()
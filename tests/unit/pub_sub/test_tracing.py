@@ -0,0 +1,93 @@
+from unittest.mock import MagicMock
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from python_publish_subscribe.src import Tracing
+from python_publish_subscribe.src.Subscriber import _handle_message_limited
+from python_publish_subscribe.src.Tracing import get_trace_context
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(Tracing, "_tracer", provider.get_tracer("test"))
+    return exporter
+
+
+def traced_message():
+    message = MagicMock()
+    message.attributes = {"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"}
+    message.message_id = "1"
+    return message
+
+
+@pytest.mark.asyncio
+async def test_async_handler_runs_in_consumer_span(exporter):
+    # Given
+    seen = {}
+
+    async def cb(message):
+        seen.update(get_trace_context())
+
+    # When
+    await _handle_message_limited(traced_message(), cb, subscription_name="orders")
+
+    # Then
+    span = exporter.get_finished_spans()[0]
+    assert span.name == "orders process"
+    assert format(span.context.trace_id, "032x") == TRACE_ID
+    assert format(span.parent.span_id, "016x") == PARENT_ID
+    assert seen["traceparent"] == f"00-{TRACE_ID}-{format(span.context.span_id, '016x')}-01"
+
+
+@pytest.mark.asyncio
+async def test_sync_handler_keeps_trace_context_in_executor(exporter):
+    seen = {}
+
+    def cb(message):
+        seen.update(get_trace_context())
+
+    await _handle_message_limited(traced_message(), cb, subscription_name="orders")
+
+    assert seen["traceparent"].split("-")[1] == TRACE_ID
+
+
+def test_publish_injects_trace_context(app, mock_publisher_client, exporter):
+    # Given
+    with Tracing._tracer.start_as_current_span("parent"):
+        # When
+        app.publisher.publish("projects/p/topics/t", "data", attributes={"a": "b"})
+
+    # Then
+    kwargs = mock_publisher_client.publish.call_args.kwargs
+    assert kwargs["a"] == "b"
+    assert kwargs["traceparent"].split("-")[1] == format(exporter.get_finished_spans()[-1].context.trace_id, "032x")
+    assert [span.name for span in exporter.get_finished_spans()] == ["t publish", "parent"]
+
+
+@pytest.mark.asyncio
+async def test_trace_context_propagated_without_opentelemetry(monkeypatch):
+    # Given
+    monkeypatch.setattr(Tracing, "_tracer", None)
+    monkeypatch.setattr(Tracing, "propagate", None)
+    seen = {}
+
+    async def cb(message):
+        seen.update(get_trace_context())
+
+    # When
+    await _handle_message_limited(traced_message(), cb, subscription_name="orders")
+
+    # Then
+    _, trace_id, span_id, flags = seen["traceparent"].split("-")
+    assert (trace_id, flags) == (TRACE_ID, "01")
+    assert span_id != PARENT_ID
+    assert get_trace_context() == {}
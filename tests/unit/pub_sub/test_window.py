@@ -0,0 +1,219 @@
+import asyncio
+import gc
+import json
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from python_publish_subscribe.src.Window import TumblingWindow, SlidingWindow, SessionWindow, _WindowState
+from python_publish_subscribe.src.db.DatabaseHelper import DatabaseHelper
+from python_publish_subscribe.src.db.Sharding import ShardRouter
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+def published_future():
+    future = Future()
+    future.set_result("message-id")
+    return future
+
+
+def test_tumbling_window_assign():
+    assert TumblingWindow(60).assign(125) == [(120, 180)]
+
+
+def test_sliding_window_assign():
+    assert SlidingWindow(30, 10).assign(125) == [(120, 150), (110, 140), (100, 130)]
+
+
+@pytest.mark.parametrize("window", [
+    lambda: TumblingWindow(0),
+    lambda: SlidingWindow(10, 20),
+    lambda: SessionWindow(-1),
+])
+def test_invalid_windows(window):
+    with pytest.raises(ValueError):
+        window()
+
+
+def test_window_requires_emit_target(app):
+    with pytest.raises(ValueError):
+        app.window("sub", TumblingWindow(60))
+
+
+def test_window_rejects_max_concurrency(app):
+    with pytest.raises(ValueError, match="max_in_flight"):
+        app.window("sub", TumblingWindow(60), emit_topic="counts", max_concurrency=10)
+
+
+def test_window_registers_subscription(app):
+    with patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+        aggregator = app.window("sub", TumblingWindow(60), emit_topic="counts", max_in_flight=50)
+
+    mock_add_subscription.assert_called_once_with("sub", aggregator._handle, max_concurrency=50, max_lease_duration=3600)
+    assert aggregator.stop in app.subscriber._shutdown_callbacks
+
+
+def test_window_leases_cover_the_window(app):
+    with patch.object(app.subscriber, "add_subscription") as mock_add_subscription:
+        app.window("sub", TumblingWindow(7200), emit_topic="counts")
+        app.window("sessions", SessionWindow(60), emit_topic="counts", max_lease_duration=600)
+
+    assert mock_add_subscription.call_args_list[0].kwargs["max_lease_duration"] == 7260
+    assert mock_add_subscription.call_args_list[1].kwargs["max_lease_duration"] == 600
+
+
+def test_window_rejects_leases_shorter_than_the_window(app):
+    with pytest.raises(ValueError, match="max_lease_duration"):
+        app.window("sub", SlidingWindow(3600, 60), emit_topic="counts", max_lease_duration=3600)
+
+
+@pytest.mark.asyncio
+async def test_tumbling_window_acks_after_emit(app, monkeypatch, make_message):
+    # Given
+    aggregator = app.window("sub", TumblingWindow(60), key=lambda data: data["type"], value=lambda data: data["amount"], emit_topic="totals")
+    aggregator._timer = MagicMock()
+    monkeypatch.setattr("python_publish_subscribe.src.Window.time.time", lambda: 125)
+
+    handling = [
+        asyncio.ensure_future(aggregator._handle(make_message(data=json.dumps({"type": "order", "amount": amount}).encode('utf-8'))))
+        for amount in (5, 10)
+    ]
+    await asyncio.sleep(0)
+    assert not any(task.done() for task in handling), "Messages shouldn't be acked before the window closes"
+
+    # When
+    with patch.object(app.publisher, "publish", return_value=published_future()) as mock_publish:
+        await aggregator.close_windows(179)
+        assert not any(task.done() for task in handling)
+        await aggregator.close_windows(180)
+    await asyncio.gather(*handling)
+
+    # Then
+    topic, result = mock_publish.call_args[0]
+    assert topic == "totals"
+    assert result["key"] == "order"
+    assert (result["count"], result["sum"], result["min"], result["max"]) == (2, 15, 5, 10)
+    assert result["window_start"] == "1970-01-01T00:02:00+00:00"
+
+
+@pytest.mark.asyncio
+async def test_session_window_extends_while_active(app, monkeypatch, make_message):
+    aggregator = app.window("sub", SessionWindow(30), emit_topic="sessions")
+    aggregator._timer = MagicMock()
+    now = {"time": 100}
+    monkeypatch.setattr("python_publish_subscribe.src.Window.time.time", lambda: now["time"])
+
+    first = asyncio.ensure_future(aggregator._handle(make_message(data=b'"a"')))
+    await asyncio.sleep(0)
+    now["time"] = 120
+    second = asyncio.ensure_future(aggregator._handle(make_message(data=b'"b"')))
+    await asyncio.sleep(0)
+
+    with patch.object(app.publisher, "publish", return_value=published_future()) as mock_publish:
+        await aggregator.close_windows(140)
+        assert not first.done()
+        await aggregator.close_windows(150)
+    await asyncio.gather(first, second)
+
+    assert mock_publish.call_count == 1
+    assert mock_publish.call_args[0][1]["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_emit_fails_messages(app, monkeypatch, make_message):
+    aggregator = app.window("sub", TumblingWindow(60), emit_topic="counts")
+    aggregator._timer = MagicMock()
+    monkeypatch.setattr("python_publish_subscribe.src.Window.time.time", lambda: 0)
+    handling = asyncio.ensure_future(aggregator._handle(make_message(data=b'"a"')))
+    await asyncio.sleep(0)
+
+    with patch.object(app.publisher, "publish", side_effect=RuntimeError("publish failed")):
+        await aggregator.close_windows(60)
+
+    with pytest.raises(RuntimeError):
+        await handling
+
+
+@pytest.mark.asyncio
+async def test_failed_emit_without_waiting_messages_is_not_reported(app):
+    # Given a window whose messages are no longer waiting on it
+    loop = asyncio.get_running_loop()
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    aggregator = app.window("sub", TumblingWindow(60), emit_topic="counts")
+    aggregator._windows[(None, 0)] = _WindowState(None, 0, 60)
+
+    # When
+    with patch.object(app.publisher, "publish", side_effect=RuntimeError("publish failed")):
+        await aggregator.close_windows(60)
+    gc.collect()
+
+    # Then
+    loop.set_exception_handler(None)
+    assert not errors
+
+
+@pytest.mark.asyncio
+async def test_stop_cancels_the_timer(app, make_message):
+    aggregator = app.window("sub", TumblingWindow(60), emit_topic="counts")
+    handling = asyncio.ensure_future(aggregator._handle(make_message(data=b'"a"')))
+    await asyncio.sleep(0)
+    timer = aggregator._timer
+
+    await aggregator.stop()
+
+    assert timer.cancelled()
+    assert aggregator._timer is None
+    handling.cancel()
+
+
+@pytest.mark.asyncio
+async def test_window_saves_to_model(app, monkeypatch, make_message):
+    saved = []
+    session = MagicMock()
+    session.add.side_effect = saved.append
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    monkeypatch.setattr(DatabaseHelper, "create_session", lambda: session)
+    model = MagicMock(side_effect=lambda **result: result)
+
+    aggregator = app.window("sub", TumblingWindow(60), emit_model=model)
+    aggregator._timer = MagicMock()
+    monkeypatch.setattr("python_publish_subscribe.src.Window.time.time", lambda: 0)
+    handling = asyncio.ensure_future(aggregator._handle(make_message(data=b'"a"')))
+    await asyncio.sleep(0)
+
+    await aggregator.close_windows(60)
+    await handling
+
+    assert saved[0]["count"] == 1
+    session.commit.assert_called_once()
+    session.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_window_saves_to_named_database(app, monkeypatch, make_message):
+    # Given
+    sessions = {}
+    monkeypatch.setattr(DatabaseHelper, "is_async", lambda: False)
+    monkeypatch.setattr(DatabaseHelper, "create_session", lambda name=None: sessions.setdefault(name, MagicMock()))
+    with patch.object(app.subscriber, "add_subscription"):
+        aggregator = app.window("sub", TumblingWindow(60), emit_model=MagicMock(), database="analytics")
+    aggregator._timer = MagicMock()
+    monkeypatch.setattr("python_publish_subscribe.src.Window.time.time", lambda: 0)
+    handling = asyncio.ensure_future(aggregator._handle(make_message(data=b'"a"')))
+    await asyncio.sleep(0)
+
+    # When
+    await aggregator.close_windows(60)
+    await handling
+
+    # Then
+    assert list(sessions) == ["analytics"]
+    sessions["analytics"].commit.assert_called_once()
+
+
+def test_window_rejects_shard_router(app):
+    with pytest.raises(ValueError):
+        app.window("sub", TumblingWindow(60), emit_model=MagicMock(), database=ShardRouter(["a", "b"]))